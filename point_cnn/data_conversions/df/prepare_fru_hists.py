@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+"""Precompute per-frustum category histograms used by utils.fru_sampler."""
+
+# python3 prepare_fru_hists.py -i /ssd/Datasets/DataFountain/data_bin_fru \
+# -t /ssd/Datasets/DataFountain/train.txt -o /ssd/Datasets/DataFountain/train_hists.npy
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from utils import fru_sampler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir_bin', '-i', help='Path to binary files dir (*.npy)', required=True)
+    parser.add_argument('--filelist', '-t', help='Path to file list (.txt)', required=True)
+    parser.add_argument('--output', '-o', help='Path to save histograms (.npy)', required=True)
+    parser.add_argument('--num_class', '-c', help='Number of categories', type=int, default=8)
+    args = parser.parse_args()
+    print(args)
+
+    with open(args.filelist, 'r') as f:
+        filenames = [line.strip() for line in f.readlines()]
+
+    fru_hists = np.zeros((len(filenames), args.num_class), np.int64)
+    for i, filename in enumerate(filenames):
+        fru_data = np.load(os.path.join(args.dir_bin, filename + '.npy'))
+        fru_hists[i] = fru_sampler.compute_fru_hists([fru_data], args.num_class)[0]
+
+    np.save(args.output, fru_hists)
+    print('{} frustums, points per category: {}'.format(len(filenames), np.sum(fru_hists, axis=0)))
+
+
+if __name__ == '__main__':
+    main()
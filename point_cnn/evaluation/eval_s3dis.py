@@ -6,6 +6,9 @@ from __future__ import print_function
 
 import numpy as np
 import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import seg_metrics
 
 
 gt_label_filenames = []
@@ -28,9 +31,7 @@ print(num_room)
 print(len(pred_label_filenames))
 assert(num_room == len(pred_label_filenames))
 
-gt_classes = [0 for _ in range(13)]
-positive_classes = [0 for _ in range(13)]
-true_positive_classes = [0 for _ in range(13)]
+confusion = np.zeros((13, 13), dtype=np.int64)
 
 
 for i in range(num_room):
@@ -38,14 +39,11 @@ for i in range(num_room):
     print(pred_label_filenames[i])
     pred_label = np.loadtxt(pred_label_filenames[i])
     gt_label = np.load(gt_label_filenames[i])
-    for j in range(gt_label.shape[0]):
-        gt_l = int(gt_label[j])
-        pred_l = int(pred_label[j])
-        gt_classes[gt_l] += 1
-        positive_classes[pred_l] += 1
-        true_positive_classes[gt_l] += int(gt_l==pred_l)
-
+    confusion += seg_metrics.confusion_matrix(gt_label, pred_label, 13)
 
+gt_classes = confusion.sum(axis=1)
+positive_classes = confusion.sum(axis=0)
+true_positive_classes = np.diag(confusion)
 print(gt_classes)
 print(positive_classes)
 print(true_positive_classes)
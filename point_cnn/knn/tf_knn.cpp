@@ -2,7 +2,15 @@
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/shape_inference.h"
 #include "tensorflow/core/framework/common_shape_fns.h"
+#include "tensorflow/core/util/work_sharder.h"
+#include <cmath>
+#include <algorithm>
+#include <vector>
+#include <utility>
+#include <unordered_map>
+#if GOOGLE_CUDA
 #include <cuda_runtime.h>
+#endif
 //#include <iostream>
 
 using namespace tensorflow;
@@ -17,34 +25,472 @@ REGISTER_OP("MyKnn")
 .SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
 
     ::tensorflow::shape_inference::ShapeHandle dims1; // batch_size * queries_num * channels
-    c->WithRank(c->input(0), 3, &dims1);
+    TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 3, &dims1));
     ::tensorflow::shape_inference::ShapeHandle dims2; // batch_size * points_num * channels
-    c->WithRank(c->input(1), 3, &dims2);
+    TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 3, &dims2));
 
     int k;
     TF_RETURN_IF_ERROR(c->GetAttr("k", &k));
 
-    // batch_size * queries_num * points_num
-    ::tensorflow::shape_inference::ShapeHandle output_dis = c->MakeShape({c->Dim(dims1, 0),
-                                                                      c->Dim(dims1, 1),
-                                                                      c->Dim(dims2, 1)});
+    // batch_size * queries_num * k, distances of the k nearest points in ascending order
+    ::tensorflow::shape_inference::ShapeHandle output_dis = c->MakeShape({c->Dim(dims1, 0), c->Dim(dims1, 1), k});
     c->set_output(0, output_dis);
 
-    // batch_size * queries_num * k
+    // batch_size * queries_num * k * 2, (batch index, point index) pairs for tf.gather_nd
     ::tensorflow::shape_inference::ShapeHandle output_ids = c->MakeShape({c->Dim(dims1, 0),c->Dim(dims1, 1), k, 2});
     c->set_output(1, output_ids);
 
     return Status::OK();
 });
 
+// Brute force scan with a bounded max heap per query: O(P * C + P * log(k)) per query and O(k) memory,
+// the (N, Q, P) distance matrix is never materialized. Ties are broken by the smaller point index,
+// the order tf.nn.top_k gives on the dense distance matrix.
+void myknnCpu(int batch_size, int qrs_num, int pts_num, int channels_num,
+              const float *queries, const float *points, int k,
+              float *out_dis, int *out_ids, int64 start, int64 limit) {
+    typedef std::pair<float, int> DisId;
+    std::vector<DisId> heap;
+    heap.reserve(k);
+    for (int64 index = start; index < limit; index++) {
+        int batch_id = index / qrs_num;
+        const float *query = queries + index * channels_num;
+        const float *pts = points + (int64)batch_id * pts_num * channels_num;
+
+        heap.clear();
+        for (int pt_id = 0; pt_id < pts_num; pt_id++) {
+            const float *pt = pts + (int64)pt_id * channels_num;
+            float dis = 0;
+            for (int c = 0; c < channels_num; c++) {
+                float diff = query[c] - pt[c];
+                dis += diff * diff;
+            }
+            if ((int)heap.size() < k) {
+                heap.push_back(DisId(dis, pt_id));
+                std::push_heap(heap.begin(), heap.end());
+            } else if (DisId(dis, pt_id) < heap.front()) {
+                std::pop_heap(heap.begin(), heap.end());
+                heap.back() = DisId(dis, pt_id);
+                std::push_heap(heap.begin(), heap.end());
+            }
+        }
+
+        // ascending (distance, index) order
+        std::sort_heap(heap.begin(), heap.end());
+        for (int r = 0; r < k; r++) {
+            out_dis[index * k + r] = std::sqrt(heap[r].first);
+            out_ids[(index * k + r) * 2] = batch_id;
+            out_ids[(index * k + r) * 2 + 1] = heap[r].second;
+        }
+    }
+}
+
+class MyKnnCpuOp: public OpKernel{
+public:
+    explicit MyKnnCpuOp(OpKernelConstruction* context):OpKernel(context) {
+        OP_REQUIRES_OK(context, context->GetAttr("k", &k_));
+        OP_REQUIRES(context, k_ > 0, errors::InvalidArgument("KNN expects positive k"));
+    }
+    void Compute(OpKernelContext * context)override{
+        int k = k_;
+        const Tensor& queries_tensor=context->input(0);
+        OP_REQUIRES(context,queries_tensor.dims()==3, errors::InvalidArgument("KNN expects (batch_size,num_points,3) queries shape"));
+        int batch_size = queries_tensor.shape().dim_size(0);
+        int qrs_num = queries_tensor.shape().dim_size(1);
+        int channels_num = queries_tensor.shape().dim_size(2);
+        const float * queries=queries_tensor.flat<float>().data();
+
+        const Tensor& points_tensor=context->input(1);
+        OP_REQUIRES(context,points_tensor.dims()==3 && points_tensor.shape().dim_size(0)==batch_size
+                    && points_tensor.shape().dim_size(2)==channels_num,
+                    errors::InvalidArgument("KNN expects (batch_size,num_points,channels) points shape matching queries"));
+        int pts_num = points_tensor.shape().dim_size(1);
+        OP_REQUIRES(context, k <= pts_num, errors::InvalidArgument("KNN expects k <= num_points"));
+        const float * points=points_tensor.flat<float>().data();
+
+        Tensor * out_tensor_dis;
+        OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{batch_size, qrs_num, k},&out_tensor_dis));
+        float * out_dis=out_tensor_dis->flat<float>().data();
+
+        Tensor * out_tensor_ids;
+        OP_REQUIRES_OK(context,context->allocate_output(1,TensorShape{batch_size, qrs_num, k, 2},&out_tensor_ids));
+        int * out_ids=out_tensor_ids->flat<int>().data();
+
+        // one unit of work is one query, shard them over the intra op thread pool
+        auto worker_threads = context->device()->tensorflow_cpu_worker_threads();
+        int64 cost_per_query = (int64)pts_num * (channels_num + 2);
+        Shard(worker_threads->num_threads, worker_threads->workers, (int64)batch_size * qrs_num, cost_per_query,
+              [&](int64 start, int64 limit) {
+                  myknnCpu(batch_size, qrs_num, pts_num, channels_num, queries, points, k, out_dis, out_ids,
+                           start, limit);
+              });
+    }
+private:
+    int k_;
+};
+REGISTER_KERNEL_BUILDER(Name("MyKnn").Device(DEVICE_CPU),MyKnnCpuOp);
+
+REGISTER_OP("VoxelKnn")
+.Attr("k: int")
+.Attr("voxel_size: float = 0.0")
+.Input("queries: float32")
+.Input("points: float32")
+.Output("dis: float32")
+.Output("indices: int32")
+.SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+    ::tensorflow::shape_inference::ShapeHandle dims1; // batch_size * queries_num * 3
+    TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 3, &dims1));
+    ::tensorflow::shape_inference::ShapeHandle dims2; // batch_size * points_num * 3
+    TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 3, &dims2));
+    int k;
+    TF_RETURN_IF_ERROR(c->GetAttr("k", &k));
+    c->set_output(0, c->MakeShape({c->Dim(dims1, 0), c->Dim(dims1, 1), k}));
+    c->set_output(1, c->MakeShape({c->Dim(dims1, 0), c->Dim(dims1, 1), k, 2}));
+    return Status::OK();
+});
+
+REGISTER_OP("VoxelRadiusSearch")
+.Attr("radius: float")
+.Attr("max_nn: int")
+.Attr("voxel_size: float = 0.0")
+.Input("queries: float32")
+.Input("points: float32")
+.Output("indices: int32")
+.Output("counts: int32")
+.SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+    ::tensorflow::shape_inference::ShapeHandle dims1; // batch_size * queries_num * 3
+    TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 3, &dims1));
+    ::tensorflow::shape_inference::ShapeHandle dims2; // batch_size * points_num * 3
+    TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 3, &dims2));
+    int max_nn;
+    TF_RETURN_IF_ERROR(c->GetAttr("max_nn", &max_nn));
+    c->set_output(0, c->MakeShape({c->Dim(dims1, 0), c->Dim(dims1, 1), max_nn, 2}));
+    c->set_output(1, c->MakeShape({c->Dim(dims1, 0), c->Dim(dims1, 1)}));
+    return Status::OK();
+});
+
+// Hash grid of one cloud: the points sorted by voxel, and the (start, count) of every occupied voxel.
+struct VoxelGrid {
+    float voxel_size;
+    float origin[3];
+    int64 dims[3];
+    std::vector<int> order;
+    std::unordered_map<int64, std::pair<int, int> > cells;
+};
+
+void buildVoxelGrid(const float *pts, int pts_num, float voxel_size, VoxelGrid *grid) {
+    float pts_min[3] = {pts[0], pts[1], pts[2]};
+    float pts_max[3] = {pts[0], pts[1], pts[2]};
+    for (int i = 1; i < pts_num; i++) {
+        for (int a = 0; a < 3; a++) {
+            pts_min[a] = std::min(pts_min[a], pts[i * 3 + a]);
+            pts_max[a] = std::max(pts_max[a], pts[i * 3 + a]);
+        }
+    }
+    float extent_max = std::max(pts_max[0] - pts_min[0], std::max(pts_max[1] - pts_min[1], pts_max[2] - pts_min[2]));
+    // at most 2^20 voxels per axis, so that a voxel key fits in an int64
+    voxel_size = std::max(voxel_size, std::max(extent_max / (1 << 20), 1e-6f));
+    grid->voxel_size = voxel_size;
+    for (int a = 0; a < 3; a++) {
+        grid->origin[a] = pts_min[a];
+        grid->dims[a] = (int64)((pts_max[a] - pts_min[a]) / voxel_size) + 1;
+    }
+
+    std::vector<std::pair<int64, int> > keys(pts_num);
+    for (int i = 0; i < pts_num; i++) {
+        int64 cell[3];
+        for (int a = 0; a < 3; a++) {
+            cell[a] = std::min((int64)((pts[i * 3 + a] - grid->origin[a]) / voxel_size), grid->dims[a] - 1);
+        }
+        keys[i] = std::make_pair((cell[0] * grid->dims[1] + cell[1]) * grid->dims[2] + cell[2], i);
+    }
+    std::sort(keys.begin(), keys.end());
+
+    grid->order.resize(pts_num);
+    grid->cells.clear();
+    grid->cells.reserve(pts_num);
+    for (int i = 0; i < pts_num; i++) {
+        grid->order[i] = keys[i].second;
+        if (i == 0 || keys[i].first != keys[i - 1].first) {
+            grid->cells[keys[i].first] = std::make_pair(i, 0);
+        }
+        grid->cells[keys[i].first].second++;
+    }
+}
+
+// voxel_size <= 0 picks one: the size giving k points per voxel if the points filled their bounding box,
+// then, as lidar points lie on surfaces, once rescaled by the square root of the actual occupancy
+void buildVoxelGridAuto(const float *pts, int pts_num, float voxel_size, int k, VoxelGrid *grid) {
+    if (voxel_size > 0) {
+        buildVoxelGrid(pts, pts_num, voxel_size, grid);
+        return;
+    }
+    float pts_min[3] = {pts[0], pts[1], pts[2]};
+    float pts_max[3] = {pts[0], pts[1], pts[2]};
+    for (int i = 1; i < pts_num; i++) {
+        for (int a = 0; a < 3; a++) {
+            pts_min[a] = std::min(pts_min[a], pts[i * 3 + a]);
+            pts_max[a] = std::max(pts_max[a], pts[i * 3 + a]);
+        }
+    }
+    double volume = 1.0;
+    for (int a = 0; a < 3; a++) {
+        volume *= std::max((double)(pts_max[a] - pts_min[a]), 1e-3);
+    }
+    buildVoxelGrid(pts, pts_num, (float)std::cbrt(volume * k / pts_num), grid);
+    double occupancy = (double)pts_num / grid->cells.size();
+    if (occupancy < k / 2.0) {
+        buildVoxelGrid(pts, pts_num, grid->voxel_size * (float)std::sqrt(k / occupancy), grid);
+    }
+}
+
+// The k nearest points of a query with distance^2 <= dis_max (dis_max < 0 for no limit), into a bounded
+// max heap of (distance^2, index), the same selection as myknnCpu. Voxel shells around the query voxel are
+// scanned outwards until the heap is full and its top is closer than any point of the unscanned voxels.
+void voxelSearch(const VoxelGrid &grid, const float *pts, int pts_num, const float *query, int k, float dis_max,
+                 std::vector<std::pair<float, int> > &heap) {
+    typedef std::pair<float, int> DisId;
+    heap.clear();
+    auto push = [&](int pt_id) {
+        const float *pt = pts + pt_id * 3;
+        float dis = 0;
+        for (int c = 0; c < 3; c++) {
+            float diff = query[c] - pt[c];
+            dis += diff * diff;
+        }
+        if (dis_max >= 0 && dis > dis_max) {
+            return;
+        }
+        if ((int)heap.size() < k) {
+            heap.push_back(DisId(dis, pt_id));
+            std::push_heap(heap.begin(), heap.end());
+        } else if (DisId(dis, pt_id) < heap.front()) {
+            std::pop_heap(heap.begin(), heap.end());
+            heap.back() = DisId(dis, pt_id);
+            std::push_heap(heap.begin(), heap.end());
+        }
+    };
+
+    const float voxel_size = grid.voxel_size;
+    int64 center[3];
+    int64 r_min = 0, r_max = 0;
+    for (int a = 0; a < 3; a++) {
+        double cell = std::floor((query[a] - grid.origin[a]) / voxel_size);
+        center[a] = (int64)std::max(std::min(cell, (double)(1 << 30)), -(double)(1 << 30));
+        r_min = std::max(r_min, std::max(-center[a], center[a] - (grid.dims[a] - 1)));
+        r_max = std::max(r_max, std::max(center[a], grid.dims[a] - 1 - center[a]));
+    }
+    // voxels of the block of radius r inside the grid
+    auto block_size = [&](int64 r) {
+        if (r < 0) {
+            return (int64)0;
+        }
+        int64 size = 1;
+        for (int a = 0; a < 3; a++) {
+            int64 lo = std::max(center[a] - r, (int64)0);
+            int64 hi = std::min(center[a] + r, grid.dims[a] - 1);
+            size *= std::max(hi - lo + 1, (int64)0);
+        }
+        return size;
+    };
+    auto scan_voxel = [&](int64 x, int64 y, int64 z) {
+        auto it = grid.cells.find((x * grid.dims[1] + y) * grid.dims[2] + z);
+        if (it != grid.cells.end()) {
+            for (int i = it->second.first; i < it->second.first + it->second.second; i++) {
+                push(grid.order[i]);
+            }
+        }
+    };
+
+    for (int64 r = r_min; r <= r_max; r++) {
+        // empty voxels cost more than the points they would skip, scan every point instead
+        if (block_size(r) - block_size(r - 1) > pts_num) {
+            heap.clear();
+            for (int pt_id = 0; pt_id < pts_num; pt_id++) {
+                push(pt_id);
+            }
+            return;
+        }
+        int64 x_lo = std::max(center[0] - r, (int64)0), x_hi = std::min(center[0] + r, grid.dims[0] - 1);
+        int64 y_lo = std::max(center[1] - r, (int64)0), y_hi = std::min(center[1] + r, grid.dims[1] - 1);
+        int64 z_lo = std::max(center[2] - r, (int64)0), z_hi = std::min(center[2] + r, grid.dims[2] - 1);
+        for (int64 x = x_lo; x <= x_hi; x++) {
+            for (int64 y = y_lo; y <= y_hi; y++) {
+                if (std::abs(x - center[0]) == r || std::abs(y - center[1]) == r) {
+                    for (int64 z = z_lo; z <= z_hi; z++) {
+                        scan_voxel(x, y, z);
+                    }
+                } else {
+                    if (center[2] - r >= z_lo && center[2] - r <= z_hi) {
+                        scan_voxel(x, y, center[2] - r);
+                    }
+                    if (r > 0 && center[2] + r <= z_hi && center[2] + r >= z_lo) {
+                        scan_voxel(x, y, center[2] + r);
+                    }
+                }
+            }
+        }
+        // points outside the scanned block are at least r voxels away, a small margin covers the rounding
+        // of the voxel coordinates
+        float dis_outside = std::max(r * voxel_size - 1e-4f * voxel_size, 0.0f);
+        dis_outside *= dis_outside;
+        if ((int)heap.size() == k && heap.front().first < dis_outside) {
+            return;
+        }
+        if (dis_max >= 0 && dis_max < dis_outside) {
+            return;
+        }
+    }
+}
+
+class VoxelKnnCpuOp: public OpKernel{
+public:
+    explicit VoxelKnnCpuOp(OpKernelConstruction* context):OpKernel(context) {
+        OP_REQUIRES_OK(context, context->GetAttr("k", &k_));
+        OP_REQUIRES(context, k_ > 0, errors::InvalidArgument("VoxelKnn expects positive k"));
+        OP_REQUIRES_OK(context, context->GetAttr("voxel_size", &voxel_size_));
+    }
+    void Compute(OpKernelContext * context)override{
+        int k = k_;
+        const Tensor& queries_tensor=context->input(0);
+        OP_REQUIRES(context,queries_tensor.dims()==3 && queries_tensor.shape().dim_size(2)==3,
+                    errors::InvalidArgument("VoxelKnn expects (batch_size,num_queries,3) queries shape"));
+        int batch_size = queries_tensor.shape().dim_size(0);
+        int qrs_num = queries_tensor.shape().dim_size(1);
+        const float * queries=queries_tensor.flat<float>().data();
+
+        const Tensor& points_tensor=context->input(1);
+        OP_REQUIRES(context,points_tensor.dims()==3 && points_tensor.shape().dim_size(0)==batch_size
+                    && points_tensor.shape().dim_size(2)==3,
+                    errors::InvalidArgument("VoxelKnn expects (batch_size,num_points,3) points shape"));
+        int pts_num = points_tensor.shape().dim_size(1);
+        OP_REQUIRES(context, k <= pts_num, errors::InvalidArgument("VoxelKnn expects k <= num_points"));
+        const float * points=points_tensor.flat<float>().data();
+
+        Tensor * out_tensor_dis;
+        OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{batch_size, qrs_num, k},&out_tensor_dis));
+        float * out_dis=out_tensor_dis->flat<float>().data();
+        Tensor * out_tensor_ids;
+        OP_REQUIRES_OK(context,context->allocate_output(1,TensorShape{batch_size, qrs_num, k, 2},&out_tensor_ids));
+        int * out_ids=out_tensor_ids->flat<int>().data();
+
+        // one grid per cloud, built once and shared by all the queries of the cloud
+        auto worker_threads = context->device()->tensorflow_cpu_worker_threads();
+        std::vector<VoxelGrid> grids(batch_size);
+        float voxel_size = voxel_size_;
+        Shard(worker_threads->num_threads, worker_threads->workers, batch_size, (int64)pts_num * 50,
+              [&](int64 start, int64 limit) {
+                  for (int64 b = start; b < limit; b++) {
+                      buildVoxelGridAuto(points + b * pts_num * 3, pts_num, voxel_size, k, &grids[b]);
+                  }
+              });
+        Shard(worker_threads->num_threads, worker_threads->workers, (int64)batch_size * qrs_num, (int64)k * 200,
+              [&](int64 start, int64 limit) {
+                  std::vector<std::pair<float, int> > heap;
+                  heap.reserve(k);
+                  for (int64 index = start; index < limit; index++) {
+                      int batch_id = index / qrs_num;
+                      voxelSearch(grids[batch_id], points + (int64)batch_id * pts_num * 3, pts_num,
+                                  queries + index * 3, k, -1.0f, heap);
+                      std::sort_heap(heap.begin(), heap.end());
+                      for (int r = 0; r < k; r++) {
+                          out_dis[index * k + r] = std::sqrt(heap[r].first);
+                          out_ids[(index * k + r) * 2] = batch_id;
+                          out_ids[(index * k + r) * 2 + 1] = heap[r].second;
+                      }
+                  }
+              });
+    }
+private:
+    int k_;
+    float voxel_size_;
+};
+REGISTER_KERNEL_BUILDER(Name("VoxelKnn").Device(DEVICE_CPU),VoxelKnnCpuOp);
+
+class VoxelRadiusSearchCpuOp: public OpKernel{
+public:
+    explicit VoxelRadiusSearchCpuOp(OpKernelConstruction* context):OpKernel(context) {
+        OP_REQUIRES_OK(context, context->GetAttr("radius", &radius_));
+        OP_REQUIRES(context, radius_ > 0, errors::InvalidArgument("VoxelRadiusSearch expects positive radius"));
+        OP_REQUIRES_OK(context, context->GetAttr("max_nn", &max_nn_));
+        OP_REQUIRES(context, max_nn_ > 0, errors::InvalidArgument("VoxelRadiusSearch expects positive max_nn"));
+        OP_REQUIRES_OK(context, context->GetAttr("voxel_size", &voxel_size_));
+    }
+    void Compute(OpKernelContext * context)override{
+        int max_nn = max_nn_;
+        const Tensor& queries_tensor=context->input(0);
+        OP_REQUIRES(context,queries_tensor.dims()==3 && queries_tensor.shape().dim_size(2)==3,
+                    errors::InvalidArgument("VoxelRadiusSearch expects (batch_size,num_queries,3) queries shape"));
+        int batch_size = queries_tensor.shape().dim_size(0);
+        int qrs_num = queries_tensor.shape().dim_size(1);
+        const float * queries=queries_tensor.flat<float>().data();
+
+        const Tensor& points_tensor=context->input(1);
+        OP_REQUIRES(context,points_tensor.dims()==3 && points_tensor.shape().dim_size(0)==batch_size
+                    && points_tensor.shape().dim_size(2)==3,
+                    errors::InvalidArgument("VoxelRadiusSearch expects (batch_size,num_points,3) points shape"));
+        int pts_num = points_tensor.shape().dim_size(1);
+        OP_REQUIRES(context, pts_num > 0, errors::InvalidArgument("VoxelRadiusSearch expects at least one point"));
+        const float * points=points_tensor.flat<float>().data();
+
+        Tensor * out_tensor_ids;
+        OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{batch_size, qrs_num, max_nn, 2},&out_tensor_ids));
+        int * out_ids=out_tensor_ids->flat<int>().data();
+        Tensor * out_tensor_counts;
+        OP_REQUIRES_OK(context,context->allocate_output(1,TensorShape{batch_size, qrs_num},&out_tensor_counts));
+        int * out_counts=out_tensor_counts->flat<int>().data();
+
+        auto worker_threads = context->device()->tensorflow_cpu_worker_threads();
+        std::vector<VoxelGrid> grids(batch_size);
+        float voxel_size = voxel_size_ > 0 ? voxel_size_ : radius_;
+        Shard(worker_threads->num_threads, worker_threads->workers, batch_size, (int64)pts_num * 50,
+              [&](int64 start, int64 limit) {
+                  for (int64 b = start; b < limit; b++) {
+                      buildVoxelGrid(points + b * pts_num * 3, pts_num, voxel_size, &grids[b]);
+                  }
+              });
+        float dis_max = radius_ * radius_;
+        Shard(worker_threads->num_threads, worker_threads->workers, (int64)batch_size * qrs_num,
+              (int64)max_nn * 200,
+              [&](int64 start, int64 limit) {
+                  std::vector<std::pair<float, int> > heap;
+                  heap.reserve(max_nn);
+                  for (int64 index = start; index < limit; index++) {
+                      int batch_id = index / qrs_num;
+                      voxelSearch(grids[batch_id], points + (int64)batch_id * pts_num * 3, pts_num,
+                                  queries + index * 3, max_nn, dis_max, heap);
+                      std::sort_heap(heap.begin(), heap.end());
+                      int count = heap.size();
+                      out_counts[index] = count;
+                      // pad with the nearest point in the radius, or point 0 when there is none
+                      for (int r = 0; r < max_nn; r++) {
+                          out_ids[(index * max_nn + r) * 2] = batch_id;
+                          out_ids[(index * max_nn + r) * 2 + 1] = r < count ? heap[r].second
+                                                                            : (count > 0 ? heap[0].second : 0);
+                      }
+                  }
+              });
+    }
+private:
+    float radius_;
+    int max_nn_;
+    float voxel_size_;
+};
+REGISTER_KERNEL_BUILDER(Name("VoxelRadiusSearch").Device(DEVICE_CPU),VoxelRadiusSearchCpuOp);
+
+
+#if GOOGLE_CUDA
 void myknnLauncher(int batch_size, int qrs_num, int pts_num, int channels_num,
                  const float *queries, const float *points, int k,
                  float *out_dis, int *out_ids);
+extern const int knnGpuMaxK;
 class MyKnnGpuOp: public OpKernel{
 public:
     explicit MyKnnGpuOp(OpKernelConstruction* context):OpKernel(context) {
         OP_REQUIRES_OK(context, context->GetAttr("k", &k_));
         OP_REQUIRES(context, k_ > 0, errors::InvalidArgument("KNN expects positive k"));
+        OP_REQUIRES(context, k_ <= knnGpuMaxK,
+                    errors::InvalidArgument("KNN on GPU expects k <= ", knnGpuMaxK, ", got ", k_));
 //        cout << "1" << endl;
     }
     void Compute(OpKernelContext * context)override{
@@ -61,12 +507,13 @@ public:
         const Tensor& points_tensor=context->input(1);
         OP_REQUIRES(context,points_tensor.dims()==3, errors::InvalidArgument("KNN expects (batch_size,num_points,3) points shape"));
         int pts_num = points_tensor.shape().dim_size(1);
+        OP_REQUIRES(context, k <= pts_num, errors::InvalidArgument("KNN expects k <= num_points"));
         auto points_flat=points_tensor.flat<float>();
         const float * points=&(points_flat(0));
 
 
         Tensor * out_tensor_dis;
-        OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{batch_size, qrs_num, pts_num},&out_tensor_dis));
+        OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{batch_size, qrs_num, k},&out_tensor_dis));
         auto out_flat_dis=out_tensor_dis->flat<float>();
         float * out_dis=&(out_flat_dis(0));
 
@@ -82,3 +529,4 @@ private:
     int k_;
 };
 REGISTER_KERNEL_BUILDER(Name("MyKnn").Device(DEVICE_GPU),MyKnnGpuOp);
+#endif
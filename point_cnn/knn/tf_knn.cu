@@ -11,10 +11,6 @@
 #include <cstdio>
 #include "cuda.h"
 
-// Constants used by the program
-#define BLOCK_DIM                      16
-
-
 //-----------------------------------------------------------------------------------------------//
 //                                            KERNELS                                            //
 //-----------------------------------------------------------------------------------------------//
@@ -65,229 +61,59 @@ __global__ void extract_with_interpolation(
   }
 }
 
-/**
-  * Computes the distance between two matrix A (reference points) and
-  * B (query points) containing respectively wA and wB points.
-  *
-  * @param A     pointer on the matrix A
-  * @param wA    width of the matrix A = number of points in A
-  * @param B     pointer on the matrix B
-  * @param wB    width of the matrix B = number of points in B
-  * @param dim   dimension of points = height of matrices A and B
-  * @param AB    pointer on the matrix containing the wA*wB distances computed
-  */
-__global__ void cuComputeDistanceGlobal(const float* A, int wA,
-    const float* B, int wB, int dim,  float* AB){
-
-  // Declaration of the shared memory arrays As and Bs used to store the sub-matrix of A and B
-  __shared__ float shared_A[BLOCK_DIM][BLOCK_DIM];
-  __shared__ float shared_B[BLOCK_DIM][BLOCK_DIM];
-
-  // Sub-matrix of A (begin, step, end) and Sub-matrix of B (begin, step)
-  __shared__ int begin_A;
-  __shared__ int begin_B;
-  __shared__ int step_A;
-  __shared__ int step_B;
-  __shared__ int end_A;
-
-  // Thread index
-  int tx = threadIdx.x;
-  int ty = threadIdx.y;
-
-  // Other variables
-  float tmp;
-  float ssd = 0;
-
-  // Loop parameters
-  begin_A = BLOCK_DIM * blockIdx.y;
-  begin_B = BLOCK_DIM * blockIdx.x;
-  step_A  = BLOCK_DIM * wA;
-  step_B  = BLOCK_DIM * wB;
-  end_A   = begin_A + (dim-1) * wA;
-
-    // Conditions
-  int cond0 = (begin_A + tx < wA); // used to write in shared memory
-  int cond1 = (begin_B + tx < wB); // used to write in shared memory & to computations and to write in output matrix
-  int cond2 = (begin_A + ty < wA); // used to computations and to write in output matrix
-
-  // Loop over all the sub-matrices of A and B required to compute the block sub-matrix
-  for (int a = begin_A, b = begin_B; a <= end_A; a += step_A, b += step_B) {
-    // Load the matrices from device memory to shared memory; each thread loads one element of each matrix
-    if (a/wA + ty < dim){
-      shared_A[ty][tx] = (cond0)? A[a + wA * ty + tx] : 0;
-      shared_B[ty][tx] = (cond1)? B[b + wB * ty + tx] : 0;
-    }
-    else{
-      shared_A[ty][tx] = 0;
-      shared_B[ty][tx] = 0;
-    }
-
-    // Synchronize to make sure the matrices are loaded
-    __syncthreads();
-
-    // Compute the difference between the two matrixes; each thread computes one element of the block sub-matrix
-    if (cond2 && cond1){
-      for (int k = 0; k < BLOCK_DIM; ++k){
-        tmp = shared_A[k][ty] - shared_B[k][tx];
-        ssd += tmp*tmp;
-      }
-    }
-
-    // Synchronize to make sure that the preceding computation is done before loading two new sub-matrices of A and B in the next iteration
-    __syncthreads();
-  }
-
-  // Write the block sub-matrix to device memory; each thread writes one element
-  if (cond2 && cond1)
-    AB[(begin_A + ty) * wB + begin_B + tx] = ssd;
-}
-
+// the longest neighbor list of myknnKernel, its per thread arrays are sized by it, MyKnnGpuOp checks k against it
+#define KNN_MAX_K 64
+extern const int knnGpuMaxK = KNN_MAX_K;
 
 /**
-  * Gathers k-th smallest distances for each column of the distance matrix in the top.
+  * One thread per query: scans all the points of its batch and keeps the k nearest ones in a sorted
+  * local array, so no queries_num * points_num distance matrix is needed. Ties keep the smaller
+  * point index first, like the CPU kernel.
   *
-  * @param dist        distance matrix
-  * @param ind         index matrix
-  * @param width       width of the distance matrix and of the index matrix
-  * @param height      height of the distance matrix and of the index matrix
-  * @param k           number of neighbors to consider
+  * @param out_dis   (batch_size, qrs_num, k) distances
+  * @param out_ids   (batch_size, qrs_num, k, 2) (batch index, point index) pairs
   */
-__global__ void cuInsertionSort(float *dist, int *ind, int width, int height, int k){
-
-  // Variables
-  int l, i, j;
-  float *p_dist;
-  int   *p_ind;
-  float curr_dist, max_dist;
-  int   curr_row,  max_row;
-  unsigned int xIndex = blockIdx.x * blockDim.x + threadIdx.x;
-
-  if (xIndex<width){
-    // Pointer shift, initialization, and max value
-    p_dist   = dist + xIndex;
-    p_ind    = ind  + xIndex;
-    max_dist = p_dist[0];
-    p_ind[0] = 1;
-
-    // Part 1 : sort kth firt elementZ
-    for (l=1; l<k; l++){
-      curr_row  = l * width;
-      curr_dist = p_dist[curr_row];
-      if (curr_dist<max_dist){
-        i=l-1;
-        for (int a=0; a<l-1; a++){
-          if (p_dist[a*width]>curr_dist){
-            i=a;
-            break;
-          }
-        }
-        for (j=l; j>i; j--){
-          p_dist[j*width] = p_dist[(j-1)*width];
-          p_ind[j*width]   = p_ind[(j-1)*width];
-        }
-        p_dist[i*width] = curr_dist;
-        p_ind[i*width]   = l+1;
-      } else {
-        p_ind[l*width] = l+1;
+__global__ void myknnKernel(int batch_size, int qrs_num, int pts_num, int channels_num,
+    const float *queries, const float *points, int k, float *out_dis, int *out_ids){
+  float best_dis[KNN_MAX_K];
+  int best_ids[KNN_MAX_K];
+  for (int index = blockIdx.x * blockDim.x + threadIdx.x;
+       index < batch_size * qrs_num;
+       index += blockDim.x * gridDim.x) {
+    int batch_id = index / qrs_num;
+    const float *query = queries + index * channels_num;
+    const float *pts = points + batch_id * pts_num * channels_num;
+    int count = 0;
+    for (int pt_id = 0; pt_id < pts_num; pt_id++) {
+      float dis = 0;
+      for (int c = 0; c < channels_num; c++) {
+        float diff = query[c] - pts[pt_id * channels_num + c];
+        dis += diff * diff;
       }
-      max_dist = p_dist[curr_row];
-    }
-
-    // Part 2 : insert element in the k-th first lines
-    max_row = (k-1)*width;
-    for (l=k; l<height; l++){
-      curr_dist = p_dist[l*width];
-      if (curr_dist<max_dist){
-        i=k-1;
-        for (int a=0; a<k-1; a++){
-          if (p_dist[a*width]>curr_dist){
-            i=a;
-            break;
-          }
-        }
-        for (j=k-1; j>i; j--){
-          p_dist[j*width] = p_dist[(j-1)*width];
-          p_ind[j*width]   = p_ind[(j-1)*width];
+      if (count < k || dis < best_dis[k - 1]) {
+        int pos = count < k ? count++ : k - 1;
+        while (pos > 0 && best_dis[pos - 1] > dis) {
+          best_dis[pos] = best_dis[pos - 1];
+          best_ids[pos] = best_ids[pos - 1];
+          pos--;
         }
-        p_dist[i*width] = curr_dist;
-        p_ind[i*width]   = l+1;
-        max_dist             = p_dist[max_row];
+        best_dis[pos] = dis;
+        best_ids[pos] = pt_id;
       }
     }
+    for (int r = 0; r < k; r++) {
+      out_dis[index * k + r] = sqrt(best_dis[r]);
+      out_ids[(index * k + r) * 2] = batch_id;
+      out_ids[(index * k + r) * 2 + 1] = best_ids[r];
+    }
   }
 }
 
-
-/**
-  * Computes the square root of the first line (width-th first element)
-  * of the distance matrix.
-  *
-  * @param dist    distance matrix
-  * @param width   width of the distance matrix
-  * @param k       number of neighbors to consider
-  */
-__global__ void cuParallelSqrt(float *dist, int width, int k){
-    unsigned int xIndex = blockIdx.x * blockDim.x + threadIdx.x;
-    unsigned int yIndex = blockIdx.y * blockDim.y + threadIdx.y;
-  if (xIndex<width && yIndex<k)
-    dist[yIndex*width + xIndex] = sqrt(dist[yIndex*width + xIndex]);
-}
-
-
-//-----------------------------------------------------------------------------------------------//
-//                                   K-th NEAREST NEIGHBORS                                      //
-//-----------------------------------------------------------------------------------------------//
-
-
-/**
-  * Prints the error message return during the memory allocation.
-  *
-  * @param error        error value return by the memory allocation function
-  * @param memorySize   size of memory tried to be allocated
-  */
-void printErrorMessage(cudaError_t error, int memorySize){
-  printf("==================================================\n");
-  printf("MEMORY ALLOCATION ERROR  : %s\n", cudaGetErrorString(error));
-  printf("Whished allocated memory : %d\n", memorySize);
-  printf("==================================================\n");
-}
-
 void myknnLauncher(int batch_size, int qrs_num, int pts_num, int channels_num,
                  const float *queries, const float *points, int k,
                  float *out_dis, int *out_ids){
-    for(int batch_id=0; batch_id<batch_size; batch_id++) {
-        int query_width = qrs_num;
-        int ref_width = pts_num;
-        const float *ref_dev = points + pts_num * channels_num * batch_size;
-        const float *query_dev = queries + qrs_num * channels_num * batch_size;
-        int height = channels_num;
-        float *dist_dev = out_dis + qrs_num * pts_num * batch_size;
-        int *ind_dev = out_ids + qrs_num * k * 2 * batch_size;
-
-        // Grids ans threads
-        dim3 g_16x16(query_width/16, ref_width/16, 1);
-        dim3 t_16x16(16, 16, 1);
-        if (query_width%16 != 0) g_16x16.x += 1;
-        if (ref_width  %16 != 0) g_16x16.y += 1;
-        //
-        dim3 g_256x1(query_width/256, 1, 1);
-        dim3 t_256x1(256, 1, 1);
-        if (query_width%256 != 0) g_256x1.x += 1;
-
-        dim3 g_k_16x16(query_width/16, k/16, 1);
-        dim3 t_k_16x16(16, 16, 1);
-        if (query_width%16 != 0) g_k_16x16.x += 1;
-        if (k  %16 != 0) g_k_16x16.y += 1;
-
-        // Kernel 1: Compute all the distances
-        cuComputeDistanceGlobal<<<g_16x16,t_16x16>>>(ref_dev, ref_width,
-            query_dev, query_width, height, dist_dev);
-
-        // Kernel 2: Sort each column
-        cuInsertionSort<<<g_256x1,t_256x1>>>(dist_dev, ind_dev,
-            query_width, ref_width, k);
-
-        // Kernel 3: Compute square root of k first elements
-        cuParallelSqrt<<<g_k_16x16,t_k_16x16>>>(dist_dev, query_width, k);
-    }
-}
\ No newline at end of file
+    int threads = 256;
+    int blocks = (batch_size * qrs_num + threads - 1) / threads;
+    myknnKernel<<<blocks, threads>>>(batch_size, qrs_num, pts_num, channels_num, queries, points, k,
+                                     out_dis, out_ids);
+}
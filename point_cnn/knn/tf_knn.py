@@ -15,11 +15,12 @@ knn_module = tf.load_op_library(os.path.join(BASE_DIR, 'tf_knn.so'))
 
 def knn(k, queries, points):
     """
-
+    k nearest points of every query, without materializing the (N, P_queries, P_points) distance matrix
     :param queries: (N, P_queries, C)
     :param points:  (N, P_points, C)
-    :param k:   int
-    :return:    (N, P_queries, k, dis),  (N, P_queries, k, indices)
+    :param k:   int, k <= P_points, and k <= 64 on GPU
+    :return:    (N, P_queries, k) euclidean distances in ascending order, ties in point index order,
+                (N, P_queries, k, 2) int32 indices for tf.gather_nd(points, indices)
     """
 
     return knn_module.my_knn(k=k, queries=queries, points=points)
@@ -27,6 +28,42 @@ def knn(k, queries, points):
 ops.NoGradient('MyKnn')
 
 
+def voxel_knn(k, queries, points, voxel_size=0.0):
+    """
+    k nearest points of every query through a voxel hash grid built once per cloud, CPU only,
+    same results as knn() for 3D points
+    :param queries: (N, P_queries, 3)
+    :param points:  (N, P_points, 3)
+    :param k:   int, k <= P_points
+    :param voxel_size:  voxel edge length, 0 to pick one from the point density
+    :return:    (N, P_queries, k) euclidean distances in ascending order,
+                (N, P_queries, k, 2) int32 indices for tf.gather_nd(points, indices)
+    """
+
+    return knn_module.voxel_knn(k=k, queries=queries, points=points, voxel_size=voxel_size)
+
+ops.NoGradient('VoxelKnn')
+
+
+def voxel_radius_search(radius, max_nn, queries, points, voxel_size=0.0):
+    """
+    up to max_nn nearest points within radius of every query through a voxel hash grid, CPU only
+    :param queries: (N, P_queries, 3)
+    :param points:  (N, P_points, 3)
+    :param radius:  float
+    :param max_nn:  int
+    :param voxel_size:  voxel edge length, 0 for radius
+    :return:    (N, P_queries, max_nn, 2) int32 indices for tf.gather_nd(points, indices), ascending distance,
+                padded with the nearest neighbor, or point 0 when there is none,
+                (N, P_queries) int32 neighbor counts
+    """
+
+    return knn_module.voxel_radius_search(radius=radius, max_nn=max_nn, queries=queries, points=points,
+                                          voxel_size=voxel_size)
+
+ops.NoGradient('VoxelRadiusSearch')
+
+
 def farthest_point_sample(npoint,inp):
     '''
 input:
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""Benchmark the MyKnn op against the dense and chunked pf.knn_indices_general paths on CPU,
+the overhead of the unique=True duplicate suppression on the dense path, and the voxel hash KNN op."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+import pointfly as pf
+from tf_knn import knn, voxel_knn
+
+
+def time_op(sess, op, repeat_num):
+    sess.run(op)  # warm up
+    time_start = time.time()
+    for _ in range(repeat_num):
+        sess.run(op)
+    return (time.time() - time_start) / repeat_num
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', '-b', help='Batch size', type=int, default=8)
+    parser.add_argument('--repeat_num', '-r', help='Repeat number', type=int, default=10)
+    parser.add_argument('--threads', '-t', help='Intra op threads, 0 for all cores', type=int, default=0)
+    parser.add_argument('--chunk_size', '-c', help='Query chunk size of the chunked path', type=int, default=256)
+    parser.add_argument('--dup_ratio', help='Ratio of duplicated points, as of repeated lidar returns', type=float,
+                        default=0.1)
+    parser.add_argument('--max_dense_mb', help='Skip the dense paths when their distance matrix is bigger', type=float,
+                        default=2048)
+    args = parser.parse_args()
+    print(args)
+
+    # (P_queries, P_points, K * D) of the df_x4_2048_fps layers, and of the first layer on a full frustum
+    configs = [(2048, 2048, 12), (768, 2048, 16), (384, 768, 32), (128, 384, 32), (2048, 4096, 12),
+               (16384, 16384, 12)]
+    config = tf.ConfigProto(intra_op_parallelism_threads=args.threads, device_count={'GPU': 0})
+
+    print('{:>8} {:>8} {:>4} {:>12} {:>12} {:>8} {:>14} {:>14} {:>12} {:>14} {:>16}'.format(
+        'queries', 'points', 'k', 'op (ms)', 'dense (ms)', 'speedup', 'chunked (ms)', 'unique (ms)', 'voxel (ms)',
+        'dense D (MB)', 'chunked D (MB)'))
+    for qrs_num, pts_num, k in configs:
+        tf.reset_default_graph()
+        # a lidar like cloud, points on a wavy ground plane
+        u = np.random.random((args.batch_size, pts_num, 2))
+        points_np = np.stack([u[..., 0] * 60, u[..., 1] * 20, 0.2 * np.sin(u[..., 0] * 30)], axis=-1)
+        points_np = points_np.astype(np.float32)
+        dup_num = int(pts_num * args.dup_ratio)
+        points_np[:, pts_num - dup_num:] = points_np[:, :dup_num]
+        points = tf.constant(points_np)
+        queries = tf.constant(points_np[:, :qrs_num])
+        with tf.device('/cpu:0'):
+            _, ids_op = knn(k, queries, points)
+            _, ids_dense = pf.knn_indices_general(queries, points, k, True, unique=False)
+            _, ids_chunked = pf.knn_indices_general(queries, points, k, True, unique=False, chunk_size=args.chunk_size)
+            _, ids_unique = pf.knn_indices_general(queries, points, k, True, unique=True)
+            _, ids_voxel = voxel_knn(k, queries, points)
+        dense_mb = args.batch_size * qrs_num * pts_num * 4 / 1024 / 1024
+        chunked_mb = dense_mb * min(args.chunk_size, qrs_num) / qrs_num
+        with tf.Session(config=config) as sess:
+            time_knn_op = time_op(sess, ids_op.op, args.repeat_num)
+            time_chunked = time_op(sess, ids_chunked.op, args.repeat_num)
+            time_voxel = time_op(sess, ids_voxel.op, args.repeat_num)
+            if dense_mb <= args.max_dense_mb:
+                time_dense = time_op(sess, ids_dense.op, args.repeat_num)
+                time_unique = time_op(sess, ids_unique.op, args.repeat_num)
+            else:
+                time_dense = time_unique = float('nan')
+        print('{:>8d} {:>8d} {:>4d} {:>12.2f} {:>12.2f} {:>8.2f} {:>14.2f} {:>14.2f} {:>12.2f} {:>14.1f} {:>16.1f}'
+              .format(qrs_num, pts_num, k, time_knn_op * 1000, time_dense * 1000, time_dense / time_knn_op,
+                      time_chunked * 1000, time_unique * 1000, time_voxel * 1000, dense_mb, chunked_mb))
+
+
+if __name__ == '__main__':
+    main()
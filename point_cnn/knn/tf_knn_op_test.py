@@ -0,0 +1,150 @@
+import os
+import sys
+import numpy as np
+import tensorflow as tf
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+import pointfly as pf
+from tf_knn import knn, voxel_knn, voxel_radius_search
+from utils.voxel_grid import VoxelGrid
+
+
+def knn_numpy(queries, points, k):
+    d = np.sum(np.square(queries[:, :, None, :].astype(np.float64) - points[:, None, :, :]), axis=-1)
+    point_indices = np.argsort(d, axis=-1, kind='stable')[:, :, :k]
+    return np.sqrt(np.take_along_axis(d, point_indices, axis=-1)), point_indices
+
+
+class MyKnnCpuTest(tf.test.TestCase):
+  def test(self):
+    np.random.seed(0)
+    for batch_size, qrs_num, pts_num, dim, k in [(2, 128, 512, 3, 16), (3, 100, 333, 7, 1), (1, 64, 64, 3, 64)]:
+      queries = np.random.random((batch_size, qrs_num, dim)).astype('float32')
+      points = np.random.random((batch_size, pts_num, dim)).astype('float32')
+      with tf.device('/cpu:0'):
+        dis, ids = knn(k, tf.constant(queries), tf.constant(points))
+      with self.test_session():
+        dis_val, ids_val = dis.eval(), ids.eval()
+      dis_np, point_indices_np = knn_numpy(queries, points, k)
+      self.assertAllEqual(ids_val[..., 0], np.tile(np.arange(batch_size).reshape(-1, 1, 1), (1, qrs_num, k)))
+      self.assertAllEqual(ids_val[..., 1], point_indices_np)
+      self.assertAllClose(dis_val, dis_np, atol=1e-5)
+
+  def test_dense(self):
+    np.random.seed(1)
+    # integer coordinates keep r_A - 2AB + r_B of the dense path exact, and make ties common: both paths rank
+    # by (distance, point index), top_k keeping the lower index first
+    queries = np.random.randint(0, 8, size=(2, 256, 3)).astype('float32')
+    points = np.random.randint(0, 8, size=(2, 1024, 3)).astype('float32')
+    k = 16
+    with tf.device('/cpu:0'):
+      _, ids = knn(k, tf.constant(queries), tf.constant(points))
+      _, ids_dense = pf.knn_indices_general(tf.constant(queries), tf.constant(points), k, True, unique=False)
+    with self.test_session():
+      ids_val, ids_dense_val = ids.eval(), ids_dense.eval()
+    self.assertAllEqual(ids_val, ids_dense_val)
+    self.assertAllEqual(ids_val[..., 1], knn_numpy(queries, points, k)[1])
+
+  def test_no_distance_matrix(self):
+    with tf.device('/cpu:0'):
+      dis, ids = knn(12, tf.zeros((8, 2048, 3)), tf.zeros((8, 2048, 3)))
+    self.assertEqual(dis.get_shape().as_list(), [8, 2048, 12])
+    self.assertEqual(ids.get_shape().as_list(), [8, 2048, 12, 2])
+
+
+class KnnIndicesChunkedTest(tf.test.TestCase):
+  def test(self):
+    np.random.seed(2)
+    for qrs_num, pts_num, k, chunk_size in [(256, 1024, 16, 64), (100, 333, 8, 48), (32, 64, 32, 128)]:
+      queries = tf.constant(np.random.random((2, qrs_num, 3)).astype('float32'))
+      points = tf.constant(np.random.random((2, pts_num, 3)).astype('float32'))
+      dis_dense, ids_dense = pf.knn_indices_general(queries, points, k, True, unique=False)
+      dis_chunked, ids_chunked = pf.knn_indices_general(queries, points, k, True, unique=False,
+                                                        chunk_size=chunk_size)
+      with self.test_session():
+        self.assertAllEqual(ids_chunked.eval(), ids_dense.eval())
+        self.assertAllEqual(dis_chunked.eval(), dis_dense.eval())
+
+
+class KnnIndicesUniqueTest(tf.test.TestCase):
+  def test_find_duplicate_columns(self):
+    np.random.seed(3)
+    points = np.random.randint(0, 4, size=(3, 200, 3)).astype('float32')
+    indices_duplicated = pf.find_duplicate_columns(points)
+    for idx in range(3):
+      _, indices_unique = np.unique(points[idx], return_index=True, axis=0)
+      expected = np.ones(200, dtype=np.int32)
+      expected[indices_unique] = 0
+      self.assertAllEqual(indices_duplicated[idx, 0], expected)
+
+  def test(self):
+    np.random.seed(4)
+    k = 16
+    points_unique = np.random.random((2, 300, 3)).astype('float32')
+    # every third point is returned twice, in random order
+    points = np.concatenate([points_unique, points_unique[:, ::3]], axis=1)
+    points = points[:, np.random.permutation(points.shape[1])]
+    queries = points_unique[:, :64]
+    _, ids = pf.knn_indices_general(tf.constant(queries), tf.constant(points), k, True, unique=True)
+    with self.test_session():
+      ids_val = ids.eval()
+    _, point_indices_np = knn_numpy(queries, points_unique, k)
+    for idx in range(2):
+      nn_pts = points[idx][ids_val[idx, ..., 1]]  # (P, K, 3)
+      nn_pts_np = points_unique[idx][point_indices_np[idx]]
+      self.assertAllEqual(np.sort(nn_pts, axis=1), np.sort(nn_pts_np, axis=1))
+
+
+def lidar_like(batch_size, pts_num):
+  # points on a wavy ground plane, some repeated, plus far outliers
+  u = np.random.random((batch_size, pts_num, 2))
+  points = np.stack([u[..., 0] * 60, u[..., 1] * 20, 0.2 * np.sin(u[..., 0] * 30)], axis=-1)
+  points[:, ::50, 2] += 30 * np.random.random((batch_size, len(range(0, pts_num, 50))))
+  points[:, 1::97] = points[:, ::97][:, :len(range(1, pts_num, 97))]
+  return points.astype('float32')
+
+
+class VoxelKnnTest(tf.test.TestCase):
+  def test(self):
+    np.random.seed(5)
+    for batch_size, qrs_num, pts_num, k, voxel_size in [(2, 512, 4096, 32, 0.0), (3, 100, 333, 1, 0.5),
+                                                        (1, 64, 64, 64, 0.0), (2, 256, 2048, 12, 10.0)]:
+      points = lidar_like(batch_size, pts_num)
+      queries = np.concatenate([points[:, :qrs_num // 2],
+                                lidar_like(batch_size, qrs_num - qrs_num // 2) * 1.1], axis=1)
+      with tf.device('/cpu:0'):
+        dis, ids = voxel_knn(k, tf.constant(queries), tf.constant(points), voxel_size)
+        dis_ref, ids_ref = knn(k, tf.constant(queries), tf.constant(points))
+      with self.test_session() as sess:
+        dis_val, ids_val, dis_ref_val, ids_ref_val = sess.run([dis, ids, dis_ref, ids_ref])
+      self.assertAllEqual(ids_val, ids_ref_val)
+      self.assertAllEqual(dis_val, dis_ref_val)
+      for idx in range(batch_size):
+        dis_np, point_indices_np = VoxelGrid(points[idx], voxel_size or None, k).knn(queries[idx], k)
+        self.assertAllEqual(point_indices_np, ids_ref_val[idx, ..., 1])
+        self.assertAllClose(dis_np, dis_ref_val[idx])
+
+  def test_radius(self):
+    np.random.seed(6)
+    radius, max_nn = 1.0, 24
+    points = lidar_like(2, 3000)
+    queries = points[:, ::10] + np.float32(0.5)
+    with tf.device('/cpu:0'):
+      ids, counts = voxel_radius_search(radius, max_nn, tf.constant(queries), tf.constant(points))
+    with self.test_session() as sess:
+      ids_val, counts_val = sess.run([ids, counts])
+    for idx in range(2):
+      d = np.sum(np.square(queries[idx, :, None, :] - points[idx, None, :, :]), axis=-1)
+      point_indices = np.argsort(d, axis=-1, kind='stable')
+      counts_np = np.minimum(np.sum(d <= radius * radius, axis=-1), max_nn)
+      self.assertAllEqual(counts_val[idx], counts_np)
+      for qrs_idx in range(queries.shape[1]):
+        count = counts_np[qrs_idx]
+        self.assertAllEqual(ids_val[idx, qrs_idx, :count, 1], point_indices[qrs_idx, :count])
+      indices_np, counts_grid = VoxelGrid(points[idx], radius).radius_search(queries[idx], radius, max_nn)
+      self.assertAllEqual(counts_grid, counts_val[idx])
+      self.assertAllEqual(indices_np, ids_val[idx, ..., 1])
+
+if __name__=='__main__':
+  tf.test.main()
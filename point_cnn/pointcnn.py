@@ -3,13 +3,52 @@ from __future__ import division
 from __future__ import print_function
 
 import math
+import time
 import pointfly as pf
 import tensorflow as tf
 
 
+# nn_pts_local shape is (N, P, K, 3), nn_fts_input shape is (N, P, K, C)
+# return shape is (N, P, K, C), nn_fts_input transformed by the learned (K, K) X of every point
+def x_transformation(nn_pts_local, nn_fts_input, tag, N, P, K, is_training, fused=False):
+    # the fused op has the same variables as below, with the batch normalizations frozen to their moving statistics,
+    # so it is inference (and frozen batch normalization fine tuning) only: where is_training may be True, the
+    # composed path below is built instead
+    if fused:
+        is_training_value = tf.contrib.util.constant_value(tf.convert_to_tensor(is_training))
+        fused = is_training_value is not None and not is_training_value
+    if fused:
+        from xtransform import tf_xtransform
+        C_pts = nn_pts_local.get_shape()[-1].value
+        with tf.variable_scope(tag + 'X_0'):
+            w0 = tf.get_variable('kernel', (1, K, C_pts, K * K), initializer=tf.glorot_normal_initializer(),
+                                 regularizer=tf.contrib.layers.l2_regularizer(scale=1.0))
+        scale0, shift0 = pf.batch_normalization_affine(K * K, tag + 'X_0_bn')
+        ws = []
+        for X_idx in [1, 2]:
+            with tf.variable_scope(tag + 'X_{:d}'.format(X_idx)):
+                ws.append(tf.get_variable('depthwise_weights', (1, K, K, K), initializer=tf.glorot_normal_initializer(),
+                                          regularizer=tf.contrib.layers.l2_regularizer(scale=1.0)))
+        scale1, shift1 = pf.batch_normalization_affine(K * K, tag + 'X_1_bn')
+        scale2, shift2 = pf.batch_normalization_affine(K * K, tag + 'X_2_bn')
+        return tf.identity(tf_xtransform.x_transform(nn_pts_local, nn_fts_input, w0, scale0, shift0,
+                                                     ws[0], scale1, shift1, ws[1], scale2, shift2), name=tag + 'fts_X')
+
+    X_0 = pf.conv2d(nn_pts_local, K * K, tag + 'X_0', is_training, (1, K))
+    X_0_KK = tf.reshape(X_0, (N, P, K, K), name=tag + 'X_0_KK')
+    X_1 = pf.depthwise_conv2d(X_0_KK, K, tag + 'X_1', is_training, (1, K))
+    X_1_KK = tf.reshape(X_1, (N, P, K, K), name=tag + 'X_1_KK')
+    X_2 = pf.depthwise_conv2d(X_1_KK, K, tag + 'X_2', is_training, (1, K), activation=None)
+    X_2_KK = tf.reshape(X_2, (N, P, K, K), name=tag + 'X_2_KK')
+    return tf.matmul(X_2_KK, nn_fts_input, name=tag + 'fts_X')
+
+
 def xconv(pts, fts, qrs, tag, N, K, D, P, C, C_pts_fts, is_training, with_X_transformation, depth_multiplier,
-          sorting_method=None, with_global=False):
-    _, indices_dilated = pf.knn_indices_general(qrs, pts, K * D, True)
+          sorting_method=None, with_global=False, knn_chunk_size=None, indices_dilated=None, fused_X=False,
+          knn_unique=False):
+    if indices_dilated is None:
+        _, indices_dilated = pf.knn_indices_general(qrs, pts, K * D, True, unique=knn_unique,
+                                                    chunk_size=knn_chunk_size)
     indices = indices_dilated[:, :, ::D, :]
 
     if sorting_method is not None:
@@ -30,13 +69,7 @@ def xconv(pts, fts, qrs, tag, N, K, D, P, C, C_pts_fts, is_training, with_X_tran
 
     if with_X_transformation:
         ######################## X-transformation #########################
-        X_0 = pf.conv2d(nn_pts_local, K * K, tag + 'X_0', is_training, (1, K))
-        X_0_KK = tf.reshape(X_0, (N, P, K, K), name=tag + 'X_0_KK')
-        X_1 = pf.depthwise_conv2d(X_0_KK, K, tag + 'X_1', is_training, (1, K))
-        X_1_KK = tf.reshape(X_1, (N, P, K, K), name=tag + 'X_1_KK')
-        X_2 = pf.depthwise_conv2d(X_1_KK, K, tag + 'X_2', is_training, (1, K), activation=None)
-        X_2_KK = tf.reshape(X_2, (N, P, K, K), name=tag + 'X_2_KK')
-        fts_X = tf.matmul(X_2_KK, nn_fts_input, name=tag + 'fts_X')
+        fts_X = x_transformation(nn_pts_local, nn_fts_input, tag, N, P, K, is_training, fused_X)
         ###################################################################
     else:
         fts_X = nn_fts_input
@@ -44,7 +77,13 @@ def xconv(pts, fts, qrs, tag, N, K, D, P, C, C_pts_fts, is_training, with_X_tran
     fts_conv = pf.separable_conv2d(fts_X, C, tag + 'fts_conv', is_training, (1, K), depth_multiplier=depth_multiplier)
     fts_conv_3d = tf.squeeze(fts_conv, axis=2, name=tag + 'fts_conv_3d')
 
-    if with_global:
+    if with_global == 'constant':
+        # the global branch replaced by its expectation, the shift of its batch normalization, for fast profiles
+        with tf.variable_scope(tag + 'fts_global_bn', reuse=tf.AUTO_REUSE):
+            beta = tf.get_variable('beta', (C // 4,), initializer=tf.zeros_initializer())
+        fts_global = tf.zeros_like(qrs[:, :, :1]) + beta
+        return tf.concat([fts_global, fts_conv_3d], axis=-1, name=tag + 'fts_conv_3d_with_global')
+    elif with_global:
         fts_global_0 = pf.dense(qrs, C // 4, tag + 'fts_global_0', is_training)
         fts_global = pf.dense(fts_global_0, C // 4, tag + 'fts_global', is_training)
         return tf.concat([fts_global, fts_conv_3d], axis=-1, name=tag + 'fts_conv_3d_with_global')
@@ -52,14 +91,61 @@ def xconv(pts, fts, qrs, tag, N, K, D, P, C, C_pts_fts, is_training, with_X_tran
         return fts_conv_3d
 
 
+# KNN cache keys of the xconv and xdconv layers, of the layers sampling their qrs with inverse density
+# sampling (None for the others), and the largest K * D asked for each key.
+# A key is (pts layer, qrs layer) in terms of self.layer_pts, where a layer that outputs all its
+# input points (P == -1 or P equal to the previous P) is the same layer as its input.
+def knn_cache_plan(xconv_params, xdconv_params, sampling=None):
+    layer_ids = [0]
+    for layer_idx, layer_param in enumerate(xconv_params):
+        P = layer_param['P']
+        if P == -1 or (layer_idx > 0 and P == xconv_params[layer_idx - 1]['P']):
+            layer_ids.append(layer_ids[-1])
+        else:
+            layer_ids.append(layer_idx + 1)
+
+    xconv_keys = [(layer_ids[layer_idx], layer_ids[layer_idx + 1]) for layer_idx in range(len(xconv_params))]
+    xdconv_keys = [(layer_ids[layer_param['pts_layer_idx'] + 1], layer_ids[layer_param['qrs_layer_idx'] + 1])
+                   for layer_param in xdconv_params]
+    # inverse density sampling needs the K nearest points of every pts point among pts
+    ids_keys = [(layer_ids[layer_idx], layer_ids[layer_idx])
+                if sampling == 'ids' and layer_ids[layer_idx + 1] == layer_idx + 1 else None
+                for layer_idx in range(len(xconv_params))]
+    k_max = dict()
+    for key, layer_param in zip(xconv_keys + xdconv_keys, list(xconv_params) + list(xdconv_params)):
+        k_max[key] = max(k_max.get(key, 0), layer_param['K'] * layer_param['D'])
+    for key, layer_param in zip(ids_keys, xconv_params):
+        if key is not None:
+            k_max[key] = max(k_max.get(key, 0), layer_param['K'])
+    return xconv_keys, xdconv_keys, ids_keys, k_max
+
+
 class PointCNN:
     def __init__(self, points, features, is_training, setting):
         xconv_params = setting.xconv_params
         fc_params = setting.fc_params
         with_X_transformation = setting.with_X_transformation
         sorting_method = setting.sorting_method
+        knn_chunk_size = getattr(setting, 'knn_chunk_size', None)
+        self.knn_method = getattr(setting, 'knn_method', 'dense')
+        # duplicate suppression is a py_func round trip to the host per KNN, and cannot be frozen
+        self.knn_unique = getattr(setting, 'knn_unique', False)
+        fused_X = getattr(setting, 'x_transformation_fused', False)
         N = tf.shape(points)[0]
 
+        if self.knn_method == 'voxel':
+            from knn import tf_knn
+            self.tf_knn = tf_knn
+
+        # layers querying the same (pts, qrs) pair share one KNN, computed with the largest K * D and
+        # sliced, the sorted top k of a smaller k is a prefix of it
+        self.knn_cache_enabled = getattr(setting, 'knn_cache', True)
+        xconv_keys, xdconv_keys, ids_keys, self.knn_k_max = knn_cache_plan(xconv_params,
+                                                                           getattr(setting, 'xdconv_params', []),
+                                                                           setting.sampling)
+        self.knn_cache = dict()  # key -> (indices, pts, qrs, tag of the computing layer)
+        self.knn_stats = []  # (tag, key, K * D, tag of the computing layer)
+
         if setting.sampling == 'fps':
             from sampling import tf_sampling
 
@@ -95,7 +181,11 @@ class PointCNN:
                     indices = tf.concat([batch_indices, tf.expand_dims(fps_indices,-1)], axis=-1)
                     qrs = tf.gather_nd(pts, indices, name= tag + 'qrs') # (N, P, 3)
                 elif setting.sampling == 'ids':
-                    indices = pf.inverse_density_sampling(pts, K, P)
+                    # the density comes from the (possibly cached) K nearest points, not a P x P matrix
+                    nn_indices = self.knn(pts, pts, ids_keys[layer_idx], K, tag + 'ids_', knn_chunk_size)
+                    nn_pts = tf.gather_nd(pts, nn_indices, name=tag + 'ids_nn_pts')  # (N, P_pts, K, 3)
+                    nn_distances = tf.reduce_sum(tf.square(nn_pts - tf.expand_dims(pts, axis=2)), axis=-1)
+                    indices = pf.inverse_density_sampling(pts, K, P, nn_distances)
                     qrs = tf.gather_nd(pts, indices)
                 elif setting.sampling == 'random':
                     qrs = tf.slice(pts, (0, 0, 0), (-1, P, -1), name=tag + 'qrs')  # (N, P, 3)
@@ -111,9 +201,11 @@ class PointCNN:
                 C_prev = xconv_params[layer_idx - 1]['C']
                 C_pts_fts = C_prev // 4
                 depth_multiplier = math.ceil(C / C_prev)
-            with_global = (setting.with_global and layer_idx == len(xconv_params) - 1)
+            with_global = setting.with_global if layer_idx == len(xconv_params) - 1 else False
+            indices_dilated = self.knn(pts, qrs, xconv_keys[layer_idx], K * D, tag, knn_chunk_size)
             fts_xconv = xconv(pts, fts, qrs, tag, N, K, D, P, C, C_pts_fts, is_training, with_X_transformation,
-                              depth_multiplier, sorting_method, with_global)
+                              depth_multiplier, sorting_method, with_global, indices_dilated=indices_dilated,
+                              fused_X=fused_X)
             fts_list = []
             for link in links:
                 fts_from_link = self.layer_fts[link]
@@ -143,8 +235,9 @@ class PointCNN:
                 C_prev = xconv_params[pts_layer_idx]['C']
                 C_pts_fts = C_prev // 4
                 depth_multiplier = 1
+                indices_dilated = self.knn(pts, qrs, xdconv_keys[layer_idx], K * D, tag, knn_chunk_size)
                 fts_xdconv = xconv(pts, fts, qrs, tag, N, K, D, P, C, C_pts_fts, is_training, with_X_transformation,
-                                   depth_multiplier, sorting_method)
+                                   depth_multiplier, sorting_method, indices_dilated=indices_dilated, fused_X=fused_X)
                 fts_concat = tf.concat([fts_xdconv, fts_qrs], axis=-1, name=tag + 'fts_concat')
                 fts_fuse = pf.dense(fts_concat, C, tag + 'fts_fuse', is_training)
                 self.layer_pts.append(qrs)
@@ -157,3 +250,39 @@ class PointCNN:
             fc = pf.dense(self.fc_layers[-1], C, 'fc{:d}'.format(layer_idx), is_training)
             fc_drop = tf.layers.dropout(fc, dropout_rate, training=is_training, name='fc{:d}_drop'.format(layer_idx))
             self.fc_layers.append(fc_drop)
+
+    # return shape is (N, P, k, 2)
+    def knn(self, pts, qrs, key, k, tag, knn_chunk_size=None):
+        if self.knn_cache_enabled and key in self.knn_cache:
+            indices, _, _, tag_computed = self.knn_cache[key]
+        else:
+            k_computed = self.knn_k_max[key] if self.knn_cache_enabled else k
+            if self.knn_method == 'voxel':
+                with tf.device('/cpu:0'):
+                    _, indices = self.tf_knn.voxel_knn(k_computed, qrs, pts)
+            else:
+                _, indices = pf.knn_indices_general(qrs, pts, k_computed, True, unique=self.knn_unique,
+                                                    chunk_size=knn_chunk_size)
+            tag_computed = tag
+            if self.knn_cache_enabled:
+                self.knn_cache[key] = (indices, pts, qrs, tag)
+        self.knn_stats.append((tag, key, k, tag_computed))
+        if tag_computed != tag:
+            print('{}knn reuses the K={:d} neighbors of {}knn'.format(tag, self.knn_k_max[key], tag_computed))
+        return indices if indices.shape[2] == k else indices[:, :, :k, :]
+
+    # time the KNN of every cache entry, layers that reuse an entry saved that time
+    # return a list of (tag, seconds saved) for the layers
+    def knn_time_saved(self, sess, feed_dict, repeat_num=10):
+        def time_run(fetches):
+            sess.run(fetches, feed_dict=feed_dict)  # warm up
+            time_start = time.time()
+            for _ in range(repeat_num):
+                sess.run(fetches, feed_dict=feed_dict)
+            return (time.time() - time_start) / repeat_num
+
+        time_knn = dict()
+        for key, (indices, pts, qrs, _) in self.knn_cache.items():
+            time_knn[key] = max(time_run(indices) - time_run([pts, qrs]), 0.0)
+        return [(tag, time_knn[key] if tag != tag_computed else 0.0)
+                for tag, key, _, tag_computed in self.knn_stats]
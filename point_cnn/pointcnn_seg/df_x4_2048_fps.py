@@ -13,6 +13,15 @@ label_weights = [0.4, 0.95, 0.97, 0.7, 0.8,  0.99, 1.0, 0.9]
 # for c in range(num_class):
 #     label_weights.append(1.0)
 
+# frustum sampler, plain shuffling when sampler_class_freqs is None and sampler_hard_example is False
+# target point share of every category in a batch
+sampler_class_freqs = None
+# sampler_class_freqs = [0.4, 0.1, 0.05, 0.15, 0.1, 0.05, 0.05, 0.1]
+# upweight frustums by running loss, weight *= (loss / mean_loss) ** sampler_hard_power
+sampler_hard_example = False
+sampler_loss_momentum = 0.9
+sampler_hard_power = 1.0
+
 learning_rate_base = 0.005
 decay_steps = 80000
 decay_rate = 0.8
@@ -67,6 +76,27 @@ data_dim = 4
 use_extra_features = True
 with_normal_feature = False
 with_X_transformation = True
+# the X-transformation as one CPU op (xtransform/tf_xtransform.so), its batch normalizations use the moving
+# statistics and are not updated: inference / frozen-BN fine-tuning only, where is_training is not a constant
+# False the composed X-transformation is built instead
+x_transformation_fused = False
 sorting_method = None
 
+# process the KNN queries this many at a time to bound the distance matrix memory, None for all at once
+knn_chunk_size = None
+# 'dense' for the distance matrix, 'voxel' for the voxel hash KNN op (CPU, knn/tf_knn.so), which scales to
+# full frustums, duplicated points are not suppressed with it
+knn_method = 'dense'
+# rank duplicated points (repeated lidar returns) after the others in the dense KNN, a py_func per KNN on
+# the host, which cannot be part of a frozen graph
+knn_unique = False
+
+# lighter inference variants of this setting's checkpoints (utils/fast_profile.py), picked with --profile
+# in test_df_seg_processes_fru.py and compared with sweep_profiles_df_fru.py
+fast_profiles = {
+    'fast': dict(sample_num=1536, P_scale=0.75, D=1),
+    'faster': dict(sample_num=1024, P_scale=0.5, D=1, with_global=False),
+    'fast_int8': dict(sample_num=1536, P_scale=0.75, D=1, precision='int8'),
+}
+
 keep_remainder = True
\ No newline at end of file
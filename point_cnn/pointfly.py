@@ -101,6 +101,46 @@ def augment(points, xforms, range=None):
     return points_xformed + jitter_clipped
 
 
+# take the tower_idx-th of tower_num contiguous slices along the batch dimension,
+# slice sizes differ by at most one when the batch size is not divisible, and some are empty when the batch
+# is smaller than tower_num
+def split_batch(data, tower_num, tower_idx):
+    if tower_num == 1:
+        return data
+    batch_size = tf.shape(data)[0]
+    start = (batch_size * tower_idx) // tower_num
+    end = (batch_size * (tower_idx + 1)) // tower_num
+    return data[start:end]
+
+
+# tower_grads is a list of compute_gradients() results, one per tower
+# tower_weights is None for the plain mean, or a scalar tensor per tower, the number of nonzero label weights
+# of its slice: with losses reduced by SUM_BY_NONZERO_WEIGHTS (the tf.losses default) the weighted mean is then
+# the gradient of the loss of the whole batch, whatever the slice sizes, and an empty slice counts for nothing.
+# A loss term every tower adds in full, like the regularization, keeps its gradient since the weights sum to 1.
+# return the per-variable average, in the format of apply_gradients()
+def average_gradients(tower_grads, tower_weights=None):
+    if len(tower_grads) == 1:
+        return tower_grads[0]
+    tower_num = len(tower_grads)
+    if tower_weights is None:
+        scales = [1.0 / tower_num] * tower_num
+    else:
+        weight_sum = tf.add_n(tower_weights)
+        # no weighted label in the whole batch, only terms like the regularization are left, take the plain mean
+        scales = [tf.where(weight_sum > 0, weight / tf.maximum(weight_sum, 1e-8), tf.constant(1.0 / tower_num))
+                  for weight in tower_weights]
+    average_grads = []
+    for grads_and_vars in zip(*tower_grads):
+        grads = [grad * scale for (grad, _), scale in zip(grads_and_vars, scales) if grad is not None]
+        var = grads_and_vars[0][1]
+        if not grads:
+            average_grads.append((None, var))
+            continue
+        average_grads.append((tf.add_n(grads), var))
+    return average_grads
+
+
 # A shape is (N, C)
 def distance_matrix(A):
     r = tf.reduce_sum(A * A, 1, keep_dims=True)
@@ -128,50 +168,90 @@ def batch_distance_matrix_general(A, B):
 
 
 # A shape is (N, P, C)
+# return shape is (N, 1, P), 1 for a point equal to a point of smaller index in the same sample
+# one lexicographic sort of the whole batch by (sample, coordinates), equal points end up adjacent and,
+# the sort being stable, in index order, so all but the first of each run are duplicates
 def find_duplicate_columns(A):
-    N = A.shape[0]
-    P = A.shape[1]
-    indices_duplicated = np.fill((N, 1, P), 1, dtype=np.int32)
-    for idx in range(N):
-        _, indices = np.unique(A[idx], return_index=True, axis=0)
-        indices_duplicated[idx, :, indices] = 0
+    N, P, C = A.shape
+    A_flat = A.reshape(N * P, C)
+    batch_ids = np.repeat(np.arange(N), P)
+    order = np.lexsort([A_flat[:, c] for c in reversed(range(C))] + [batch_ids])
+    A_sorted = A_flat[order]
+    same = np.all(A_sorted[1:] == A_sorted[:-1], axis=1) & (batch_ids[order[1:]] == batch_ids[order[:-1]])
+    indices_duplicated = np.zeros(N * P, dtype=np.int32)
+    indices_duplicated[order[1:][same]] = 1
+    return indices_duplicated.reshape(N, 1, P)
+
+
+# A shape is (N, P, C)
+# return shape is (N, 1, P)
+def duplicate_columns(A):
+    indices_duplicated = tf.py_func(find_duplicate_columns, [A], tf.int32, stateful=False)
+    indices_duplicated.set_shape(A.get_shape()[:1].concatenate([1]).concatenate(A.get_shape()[1:2]))
     return indices_duplicated
 
 
-# add a big value to duplicate columns
-def prepare_for_unique_top_k(D, A):
-    indices_duplicated = tf.py_func(find_duplicate_columns, [A], tf.int32)
-    D += tf.reduce_max(D)*tf.cast(indices_duplicated, tf.float32)
+# add a value bigger than any distance to duplicate columns, so they are ranked last
+def prepare_for_unique_top_k(D, A, indices_duplicated=None):
+    if indices_duplicated is None:
+        indices_duplicated = duplicate_columns(A)
+    return D + (tf.reduce_max(D) + 1.0) * tf.cast(indices_duplicated, tf.float32)
 
 
 # return shape is (N, P, K, 2)
-def knn_indices(points, k, sort=True, unique=True):
+def knn_indices(points, k, sort=True, unique=False):
     points_shape = tf.shape(points)
     batch_size = points_shape[0]
     point_num = points_shape[1]
 
     D = batch_distance_matrix(points)
     if unique:
-        prepare_for_unique_top_k(D, points)
+        D = prepare_for_unique_top_k(D, points)
     distances, point_indices = tf.nn.top_k(-D, k=k, sorted=sort)
     batch_indices = tf.tile(tf.reshape(tf.range(batch_size), (-1, 1, 1, 1)), (1, point_num, k, 1))
     indices = tf.concat([batch_indices, tf.expand_dims(point_indices, axis=3)], axis=3)
     return -distances, indices
 
 
+# queries shape is (N, P_Q, C), points shape is (N, P, C)
+# return shape is (N, P_Q, K), (N, P_Q, K)
+# indices_duplicated is None or (N, 1, P) from duplicate_columns(points)
+def _top_k_general(queries, points, k, sort, indices_duplicated):
+    D = batch_distance_matrix_general(queries, points)
+    if indices_duplicated is not None:
+        D = prepare_for_unique_top_k(D, points, indices_duplicated)
+    distances, point_indices = tf.nn.top_k(-D, k=k, sorted=sort)
+    return -distances, point_indices
+
+
 # return shape is (N, P, K, 2)
-def knn_indices_general(queries, points, k, sort=True, unique=True):
+# unique ranks duplicated points last, with a py_func on the host, so it is off unless asked for
+# with chunk_size, the queries are processed chunk_size at a time, one after another, so only a
+# (N, chunk_size, P) block of the distance matrix is alive at once. Each query row is computed and
+# ranked exactly as in the dense case, the results are identical.
+def knn_indices_general(queries, points, k, sort=True, unique=False, chunk_size=None):
     queries_shape = tf.shape(queries)
     batch_size = queries_shape[0]
     point_num = queries_shape[1]
 
-    D = batch_distance_matrix_general(queries, points)
-    if unique:
-        prepare_for_unique_top_k(D, points)
-    distances, point_indices = tf.nn.top_k(-D, k=k, sorted=sort)  # (N, P, K)
+    indices_duplicated = duplicate_columns(points) if unique else None
+    if chunk_size is None:
+        distances, point_indices = _top_k_general(queries, points, k, sort, indices_duplicated)  # (N, P, K)
+    else:
+        chunk_num = (point_num + chunk_size - 1) // chunk_size
+        queries_padded = tf.pad(queries, ((0, 0), (0, chunk_num * chunk_size - point_num), (0, 0)))
+        queries_chunks = tf.reshape(queries_padded, (batch_size, chunk_num, chunk_size, -1))
+        queries_chunks = tf.transpose(queries_chunks, perm=(1, 0, 2, 3))  # (chunk_num, N, chunk_size, C)
+        distances, point_indices = tf.map_fn(lambda queries_chunk: _top_k_general(queries_chunk, points, k,
+                                                                                   sort, indices_duplicated),
+                                             queries_chunks, dtype=(tf.float32, tf.int32),
+                                             parallel_iterations=1)  # (chunk_num, N, chunk_size, K)
+        distances = tf.reshape(tf.transpose(distances, perm=(1, 0, 2, 3)), (batch_size, -1, k))[:, :point_num]
+        point_indices = tf.reshape(tf.transpose(point_indices, perm=(1, 0, 2, 3)),
+                                   (batch_size, -1, k))[:, :point_num]
     batch_indices = tf.tile(tf.reshape(tf.range(batch_size), (-1, 1, 1, 1)), (1, point_num, k, 1))
     indices = tf.concat([batch_indices, tf.expand_dims(point_indices, axis=3)], axis=3)
-    return -distances, indices
+    return distances, indices
 
 
 # indices is (N, P, K, 2)
@@ -272,22 +352,20 @@ def curvature_based_sample(nn_pts, k):
     return indices
 
 
-def random_choice_2d(size, prob_matrix):
-    n_row = prob_matrix.shape[0]
-    n_col = prob_matrix.shape[1]
-    choices = np.ones((n_row, size), dtype=np.int32)
-    for idx_row in range(n_row):
-        choices[idx_row] = np.random.choice(n_col, size=size, replace=False, p=prob_matrix[idx_row])
-    return choices
-
-
-def inverse_density_sampling(points, k, sample_num):
-    D = batch_distance_matrix(points)
-    distances, _ = tf.nn.top_k(-D, k=k, sorted=False)
-    distances_avg = tf.abs(tf.reduce_mean(distances, axis=-1)) + 1e-8
-    prob_matrix = distances_avg / tf.reduce_sum(distances_avg, axis=-1, keep_dims=True)
-    point_indices = tf.py_func(random_choice_2d, [sample_num, prob_matrix], tf.int32)
-    point_indices.set_shape([points.get_shape()[0], sample_num])
+# points shape is (N, P, C), nn_distances shape is (N, P, K), the squared distances of every point to its K
+# nearest points, computed from a P x P distance matrix when not given
+# return shape is (N, sample_num, 2)
+# sample_num points drawn without replacement with probability proportional to their mean squared KNN distance,
+# in graph with the Gumbel top-k trick: top-k of log(p) + Gumbel noise is such a draw
+def inverse_density_sampling(points, k, sample_num, nn_distances=None):
+    if nn_distances is None:
+        D = batch_distance_matrix(points)
+        distances, _ = tf.nn.top_k(-D, k=k, sorted=False)
+        nn_distances = -distances
+    distances_avg = tf.abs(tf.reduce_mean(nn_distances, axis=-1)) + 1e-8
+    log_prob = tf.log(distances_avg) - tf.log(tf.reduce_sum(distances_avg, axis=-1, keep_dims=True))
+    gumbel = -tf.log(-tf.log(tf.random_uniform(tf.shape(log_prob)) + 1e-20))
+    _, point_indices = tf.nn.top_k(log_prob + gumbel, k=sample_num, sorted=False)
 
     batch_size = tf.shape(points)[0]
     batch_indices = tf.tile(tf.reshape(tf.range(batch_size), (-1, 1, 1)), (1, sample_num, 1))
@@ -295,6 +373,41 @@ def inverse_density_sampling(points, k, sample_num):
     return indices
 
 
+# labels and predictions are int tensors of the same shape, weights is None or a float tensor of that shape
+# return the (num_class, num_class) confusion matrix local variable, rows are labels, and its update op
+# the variable lives in the current name scope, so the usual 'metrics' scoped reset op also resets it
+def streaming_confusion_matrix(labels, predictions, num_class, weights=None, name='confusion_matrix'):
+    confusion = tf.Variable(tf.zeros((num_class, num_class), dtype=tf.float64), trainable=False,
+                            collections=[tf.GraphKeys.LOCAL_VARIABLES, tf.GraphKeys.METRIC_VARIABLES], name=name)
+    cell_indices = tf.reshape(tf.cast(labels, tf.int32) * num_class + tf.cast(predictions, tf.int32), (-1,))
+    if weights is not None:
+        weights = tf.reshape(tf.cast(weights, tf.float64), (-1,))
+    counts = tf.bincount(cell_indices, weights=weights, minlength=num_class * num_class,
+                         maxlength=num_class * num_class, dtype=tf.float64)
+    update_op = tf.assign_add(confusion, tf.reshape(counts, (num_class, num_class)), name=name + '_update')
+    return confusion, update_op
+
+
+# confusion shape is (C, C), rows are labels, columns are predictions
+# return overall accuracy, mean per class accuracy, mean iou and per class iou (C,)
+# classes absent from both labels and predictions are left out of the means
+def confusion_matrix_metrics(confusion):
+    true_positive = tf.diag_part(confusion)
+    label_sum = tf.reduce_sum(confusion, axis=1)
+    prediction_sum = tf.reduce_sum(confusion, axis=0)
+    union = label_sum + prediction_sum - true_positive
+
+    overall_acc = tf.reduce_sum(true_positive) / tf.maximum(tf.reduce_sum(confusion), 1e-12)
+    per_class_acc = true_positive / tf.maximum(label_sum, 1e-12)
+    label_present = tf.cast(label_sum > 0, tf.float64)
+    mean_per_class_acc = tf.reduce_sum(per_class_acc * label_present) / tf.maximum(tf.reduce_sum(label_present), 1.0)
+    per_class_iou = true_positive / tf.maximum(union, 1e-12)
+    union_present = tf.cast(union > 0, tf.float64)
+    mean_iou = tf.reduce_sum(per_class_iou * union_present) / tf.maximum(tf.reduce_sum(union_present), 1.0)
+    return (tf.cast(overall_acc, tf.float32), tf.cast(mean_per_class_acc, tf.float32),
+            tf.cast(mean_iou, tf.float32), tf.cast(per_class_iou, tf.float32))
+
+
 def batch_normalization(data, is_training, name, reuse=None):
     return tf.layers.batch_normalization(data, momentum=0.99, training=is_training,
                                          beta_regularizer=tf.contrib.layers.l2_regularizer(scale=1.0),
@@ -302,6 +415,21 @@ def batch_normalization(data, is_training, name, reuse=None):
                                          reuse=reuse, name=name)
 
 
+# return the (scale, shift) of the inference mode batch normalization over the last axis of channels,
+# from the variables tf.layers.batch_normalization creates under name, the moving statistics are not updated
+def batch_normalization_affine(channels, name, reuse=None, epsilon=1e-3):
+    with tf.variable_scope(name, reuse=reuse):
+        gamma = tf.get_variable('gamma', (channels,), initializer=tf.ones_initializer(),
+                                regularizer=tf.contrib.layers.l2_regularizer(scale=1.0))
+        beta = tf.get_variable('beta', (channels,), initializer=tf.zeros_initializer(),
+                               regularizer=tf.contrib.layers.l2_regularizer(scale=1.0))
+        moving_mean = tf.get_variable('moving_mean', (channels,), initializer=tf.zeros_initializer(), trainable=False)
+        moving_variance = tf.get_variable('moving_variance', (channels,), initializer=tf.ones_initializer(),
+                                          trainable=False)
+    scale = gamma * tf.rsqrt(moving_variance + epsilon)
+    return scale, beta - moving_mean * scale
+
+
 def separable_conv2d(input, output, name, is_training, kernel_size, depth_multiplier=1,
                      reuse=None, with_bn=True, activation=tf.nn.elu):
     conv2d = tf.layers.separable_conv2d(input, output, kernel_size=kernel_size, strides=(1, 1), padding='VALID',
@@ -0,0 +1,62 @@
+import numpy as np
+import tensorflow as tf
+
+import pointfly as pf
+
+
+# a softmax classifier with a regularized weight, the loss of train_val_seg_df_fru.py without the net
+def build_loss(points, labels, weights):
+  with tf.variable_scope('classifier', reuse=tf.AUTO_REUSE):
+    kernel = tf.get_variable('kernel', (3, 4), initializer=tf.glorot_normal_initializer(),
+                             regularizer=tf.contrib.layers.l2_regularizer(scale=1.0))
+    bias = tf.get_variable('bias', (4,), initializer=tf.zeros_initializer())
+  logits = tf.tensordot(points, kernel, axes=1) + bias
+  loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits, weights=weights, loss_collection=None)
+  return loss + 1e-2 * tf.losses.get_regularization_loss()
+
+
+# gradients of the whole batch on one tower and averaged over num_towers slices, as in train_val_seg_df_fru.py
+def tower_gradients(points, labels, weights, num_towers):
+  optimizer = tf.train.GradientDescentOptimizer(1.0)
+  grads_single = optimizer.compute_gradients(build_loss(points, labels, weights))
+  tower_grads = []
+  tower_weights = []
+  for tower_idx in range(num_towers):
+    weights_tower = pf.split_batch(weights, num_towers, tower_idx)
+    tower_grads.append(optimizer.compute_gradients(build_loss(pf.split_batch(points, num_towers, tower_idx),
+                                                              pf.split_batch(labels, num_towers, tower_idx),
+                                                              weights_tower)))
+    tower_weights.append(tf.count_nonzero(weights_tower, dtype=tf.float32))
+  grads_towers = pf.average_gradients(tower_grads, tower_weights)
+  return [grad for grad, _ in grads_single], [grad for grad, _ in grads_towers]
+
+
+class AverageGradientsTest(tf.test.TestCase):
+  def check(self, batch_size, num_towers, weights_np):
+    np.random.seed(batch_size * 10 + num_towers)
+    with tf.Graph().as_default():
+      points = tf.constant(np.random.random((batch_size, 16, 3)).astype('float32') - 0.5)
+      labels = tf.constant(np.random.randint(0, 4, size=(batch_size, 16)).astype('int64'))
+      grads_single, grads_towers = tower_gradients(points, labels, tf.constant(weights_np), num_towers)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        grads_single_val, grads_towers_val = sess.run([grads_single, grads_towers])
+    for grad_single_val, grad_towers_val in zip(grads_single_val, grads_towers_val):
+      self.assertAllClose(grad_towers_val, grad_single_val, rtol=1e-5, atol=1e-6)
+
+  def test_uneven(self):
+    # slices of 2, 2 and 3 frustums, with label weights of different sums and zeros, as label_weights makes them
+    np.random.seed(0)
+    weights_np = np.random.choice([0.0, 0.4, 1.0], size=(7, 16)).astype('float32')
+    weights_np[2:4] = 0.0
+    self.check(7, 3, weights_np)
+
+  def test_batch_smaller_than_towers(self):
+    np.random.seed(1)
+    self.check(2, 3, np.random.choice([0.0, 0.7, 1.0], size=(2, 16)).astype('float32'))
+
+  def test_single_tower(self):
+    self.check(5, 1, np.ones((5, 16), dtype='float32'))
+
+if __name__=='__main__':
+  tf.test.main()
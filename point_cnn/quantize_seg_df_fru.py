@@ -0,0 +1,355 @@
+#!/usr/bin/python3
+"""Post-training int8 quantization of a DF segmentation checkpoint for CPU inference."""
+
+# python3 quantize_seg_df_fru.py -i /ssd/Datasets/DataFountain/data_bin_fru \
+# -t /ssd/Datasets/DataFountain/train.txt \
+# -v /ssd/Datasets/DataFountain/val.txt \
+# -l /ssd/wyc/models/data_fountain/pointcnn_seg_df_x4_2048_fps_xxxx/ckpts/iter-80000 \
+# -o /ssd/wyc/models/data_fountain/pointcnn_seg_df_x4_2048_fps_xxxx/frozen_int8.pb \
+# -m pointcnn_seg -x df_x4_2048_fps
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+import types
+import random
+import argparse
+import importlib
+import data_utils
+import numpy as np
+import pointfly as pf
+import tensorflow as tf
+from datetime import datetime
+from utils import df_utils
+from utils import fast_profile
+from utils import seg_metrics
+from tensorflow.core.framework import tensor_pb2
+from tensorflow.core.framework import types_pb2
+from tensorflow.python.framework import graph_util
+from tensorflow.python.framework import tensor_util
+
+# ops rewritten to their quantized kernels, depthwise convolutions have none and stay float
+QUANTIZABLE_OPS = ['MatMul', 'Conv2D']
+# ops a constant weight may pass through on its way from the frozen variable to the matmul
+WEIGHT_PATH_OPS = ['Const', 'Identity', 'Transpose', 'Reshape', 'ExpandDims', 'Squeeze']
+# ops that call back into the Python process that built the graph
+PY_FUNC_OPS = ['PyFunc', 'PyFuncStateless', 'EagerPyFunc']
+
+
+def load_setting(model_name, setting_name, profile_name_or_text=None):
+    """
+    import a setting and apply a fast profile to it
+    :return: setting namespace, profile name, profile dict
+    """
+    setting_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), model_name)
+    sys.path.append(setting_path)
+    setting = importlib.import_module(setting_name)
+    profile_name, profile = fast_profile.load_profile(setting, profile_name_or_text)
+    return fast_profile.apply_profile(setting, profile), profile_name, profile
+
+
+def build_frozen_graph(model_name, setting, path_ckpt):
+    """
+    build the inference graph of a checkpoint and freeze its variables, without py_func ops so the frozen graph
+    runs in any process: the KNN duplicate suppression is turned off and FPS needs the compiled sampling op
+    :return: frozen float graph def
+    """
+    model = importlib.import_module(model_name)
+    setting = types.SimpleNamespace(**{name: value for name, value in vars(setting).items()
+                                       if not name.startswith('__')})
+    setting.knn_unique = False
+
+    graph = tf.Graph()
+    with graph.as_default():
+        xforms = tf.placeholder(tf.float32, shape=(None, 3, 3), name="xforms")
+        jitter_range = tf.placeholder(tf.float32, shape=(1), name="jitter_range")
+        pts_fts = tf.placeholder(tf.float32, shape=(None, setting.sample_num, setting.data_dim), name='pts_fts')
+        is_training = tf.constant(False, dtype=tf.bool, name='is_training')
+
+        features = None
+        if setting.data_dim > 3:
+            points, features = tf.split(pts_fts, [3, setting.data_dim - 3], axis=-1, name='split_points_features')
+            if not setting.use_extra_features:
+                features = None
+        else:
+            points = pts_fts
+        points_augmented = pf.augment(points, xforms, jitter_range)
+
+        net = model.Net(points_augmented, features, is_training, setting)
+        _ = tf.argmax(net.logits, axis=-1, name='predictions')
+
+        saver = tf.train.Saver()
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            saver.restore(sess, path_ckpt)
+            graph_def = graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), ['predictions'])
+    for node in graph_def.node:
+        node.device = ''
+    check_no_py_func(graph_def)
+    return graph_def
+
+
+def check_no_py_func(graph_def):
+    """
+    raise if a py_func is left in a frozen graph, its callback lives in the building process only
+    """
+    py_funcs = [node.name for node in graph_def.node if node.op in PY_FUNC_OPS]
+    if py_funcs:
+        raise ValueError('The frozen graph has {:d} py_func nodes ({}), compile sampling/tf_sampling_so.so for FPS!'
+                         .format(len(py_funcs), ', '.join(py_funcs[:5])))
+
+
+def quantizable_nodes(graph_def):
+    """
+    the float MatMul/Conv2D nodes whose second input is computed from constants only
+    :return: list of node defs
+    """
+    nodes = {node.name: node for node in graph_def.node}
+
+    def is_constant(name):
+        node = nodes[name.lstrip('^').split(':')[0]]
+        return node.op in WEIGHT_PATH_OPS and all(is_constant(input) for input in node.input)
+
+    result = []
+    for node in graph_def.node:
+        if node.op not in QUANTIZABLE_OPS or node.attr['T'].type != types_pb2.DT_FLOAT:
+            continue
+        if node.op == 'Conv2D' and (node.attr['data_format'].s not in [b'', b'NHWC']
+                                    or any(d != 1 for d in node.attr['dilations'].list.i)):
+            continue
+        if is_constant(node.input[1]):
+            result.append(node)
+    return result
+
+
+def calibrate(graph_def, nodes, batches):
+    """
+    activation ranges of the quantizable nodes, the extremes seen over the calibration batches
+    :param batches: iterable of feed dicts keyed by tensor name
+    :return: weights {node name: float weight array}, ranges {node name: (input min, input max, output min, output max)}
+    """
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        weights_ops = [graph.get_tensor_by_name(node.input[1] if ':' in node.input[1] else node.input[1] + ':0')
+                       for node in nodes]
+        ranges_ops = []
+        for node in nodes:
+            input = graph.get_tensor_by_name(node.input[0] if ':' in node.input[0] else node.input[0] + ':0')
+            output = graph.get_tensor_by_name(node.name + ':0')
+            ranges_ops.append(tf.stack([tf.reduce_min(input), tf.reduce_max(input),
+                                        tf.reduce_min(output), tf.reduce_max(output)]))
+        ranges_op = tf.stack(ranges_ops)
+
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            weights = sess.run(weights_ops)
+            ranges = None
+            for feed_dict in batches:
+                ranges_batch = sess.run(ranges_op, feed_dict=feed_dict)
+                if ranges is None:
+                    ranges = ranges_batch
+                else:
+                    ranges[:, 0::2] = np.minimum(ranges[:, 0::2], ranges_batch[:, 0::2])
+                    ranges[:, 1::2] = np.maximum(ranges[:, 1::2], ranges_batch[:, 1::2])
+    return ({node.name: w for node, w in zip(nodes, weights)},
+            {node.name: tuple(r) for node, r in zip(nodes, ranges)})
+
+
+def _const_node(name, value, dtype=tf.float32):
+    node = tf.NodeDef(name=name, op='Const')
+    node.attr['dtype'].type = dtype.as_datatype_enum
+    node.attr['value'].tensor.CopyFrom(tensor_util.make_tensor_proto(value, dtype=dtype))
+    return node
+
+
+# quint8 weights with MIN_FIRST layout, the range always contains 0 as QuantizeV2 makes it for activations
+def _quantized_weights_nodes(name, weights):
+    w_min = min(float(weights.min()), 0.0)
+    w_max = max(float(weights.max()), w_min + 1e-6)
+    weights_quantized = np.round((weights - w_min) * (255.0 / (w_max - w_min))).astype(np.uint8)
+    node = tf.NodeDef(name=name, op='Const')
+    node.attr['dtype'].type = types_pb2.DT_QUINT8
+    node.attr['value'].tensor.CopyFrom(tensor_pb2.TensorProto(
+        dtype=types_pb2.DT_QUINT8, tensor_shape=tf.TensorShape(weights.shape).as_proto(),
+        tensor_content=weights_quantized.tobytes()))
+    return [node, _const_node(name + '_min', w_min), _const_node(name + '_max', w_max)]
+
+
+def quantize_graph(graph_def, weights, ranges):
+    """
+    rewrite the calibrated nodes to QuantizeV2 -> QuantizedMatMul/QuantizedConv2D -> Requantize -> Dequantize,
+    with the calibrated ranges frozen in, the Dequantize keeps the original node name so consumers are untouched
+    :return: quantized graph def, pruned to predictions
+    """
+    result = tf.GraphDef()
+    result.versions.CopyFrom(graph_def.versions)
+    for node in graph_def.node:
+        if node.name not in ranges:
+            result.node.extend([node])
+            continue
+        name = node.name
+        input_min, input_max, output_min, output_max = ranges[name]
+        output_max = max(output_max, output_min + 1e-6)
+
+        quantize = tf.NodeDef(name=name + '_eightbit_quantize', op='QuantizeV2',
+                              input=[node.input[0], name + '_eightbit_input_min', name + '_eightbit_input_max'])
+        quantize.attr['T'].type = types_pb2.DT_QUINT8
+        quantize.attr['mode'].s = b'MIN_FIRST'
+
+        weights_name = name + '_eightbit_weights'
+        inputs = [quantize.name, weights_name, quantize.name + ':1', quantize.name + ':2',
+                  weights_name + '_min', weights_name + '_max']
+        if node.op == 'MatMul':
+            quantized = tf.NodeDef(name=name + '_eightbit_quantized', op='QuantizedMatMul', input=inputs)
+            quantized.attr['T1'].type = types_pb2.DT_QUINT8
+            quantized.attr['T2'].type = types_pb2.DT_QUINT8
+            quantized.attr['Toutput'].type = types_pb2.DT_QINT32
+            quantized.attr['transpose_a'].b = node.attr['transpose_a'].b
+            quantized.attr['transpose_b'].b = node.attr['transpose_b'].b
+        else:
+            quantized = tf.NodeDef(name=name + '_eightbit_quantized', op='QuantizedConv2D', input=inputs)
+            quantized.attr['Tinput'].type = types_pb2.DT_QUINT8
+            quantized.attr['Tfilter'].type = types_pb2.DT_QUINT8
+            quantized.attr['out_type'].type = types_pb2.DT_QINT32
+            for key in ['strides', 'padding', 'dilations']:
+                if key in node.attr:
+                    quantized.attr[key].CopyFrom(node.attr[key])
+
+        requantize = tf.NodeDef(name=name + '_eightbit_requantize', op='Requantize',
+                                input=[quantized.name, quantized.name + ':1', quantized.name + ':2',
+                                       name + '_eightbit_output_min', name + '_eightbit_output_max'])
+        requantize.attr['Tinput'].type = types_pb2.DT_QINT32
+        requantize.attr['out_type'].type = types_pb2.DT_QUINT8
+
+        dequantize = tf.NodeDef(name=name, op='Dequantize',
+                                input=[requantize.name, requantize.name + ':1', requantize.name + ':2'])
+        dequantize.attr['T'].type = types_pb2.DT_QUINT8
+        dequantize.attr['mode'].s = b'MIN_FIRST'
+
+        result.node.extend([_const_node(name + '_eightbit_input_min', input_min),
+                            _const_node(name + '_eightbit_input_max', input_max),
+                            _const_node(name + '_eightbit_output_min', output_min),
+                            _const_node(name + '_eightbit_output_max', output_max)]
+                           + _quantized_weights_nodes(weights_name, weights[name])
+                           + [quantize, quantized, requantize, dequantize])
+    # the float weights and their transposes/reshapes are dead now
+    result = graph_util.extract_sub_graph(result, ['predictions'])
+    check_no_py_func(result)
+    return result
+
+
+def load_calibration_frus(dir_bin, path_filelist, calib_num):
+    """
+    a fixed random sample of calib_num frustums of a list
+    """
+    list_fru, _ = data_utils.load_bin_all(dir_bin, path_filelist)
+    random.seed(0)
+    return random.sample(list_fru, min(calib_num, len(list_fru)))
+
+
+def quantize_frozen_graph(graph_def, list_fru_calib, setting):
+    """
+    calibrate and quantize a frozen float graph
+    :return: quantized graph def
+    """
+    nodes = quantizable_nodes(graph_def)
+    print('{}-{:d} of {:d} MatMul/Conv2D nodes are quantizable.'.format(
+        datetime.now(), len(nodes), sum(node.op in QUANTIZABLE_OPS for node in graph_def.node)))
+    weights, ranges = calibrate(graph_def, nodes,
+                                (feed_dict for feed_dict, _, _ in feed_batches(list_fru_calib, setting, seed=1)))
+    print('{}-Calibrated on {:d} frustums.'.format(datetime.now(), len(list_fru_calib)))
+    return quantize_graph(graph_def, weights, ranges)
+
+
+def feed_batches(list_fru, setting, seed):
+    """
+    sampled, val-augmented batches of the frustums as feed dicts, with their labels and weights
+    :return: generator of (feed_dict, labels, weights)
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    batch_size = setting.batch_size
+    for start_idx in range(0, len(list_fru), batch_size):
+        fru_batch = list_fru[start_idx:start_idx + batch_size]
+        points_batch, labels_batch, weights_batch = \
+            df_utils.group_sampling_fru(fru_batch, setting.sample_num, setting.label_weights)
+        xforms_np, _ = pf.get_xforms(len(fru_batch),
+                                     rotation_range=setting.rotation_range_val,
+                                     scaling_range=setting.scaling_range_val,
+                                     order=setting.rotation_order)
+        feed_dict = {'pts_fts:0': points_batch, 'xforms:0': xforms_np,
+                     'jitter_range:0': np.array([setting.jitter_val])}
+        yield feed_dict, labels_batch, weights_batch
+
+
+def evaluate(graph_def, list_fru, setting, threads, seed=0):
+    """
+    mIoU (weighted as in validation) and mean batch latency of a frozen graph, every graph sees the same samples
+    :return: (t_1_mean_iou, seconds per batch)
+    """
+    num_class = setting.num_class
+    confusion = np.zeros((num_class, num_class), dtype=np.float64)
+    duration = 0.0
+    config = tf.ConfigProto(device_count={'GPU': 0}, intra_op_parallelism_threads=threads)
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        predictions_op = graph.get_tensor_by_name('predictions:0')
+        with tf.Session(config=config) as sess:
+            batches = list(feed_batches(list_fru, setting, seed))
+            sess.run(predictions_op, feed_dict=batches[0][0])  # warm up
+            for feed_dict, labels, weights in batches:
+                time_start = time.time()
+                predictions = sess.run(predictions_op, feed_dict=feed_dict)
+                duration += time.time() - time_start
+                confusion += seg_metrics.confusion_matrix(labels, predictions, num_class, weights=weights)
+            batch_num = len(batches)
+
+    # the mean over the classes labeled or predicted, as pf.confusion_matrix_metrics of the validation
+    ious, tps, fps, fns, _, _ = seg_metrics.confusion_metrics(confusion)
+    present = tps + fps + fns > 0
+    return (np.mean(ious[present]) if present.any() else 0.0), duration / batch_num
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir_bin', '-i', help='Path to binary files dir (*.npy)', required=True)
+    parser.add_argument('--filelist', '-t', help='Path to calibration set ground truth (.txt)', required=True)
+    parser.add_argument('--filelist_val', '-v', help='Path to validation set ground truth (.txt)', required=True)
+    parser.add_argument('--load_ckpt', '-l', help='Path to a check point file for load', required=True)
+    parser.add_argument('--output', '-o', help='Path to the quantized frozen graph (.pb)', required=True)
+    parser.add_argument('--model', '-m', help='Model to use', required=True)
+    parser.add_argument('--setting', '-x', help='Setting to use', required=True)
+    parser.add_argument('--profile', help='Fast profile of the setting, a name in its fast_profiles or inline')
+    parser.add_argument('--calib_num', help='Number of frustums for calibrating the ranges', type=int, default=256)
+    parser.add_argument('--val_num', help='Number of val frustums for evaluation, 0 for all', type=int, default=0)
+    parser.add_argument('--threads', help='Intra op threads, 0 for all cores', type=int, default=0)
+    args = parser.parse_args()
+    print(args)
+
+    setting, profile_name, profile = load_setting(args.model, args.setting, args.profile)
+    print('{}-Profile {}: {}.'.format(datetime.now(), profile_name, profile))
+    graph_def = build_frozen_graph(args.model, setting, args.load_ckpt)
+
+    list_fru_calib = load_calibration_frus(args.dir_bin, args.filelist, args.calib_num)
+    graph_def_quantized = quantize_frozen_graph(graph_def, list_fru_calib, setting)
+    with tf.gfile.GFile(args.output, 'wb') as f:
+        f.write(graph_def_quantized.SerializeToString())
+    print('{}-Quantized graph saved to {} ({:.1f}MB, float {:.1f}MB).'.format(
+        datetime.now(), args.output, graph_def_quantized.ByteSize() / 1024 / 1024, graph_def.ByteSize() / 1024 / 1024))
+
+    list_fru_val, _ = data_utils.load_bin_all(args.dir_bin, args.filelist_val)
+    if args.val_num > 0:
+        list_fru_val = list_fru_val[0:args.val_num]
+    mean_iou, latency = evaluate(graph_def, list_fru_val, setting, args.threads)
+    mean_iou_quantized, latency_quantized = evaluate(graph_def_quantized, list_fru_val, setting, args.threads)
+    print('{}-[Float]-T-1 mIOU: {:.4f}  Latency: {:.1f}ms/batch'.format(datetime.now(), mean_iou, latency * 1000))
+    print('{}-[Int8 ]-T-1 mIOU: {:.4f}  Latency: {:.1f}ms/batch'.format(datetime.now(), mean_iou_quantized,
+                                                                        latency_quantized * 1000))
+    print('{}-mIOU delta: {:+.4f}  Speedup: {:.2f}x on {:d} val frustums'.format(
+        datetime.now(), mean_iou_quantized - mean_iou, latency / latency_quantized, len(list_fru_val)))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,12 @@
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/shape_inference.h"
 #include "tensorflow/core/framework/common_shape_fns.h"
+#include "tensorflow/core/util/work_sharder.h"
+#include <algorithm>
+#include <vector>
+#if GOOGLE_CUDA
 #include <cuda_runtime.h>
+#endif
 
 using namespace tensorflow;
 
@@ -62,6 +67,70 @@ REGISTER_OP("GatherPointGrad")
     return Status::OK();
   });
 
+// Incremental FPS of one cloud: O(n) min distance updates per sampled point, O(n*m) in total.
+// The first point is sampled first, ties go to the smaller index.
+void farthestpointsamplingCpu(int n,int m,const float * inp,float * temp,int * out){
+  int old=0;
+  out[0]=old;
+  for (int k=0;k<n;k++)
+    temp[k]=1e38;
+  for (int j=1;j<m;j++){
+    int besti=0;
+    float best=-1;
+    float x1=inp[old*3+0];
+    float y1=inp[old*3+1];
+    float z1=inp[old*3+2];
+    for (int k=0;k<n;k++){
+      float x2=inp[k*3+0]-x1;
+      float y2=inp[k*3+1]-y1;
+      float z2=inp[k*3+2]-z1;
+      float d=x2*x2+y2*y2+z2*z2;
+      float d2=std::min(d,temp[k]);
+      temp[k]=d2;
+      if (d2>best){
+        best=d2;
+        besti=k;
+      }
+    }
+    old=besti;
+    out[j]=old;
+  }
+}
+
+class FarthestPointSampleCpuOp: public OpKernel{
+  public:
+    explicit FarthestPointSampleCpuOp(OpKernelConstruction* context):OpKernel(context) {
+                    OP_REQUIRES_OK(context, context->GetAttr("npoint", &npoint_));
+                    OP_REQUIRES(context, npoint_ > 0, errors::InvalidArgument("FarthestPointSample expects positive npoint"));
+                }
+    void Compute(OpKernelContext * context)override{
+      int m = npoint_;
+
+      const Tensor& inp_tensor=context->input(0);
+      OP_REQUIRES(context,inp_tensor.dims()==3 && inp_tensor.shape().dim_size(2)==3,errors::InvalidArgument("FarthestPointSample expects (batch_size,num_points,3) inp shape"));
+      int b=inp_tensor.shape().dim_size(0);
+      int n=inp_tensor.shape().dim_size(1);
+      OP_REQUIRES(context,n>0,errors::InvalidArgument("FarthestPointSample expects at least one point"));
+      const float * inp=inp_tensor.flat<float>().data();
+      Tensor * out_tensor;
+      OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{b,m},&out_tensor));
+      int * out=out_tensor->flat<int>().data();
+
+      // one cloud per unit of work, the clouds are sampled in parallel
+      auto worker_threads = context->device()->tensorflow_cpu_worker_threads();
+      Shard(worker_threads->num_threads, worker_threads->workers, b, (int64)n * m * 10,
+            [&](int64 start, int64 limit) {
+              std::vector<float> temp(n);
+              for (int64 i=start;i<limit;i++)
+                farthestpointsamplingCpu(n,m,inp+i*n*3,temp.data(),out+i*m);
+            });
+    }
+    private:
+        int npoint_;
+};
+REGISTER_KERNEL_BUILDER(Name("FarthestPointSample").Device(DEVICE_CPU),FarthestPointSampleCpuOp);
+
+#if GOOGLE_CUDA
 void probsampleLauncher(int b,int n,int m,const float * inp_p,const float * inp_r,float * temp,int * out);
 class ProbSampleGpuOp: public OpKernel{
   public:
@@ -176,4 +245,4 @@ class GatherPointGradGpuOp: public OpKernel{
     }
 };
 REGISTER_KERNEL_BUILDER(Name("GatherPointGrad").Device(DEVICE_GPU),GatherPointGradGpuOp);
-
+#endif
@@ -12,7 +12,11 @@ import pickle as pickle
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
-sampling_module=tf.load_op_library(os.path.join(BASE_DIR, 'tf_sampling_so.so'))
+try:
+    sampling_module=tf.load_op_library(os.path.join(BASE_DIR, 'tf_sampling_so.so'))
+except tf.errors.NotFoundError:
+    # not compiled on this node, farthest_point_sample falls back to farthest_point_sample_numpy
+    sampling_module=None
 def prob_sample(inp,inpr):
     '''
 input:
@@ -56,8 +60,32 @@ input:
 returns:
     batch_size * npoint         int32
     '''
+    if sampling_module is None:
+        out=tf.py_func(lambda points: farthest_point_sample_numpy(npoint, points), [inp], tf.int32, stateful=False)
+        out.set_shape(inp.get_shape()[:1].concatenate([npoint]))
+        return out
     return sampling_module.farthest_point_sample(inp, npoint)
 ops.NoGradient('FarthestPointSample')
+def farthest_point_sample_numpy(npoint,inp):
+    '''
+the CPU kernel in NumPy, vectorized over the batch and the points, same order and tie breaking
+input:
+    int32
+    batch_size * ndataset * 3   float32
+returns:
+    batch_size * npoint         int32
+    '''
+    inp=np.asarray(inp,dtype=np.float32)
+    batch_size=inp.shape[0]
+    batch_indices=np.arange(batch_size)
+    out=np.zeros((batch_size,npoint),dtype=np.int32)
+    temp=np.full(inp.shape[:2],1e38,dtype=np.float32)
+    for j in range(1,npoint):
+        diff=inp-inp[batch_indices,out[:,j-1]][:,None,:]
+        d=diff[:,:,0]*diff[:,:,0]+diff[:,:,1]*diff[:,:,1]+diff[:,:,2]*diff[:,:,2]
+        np.minimum(temp,d,out=temp)
+        out[:,j]=np.argmax(temp,axis=1)
+    return out
     
 
 if __name__=='__main__':
@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+# CPU only build of tf_sampling_so.so, only FarthestPointSample has a CPU kernel
+PYTHON=python3
+TF_LIB=$($PYTHON -c 'import tensorflow as tf; print(tf.sysconfig.get_lib())')
+TF_PATH=$TF_LIB/include
+g++ -std=c++11 tf_sampling.cpp -o tf_sampling_so.so -shared -fPIC -L$TF_LIB -ltensorflow_framework \
+-I $TF_PATH/external/nsync/public/ -I $TF_PATH -O2 -D_GLIBCXX_USE_CXX11_ABI=0
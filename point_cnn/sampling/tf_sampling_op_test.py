@@ -0,0 +1,34 @@
+import numpy as np
+import tensorflow as tf
+from tf_sampling import sampling_module, farthest_point_sample, farthest_point_sample_numpy
+
+
+class FarthestPointSampleCpuTest(tf.test.TestCase):
+  def test(self):
+    np.random.seed(0)
+    for batch_size, pts_num, npoint in [(4, 2048, 768), (3, 100, 100), (1, 1, 1), (2, 333, 17)]:
+      points = np.random.random((batch_size, pts_num, 3)).astype('float32')
+      with tf.device('/cpu:0'):
+        indices = farthest_point_sample(npoint, tf.constant(points))
+      with self.test_session():
+        indices_val = indices.eval()
+      self.assertEqual(indices_val.shape, (batch_size, npoint))
+      self.assertAllEqual(indices_val, farthest_point_sample_numpy(npoint, points))
+      if npoint <= pts_num:
+        for idx in range(batch_size):
+          self.assertEqual(len(np.unique(indices_val[idx])), npoint)
+
+  def test_gpu(self):
+    if sampling_module is None or not tf.test.is_gpu_available(cuda_only=True):
+      return
+    np.random.seed(1)
+    points = np.random.random((8, 2048, 3)).astype('float32')
+    with tf.device('/cpu:0'):
+      indices_cpu = farthest_point_sample(768, tf.constant(points))
+    with tf.device('/gpu:0'):
+      indices_gpu = farthest_point_sample(768, tf.constant(points))
+    with self.test_session():
+      self.assertAllEqual(indices_cpu.eval(), indices_gpu.eval())
+
+if __name__=='__main__':
+  tf.test.main()
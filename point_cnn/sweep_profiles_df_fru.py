@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""Latency/mIoU sweep of the fast profiles of a DF segmentation checkpoint, on the val list, for CPU inference."""
+
+# python3 sweep_profiles_df_fru.py -i /ssd/Datasets/DataFountain/data_bin_fru \
+# -t /ssd/Datasets/DataFountain/train.txt \
+# -v /ssd/Datasets/DataFountain/val.txt \
+# -l /ssd/wyc/models/data_fountain/pointcnn_seg_df_x4_2048_fps_xxxx/ckpts/iter-80000 \
+# -m pointcnn_seg -x df_x4_2048_fps --profiles base fast faster sample_num=1024,D=1
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import data_utils
+import quantize_seg_df_fru as quantize
+from datetime import datetime
+
+
+def pareto_front(results):
+    """
+    the results no other result beats in both latency and mIoU
+    :param results: list of dicts with 'latency' and 'mean_iou'
+    :return: set of indices into results
+    """
+    front = set()
+    best_mean_iou = None
+    for idx in sorted(range(len(results)), key=lambda i: (results[i]['latency'], -results[i]['mean_iou'])):
+        if best_mean_iou is None or results[idx]['mean_iou'] > best_mean_iou:
+            front.add(idx)
+            best_mean_iou = results[idx]['mean_iou']
+    return front
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir_bin', '-i', help='Path to binary files dir (*.npy)', required=True)
+    parser.add_argument('--filelist', '-t', help='Path to calibration set ground truth (.txt), for int8 profiles')
+    parser.add_argument('--filelist_val', '-v', help='Path to validation set ground truth (.txt)', required=True)
+    parser.add_argument('--load_ckpt', '-l', help='Path to a check point file for load', required=True)
+    parser.add_argument('--model', '-m', help='Model to use', required=True)
+    parser.add_argument('--setting', '-x', help='Setting to use', required=True)
+    parser.add_argument('--profiles', '-p', help='Profiles to sweep, names in fast_profiles or inline, '
+                                                 'base and all of fast_profiles by default', nargs='*')
+    parser.add_argument('--calib_num', help='Number of frustums for calibrating int8 profiles', type=int, default=256)
+    parser.add_argument('--val_num', help='Number of val frustums for evaluation, 0 for all', type=int, default=0)
+    parser.add_argument('--threads', help='Intra op threads, 0 for all cores', type=int, default=0)
+    parser.add_argument('--output', '-o', help='Path to save the sweep as csv')
+    args = parser.parse_args()
+    print(args)
+
+    if not args.profiles:
+        setting, _, _ = quantize.load_setting(args.model, args.setting)
+        args.profiles = ['base'] + sorted(getattr(setting, 'fast_profiles', dict()).keys())
+
+    list_fru_val, _ = data_utils.load_bin_all(args.dir_bin, args.filelist_val)
+    if args.val_num > 0:
+        list_fru_val = list_fru_val[0:args.val_num]
+    list_fru_calib = None
+
+    results = []
+    for profile_name_or_text in args.profiles:
+        setting, profile_name, profile = quantize.load_setting(args.model, args.setting, profile_name_or_text)
+        print('{}-Profile {}: {}.'.format(datetime.now(), profile_name, profile))
+        graph_def = quantize.build_frozen_graph(args.model, setting, args.load_ckpt)
+        if setting.precision == 'int8':
+            if args.filelist is None:
+                print('Error: int8 profiles need --filelist for calibration!')
+                exit()
+            if list_fru_calib is None:
+                list_fru_calib = quantize.load_calibration_frus(args.dir_bin, args.filelist, args.calib_num)
+            graph_def = quantize.quantize_frozen_graph(graph_def, list_fru_calib, setting)
+        mean_iou, latency = quantize.evaluate(graph_def, list_fru_val, setting, args.threads)
+        print('{}-[{}]-T-1 mIOU: {:.4f}  Latency: {:.1f}ms/batch'.format(datetime.now(), profile_name, mean_iou,
+                                                                         latency * 1000))
+        results.append({'profile': profile_name, 'mean_iou': mean_iou, 'latency': latency,
+                        'latency_fru': latency / setting.batch_size})
+
+    reference = next((result for result in results if result['profile'] == 'base'), results[0])
+    front = pareto_front(results)
+    print('{:<40} {:>12} {:>12} {:>8} {:>8} {:>8} {:>7}'.format('profile', 'ms/batch', 'ms/frustum', 'mIoU',
+                                                                 'delta', 'speedup', 'pareto'))
+    lines = ['profile,ms_per_batch,ms_per_frustum,mean_iou,mean_iou_delta,speedup,pareto']
+    for idx in sorted(range(len(results)), key=lambda i: results[i]['latency']):
+        result = results[idx]
+        values = (result['latency'] * 1000, result['latency_fru'] * 1000, result['mean_iou'],
+                  result['mean_iou'] - reference['mean_iou'], reference['latency'] / result['latency'])
+        print('{:<40} {:>12.1f} {:>12.2f} {:>8.4f} {:>+8.4f} {:>7.2f}x {:>7}'.format(
+            result['profile'], *values, '*' if idx in front else ''))
+        lines.append('"{}",{:.3f},{:.3f},{:.5f},{:.5f},{:.3f},{:d}'.format(result['profile'], *values,
+                                                                          idx in front))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        print('{}-Sweep saved to {}.'.format(datetime.now(), args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -33,6 +33,7 @@ import argparse
 import importlib
 from utils import df_utils
 from utils import vis_utils
+from utils import fast_profile
 import numpy as np
 import tensorflow as tf
 from datetime import datetime
@@ -46,6 +47,12 @@ def inference_frames_frus(args, framenames, gpu_id):
     setting_path = os.path.join(os.path.dirname(__file__), args.model)
     sys.path.append(setting_path)
     setting = importlib.import_module(args.setting)
+    profile_name, profile = fast_profile.load_profile(setting, args.profile)
+    setting = fast_profile.apply_profile(setting, profile)
+    if setting.precision != 'float32':
+        print('Error: {} precision is served by the frozen graph of quantize_seg_df_fru.py!'.format(setting.precision))
+        exit()
+    print('{}-Profile {}: {}.'.format(datetime.now(), profile_name, profile))
 
     sample_num = setting.sample_num
 
@@ -58,7 +65,7 @@ def inference_frames_frus(args, framenames, gpu_id):
 
     # Placeholders
     indices = tf.placeholder(tf.int32, shape=(batch_size, None, 2), name="indices")
-    is_training = tf.placeholder(tf.bool, name='is_training')
+    is_training = tf.constant(False, dtype=tf.bool, name='is_training')
     pts_fts = tf.placeholder(tf.float32, shape=(batch_size, max_point_num, setting.data_dim), name='points')
 
     # Sample
@@ -136,7 +143,6 @@ def inference_frames_frus(args, framenames, gpu_id):
                                      feed_dict={
                                          pts_fts: batch_pts_ins,
                                          indices: indices_batch,
-                                         is_training: False,
                                      })
 
                 # output seg probs
@@ -192,6 +198,8 @@ def main():
     parser.add_argument('--model', '-m', help='Model to use', required=True)
     parser.add_argument('--setting', '-x', help='Setting to use', required=True)
     parser.add_argument('--save_ply', '-s', help='Save results as ply', action='store_true')
+    parser.add_argument('--profile', help='Fast profile of the setting, a name in its fast_profiles or inline, '
+                                          'e.g. sample_num=1024,P_scale=0.5,D=1')
     parser.add_argument('--gpu_available', '-g', help='Gpus to use', type=str, default='0,1,2')
     args = parser.parse_args()
     print(args)
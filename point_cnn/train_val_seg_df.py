@@ -140,12 +140,10 @@ def main():
 
     with tf.name_scope('metrics'):
         loss_mean_op, loss_mean_update_op = tf.metrics.mean(loss_op)
-        t_1_acc_op, t_1_acc_update_op = tf.metrics.accuracy(labels_sampled, predictions, weights=labels_weights_sampled)
-        t_1_per_class_acc_op, t_1_per_class_acc_update_op = \
-            tf.metrics.mean_per_class_accuracy(labels_sampled, predictions, setting.num_class,
-                                               weights=labels_weights_sampled)
-        t_1_mean_iou_op, t_1_mean_iou_update_op = \
-            tf.metrics.mean_iou(labels_sampled, predictions, setting.num_class, labels_weights_sampled)
+        confusion_op, confusion_update_op = pf.streaming_confusion_matrix(labels_sampled, predictions,
+                                                                          setting.num_class, labels_weights_sampled)
+        t_1_acc_op, t_1_per_class_acc_op, t_1_mean_iou_op, t_1_per_class_iou_op = \
+            pf.confusion_matrix_metrics(confusion_op)
     reset_metrics_op = tf.variables_initializer([var for var in tf.local_variables()
                                                  if var.name.split('/')[0] == 'metrics'])
 
@@ -153,11 +151,17 @@ def main():
     _ = tf.summary.scalar('t_1_acc/train', tensor=t_1_acc_op, collections=['train'])
     _ = tf.summary.scalar('t_1_per_class_acc/train', tensor=t_1_per_class_acc_op, collections=['train'])
     _ = tf.summary.scalar('t_1_mean_iou/train', tensor=t_1_mean_iou_op, collections=['train'])
+    for class_idx in range(setting.num_class):
+        _ = tf.summary.scalar('t_1_iou_{:d}/train'.format(class_idx), tensor=t_1_per_class_iou_op[class_idx],
+                              collections=['train'])
 
     _ = tf.summary.scalar('loss/val', tensor=loss_mean_op, collections=['val'])
     _ = tf.summary.scalar('t_1_acc/val', tensor=t_1_acc_op, collections=['val'])
     _ = tf.summary.scalar('t_1_per_class_acc/val', tensor=t_1_per_class_acc_op, collections=['val'])
     _ = tf.summary.scalar('t_1_mean_iou/val', tensor=t_1_mean_iou_op, collections=['val'])
+    for class_idx in range(setting.num_class):
+        _ = tf.summary.scalar('t_1_iou_{:d}/val'.format(class_idx), tensor=t_1_per_class_iou_op[class_idx],
+                              collections=['val'])
 
     lr_exp_op = tf.train.exponential_decay(setting.learning_rate_base, global_step, setting.decay_steps,
                                            setting.decay_rate, staircase=True)
@@ -232,8 +236,7 @@ def main():
                                                             rotation_range=rotation_range_val,
                                                             scaling_range=scaling_range_val,
                                                             order=setting.rotation_order)
-                    sess.run([loss_mean_update_op, t_1_acc_update_op, t_1_per_class_acc_update_op,
-                              t_1_mean_iou_update_op],
+                    sess.run([loss_mean_update_op, confusion_update_op],
                              feed_dict={
                                  pts_fts_sampled: points_batch_sampled,
                                  xforms: xforms_np,
@@ -285,8 +288,7 @@ def main():
                                                     scaling_range=scaling_range,
                                                     order=setting.rotation_order)
             sess.run(reset_metrics_op)
-            sess.run([train_op, loss_mean_update_op, t_1_acc_update_op, t_1_per_class_acc_update_op,
-                      t_1_mean_iou_update_op],
+            sess.run([train_op, loss_mean_update_op, confusion_update_op],
                      feed_dict={
                          pts_fts_sampled: points_batch_sampled,
                          xforms: xforms_np,
@@ -8,16 +8,21 @@ from __future__ import print_function
 import os
 import sys
 import math
+import time
 import random
 import shutil
 import argparse
 import importlib
 import data_utils
+import multiprocessing
+import val_seg_df_fru
 import numpy as np
 import pointfly as pf
 import tensorflow as tf
 from datetime import datetime
 from utils import df_utils
+from utils import fru_sampler
+from utils import ckpt_manager
 
 
 def main():
@@ -25,12 +30,25 @@ def main():
     parser.add_argument('--dir_bin', '-i', help='Path to binary files dir (*.npy)', required=True)
     parser.add_argument('--filelist', '-t', help='Path to training set ground truth (.txt)', required=True)
     parser.add_argument('--filelist_val', '-v', help='Path to validation set ground truth (.txt)', required=False)
+    parser.add_argument('--fru_hists', help='Path to training set frustum histograms (.npy)', required=False)
     parser.add_argument('--load_ckpt', '-l', help='Path to a check point file for load')
     parser.add_argument('--save_folder', '-s', help='Path to folder for saving check points and summary', required=True)
     parser.add_argument('--model', '-m', help='Model to use', required=True)
     parser.add_argument('--setting', '-x', help='Setting to use', required=True)
+    parser.add_argument('--devices', '-d', help='Devices of the towers, e.g. /gpu:0,/gpu:1 or /cpu:0,/cpu:1')
+    parser.add_argument('--ckpt_keep_last', help='Number of latest check points to keep', type=int, default=5)
+    parser.add_argument('--ckpt_keep_best', help='Number of best val mIoU check points to keep', type=int, default=3)
+    parser.add_argument('--gpu_val', help='Gpu of the validation process, defaults to the visible ones')
+    parser.add_argument('--seed', help='Random seed, for comparing runs with different tower numbers', type=int)
+    parser.add_argument('--knn_report', help='Report the KNN time saved by the KNN cache per layer',
+                        action='store_true')
     args = parser.parse_args()
 
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+        tf.set_random_seed(args.seed)
+
     time_string = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
     root_folder = os.path.join(args.save_folder, '%s_%s_%s_%d' % (args.model, args.setting, time_string, os.getpid()))
     if not os.path.exists(root_folder):
@@ -53,36 +71,41 @@ def main():
     step_val = setting.step_val
     label_weights_list = setting.label_weights
     rotation_range = setting.rotation_range
-    rotation_range_val = setting.rotation_range_val
     scaling_range = setting.scaling_range
-    scaling_range_val = setting.scaling_range_val
     jitter = setting.jitter
-    jitter_val = setting.jitter_val
+    sampler_class_freqs = getattr(setting, 'sampler_class_freqs', None)
+    sampler_hard_example = getattr(setting, 'sampler_hard_example', False)
 
     # Prepare inputs
     print('{}-Preparing datasets...'.format(datetime.now()))
     dir_bin = args.dir_bin
     path_filelist_train = args.filelist
     path_filelist_val = args.filelist_val
-    list_fru_train, max_point_num_train = data_utils.load_bin_all(dir_bin, path_filelist_train)
+    list_fru_train, _ = data_utils.load_bin_all(dir_bin, path_filelist_train)
+    # validation runs in its own process and loads the val frustums there
     if path_filelist_val is None:
-        print("train with no val data")
-        list_fru_val = list_fru_train[0:100]
-        max_point_num_val = 0
+        print("train with no val data, validate on the first 100 training samples")
+        path_filelist_val = path_filelist_train
+        max_fru_num_val = 100
     else:
-        list_fru_val, max_point_num_val = data_utils.load_bin_all(dir_bin, path_filelist_val)
-    max_point_num = max(max_point_num_train, max_point_num_val)
+        max_fru_num_val = None
 
-    # shuffle
-    random.shuffle(list_fru_train)
+    # shuffle, or draw batches by class frequency / recent loss
+    if sampler_class_freqs is None and not sampler_hard_example:
+        sampler = None
+        random.shuffle(list_fru_train)
+    else:
+        fru_hists = fru_sampler.load_fru_hists(args.fru_hists, list_fru_train, setting.num_class)
+        sampler = fru_sampler.FruSampler(fru_hists, sampler_class_freqs, sampler_hard_example,
+                                         getattr(setting, 'sampler_loss_momentum', 0.9),
+                                         getattr(setting, 'sampler_hard_power', 1.0))
+        print('{}-Sampling frustums with class freqs {} and hard example {}.'
+              .format(datetime.now(), sampler_class_freqs, sampler_hard_example))
 
     num_train = len(list_fru_train)
-    num_val = len(list_fru_val)
-    print('{}-{:d}/{:d} training/validation samples.'.format(datetime.now(), num_train, num_val))
+    print('{}-{:d} training samples.'.format(datetime.now(), num_train))
     batch_num = (num_train * num_epochs + batch_size - 1) // batch_size
     print('{}-{:d} training batches.'.format(datetime.now(), batch_num))
-    batch_num_val = int(math.ceil(num_val / batch_size))
-    print('{}-{:d} testing batches per test.'.format(datetime.now(), batch_num_val))
 
     ######################################################################
     # Placeholders
@@ -98,46 +121,90 @@ def main():
     labels_weights_sampled = tf.placeholder(tf.float32, shape=(None, max_sample_num), name='labels_weights')
 
     ######################################################################
-    features_augmented = None
-    if setting.data_dim > 3:
-        points_sampled, features_sampled = tf.split(pts_fts_sampled,
-                                                    [3, setting.data_dim - 3],
-                                                    axis=-1,
-                                                    name='split_points_features')
-        if setting.use_extra_features:
-            if setting.with_normal_feature:
-                if setting.data_dim < 6:
-                    print('Only 3D normals are supported!')
-                    exit()
-                elif setting.data_dim == 6:
-                    features_augmented = pf.augment(features_sampled, rotations)
-                else:
-                    normals, rest = tf.split(features_sampled, [3, setting.data_dim - 6])
-                    normals_augmented = pf.augment(normals, rotations)
-                    features_augmented = tf.concat([normals_augmented, rest], axis=-1)
-            else:
-                features_augmented = features_sampled
+    lr_exp_op = tf.train.exponential_decay(setting.learning_rate_base, global_step, setting.decay_steps,
+                                           setting.decay_rate, staircase=True)
+    lr_clip_op = tf.maximum(lr_exp_op, setting.learning_rate_min)
+    _ = tf.summary.scalar('learning_rate', tensor=lr_clip_op, collections=['train'])
+    if setting.optimizer == 'adam':
+        optimizer = tf.train.AdamOptimizer(learning_rate=lr_clip_op, epsilon=setting.epsilon)
+    elif setting.optimizer == 'momentum':
+        optimizer = tf.train.MomentumOptimizer(learning_rate=lr_clip_op, momentum=setting.momentum, use_nesterov=True)
     else:
-        points_sampled = pts_fts_sampled
-    points_augmented = pf.augment(points_sampled, xforms, jitter_range)
-    # points_augmented = points_sampled
+        optimizer = tf.train.AdamOptimizer(learning_rate=lr_clip_op, epsilon=setting.epsilon)  # adam
 
-    net = model.Net(points_augmented, features_augmented, is_training, setting)
-    logits = net.logits
+    # one tower per device, each takes a contiguous slice of the batch and shares the variables of tower 0
+    devices = [None] if args.devices is None else [device.strip() for device in args.devices.split(',')]
+    num_towers = len(devices)
+    if num_towers > batch_size:
+        print('Error: {:d} towers need a batch size of at least {:d}!'.format(num_towers, num_towers))
+        exit()
+    print('{}-Building {:d} tower(s) on {}.'.format(datetime.now(), num_towers, devices))
+    tower_logits = []
+    tower_losses = []
+    tower_grads = []
+    tower_weights = []
+    for tower_idx, device in enumerate(devices):
+        with tf.device(device), tf.variable_scope(tf.get_variable_scope(), reuse=tower_idx > 0), \
+             tf.name_scope('tower_{:d}'.format(tower_idx)):
+            pts_fts_tower = pf.split_batch(pts_fts_sampled, num_towers, tower_idx)
+            labels_tower = pf.split_batch(labels_sampled, num_towers, tower_idx)
+            labels_weights_tower = pf.split_batch(labels_weights_sampled, num_towers, tower_idx)
+            xforms_tower = pf.split_batch(xforms, num_towers, tower_idx)
+            rotations_tower = pf.split_batch(rotations, num_towers, tower_idx)
+
+            features_augmented = None
+            if setting.data_dim > 3:
+                points_sampled, features_sampled = tf.split(pts_fts_tower,
+                                                            [3, setting.data_dim - 3],
+                                                            axis=-1,
+                                                            name='split_points_features')
+                if setting.use_extra_features:
+                    if setting.with_normal_feature:
+                        if setting.data_dim < 6:
+                            print('Only 3D normals are supported!')
+                            exit()
+                        elif setting.data_dim == 6:
+                            features_augmented = pf.augment(features_sampled, rotations_tower)
+                        else:
+                            normals, rest = tf.split(features_sampled, [3, setting.data_dim - 6])
+                            normals_augmented = pf.augment(normals, rotations_tower)
+                            features_augmented = tf.concat([normals_augmented, rest], axis=-1)
+                    else:
+                        features_augmented = features_sampled
+            else:
+                points_sampled = pts_fts_tower
+            points_augmented = pf.augment(points_sampled, xforms_tower, jitter_range)
+            # points_augmented = points_sampled
+
+            net = model.Net(points_augmented, features_augmented, is_training, setting)
+            loss_tower = tf.losses.sparse_softmax_cross_entropy(labels=labels_tower, logits=net.logits,
+                                                                weights=labels_weights_tower)
+            loss_per_fru_tower = tf.reduce_mean(tf.losses.sparse_softmax_cross_entropy(
+                labels=labels_tower, logits=net.logits, weights=labels_weights_tower,
+                loss_collection=None, reduction=tf.losses.Reduction.NONE), axis=-1)
+
+            # regularization losses are created with the variables, i.e. by tower 0
+            reg_loss = setting.weight_decay * tf.losses.get_regularization_loss()
+            tower_grads.append(optimizer.compute_gradients(loss_tower + reg_loss))
+            # loss_tower is a mean over the nonzero weights of the slice, average_gradients weights it by their count
+            tower_weights.append(tf.count_nonzero(labels_weights_tower, dtype=tf.float32))
+            tower_logits.append(net.logits)
+            tower_losses.append(loss_per_fru_tower)
+
+    logits = tf.concat(tower_logits, axis=0, name='logits')
     probs = tf.nn.softmax(logits, name='probs')
     predictions = tf.argmax(probs, axis=-1, name='predictions')
 
     loss_op = tf.losses.sparse_softmax_cross_entropy(labels=labels_sampled, logits=logits,
-                                                     weights=labels_weights_sampled)
+                                                     weights=labels_weights_sampled, loss_collection=None)
+    loss_per_fru_op = tf.concat(tower_losses, axis=0, name='loss_per_fru')
 
     with tf.name_scope('metrics'):
         loss_mean_op, loss_mean_update_op = tf.metrics.mean(loss_op)
-        t_1_acc_op, t_1_acc_update_op = tf.metrics.accuracy(labels_sampled, predictions, weights=labels_weights_sampled)
-        t_1_per_class_acc_op, t_1_per_class_acc_update_op = \
-            tf.metrics.mean_per_class_accuracy(labels_sampled, predictions, setting.num_class,
-                                               weights=labels_weights_sampled)
-        t_1_mean_iou_op, t_1_mean_iou_update_op = \
-            tf.metrics.mean_iou(labels_sampled, predictions, setting.num_class, labels_weights_sampled)
+        confusion_op, confusion_update_op = pf.streaming_confusion_matrix(labels_sampled, predictions,
+                                                                          setting.num_class, labels_weights_sampled)
+        t_1_acc_op, t_1_per_class_acc_op, t_1_mean_iou_op, t_1_per_class_iou_op = \
+            pf.confusion_matrix_metrics(confusion_op)
     reset_metrics_op = tf.variables_initializer([var for var in tf.local_variables()
                                                  if var.name.split('/')[0] == 'metrics'])
 
@@ -145,30 +212,18 @@ def main():
     _ = tf.summary.scalar('t_1_acc/train', tensor=t_1_acc_op, collections=['train'])
     _ = tf.summary.scalar('t_1_per_class_acc/train', tensor=t_1_per_class_acc_op, collections=['train'])
     _ = tf.summary.scalar('t_1_mean_iou/train', tensor=t_1_mean_iou_op, collections=['train'])
+    for class_idx in range(setting.num_class):
+        _ = tf.summary.scalar('t_1_iou_{:d}/train'.format(class_idx), tensor=t_1_per_class_iou_op[class_idx],
+                              collections=['train'])
 
-    _ = tf.summary.scalar('loss/val', tensor=loss_mean_op, collections=['val'])
-    _ = tf.summary.scalar('t_1_acc/val', tensor=t_1_acc_op, collections=['val'])
-    _ = tf.summary.scalar('t_1_per_class_acc/val', tensor=t_1_per_class_acc_op, collections=['val'])
-    _ = tf.summary.scalar('t_1_mean_iou/val', tensor=t_1_mean_iou_op, collections=['val'])
-
-    lr_exp_op = tf.train.exponential_decay(setting.learning_rate_base, global_step, setting.decay_steps,
-                                           setting.decay_rate, staircase=True)
-    lr_clip_op = tf.maximum(lr_exp_op, setting.learning_rate_min)
-    _ = tf.summary.scalar('learning_rate', tensor=lr_clip_op, collections=['train'])
-    reg_loss = setting.weight_decay * tf.losses.get_regularization_loss()
-    if setting.optimizer == 'adam':
-        optimizer = tf.train.AdamOptimizer(learning_rate=lr_clip_op, epsilon=setting.epsilon)
-    elif setting.optimizer == 'momentum':
-        optimizer = tf.train.MomentumOptimizer(learning_rate=lr_clip_op, momentum=setting.momentum, use_nesterov=True)
-    else:
-        optimizer = tf.train.AdamOptimizer(learning_rate=lr_clip_op, epsilon=setting.epsilon)  # adam
-    update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+    # batch norm moving averages are updated from tower 0 only
+    update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS, scope='tower_0')
     with tf.control_dependencies(update_ops):
-        train_op = optimizer.minimize(loss_op + reg_loss, global_step=global_step)
+        train_op = optimizer.apply_gradients(pf.average_gradients(tower_grads, tower_weights), global_step=global_step)
 
     init_op = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
 
-    saver = tf.train.Saver(max_to_keep=None)
+    saver = tf.train.Saver()
 
     # backup all code
     code_folder = os.path.abspath(os.path.dirname(__file__))
@@ -185,9 +240,28 @@ def main():
     parameter_num = np.sum([np.prod(v.shape.as_list()) for v in tf.trainable_variables()])
     print('{}-Parameter number: {:d}.'.format(datetime.now(), parameter_num))
 
-    with tf.Session() as sess:
+    # virtual cpu devices, so that /cpu:1 etc. exist for multi-tower runs on cpu only nodes
+    cpu_num = 1 + max([int(device.split(':')[-1]) for device in devices
+                       if device is not None and 'cpu' in device.lower()] or [0])
+    config = tf.ConfigProto(allow_soft_placement=True, device_count={'CPU': cpu_num})
+
+    # spawn rather than fork, the child must not inherit the tensorflow runtime of this process
+    context = multiprocessing.get_context('spawn')
+    queue_ckpt = context.Queue()
+    queue_val_result = context.Queue()
+    process_val = context.Process(target=val_seg_df_fru.validate_queue,
+                                  args=(queue_ckpt, dir_bin, path_filelist_val, args.model, args.setting,
+                                        folder_summary, max_fru_num_val, args.gpu_val, queue_val_result))
+    process_val.start()
+
+    # checkpoints are written in the background and handed to the val process once on disk, they are kept until
+    # the val process reports them validated or skipped
+    manager = ckpt_manager.CkptManager(folder_ckpt, keep_last=args.ckpt_keep_last, keep_best=args.ckpt_keep_best,
+                                       on_saved=lambda path_ckpt, step: queue_ckpt.put((path_ckpt, step)),
+                                       wait_for_report=True)
+
+    with tf.Session(config=config) as sess:
         summaries_op = tf.summary.merge_all('train')
-        summaries_val_op = tf.summary.merge_all('val')
         summary_writer = tf.summary.FileWriter(folder_summary, sess.graph)
 
         sess.run(init_op)
@@ -197,57 +271,37 @@ def main():
             saver.restore(sess, args.load_ckpt)
             print('{}-Checkpoint loaded from {}!'.format(datetime.now(), args.load_ckpt))
 
+        time_train = 0.0
+        sample_num_trained = 0
         for batch_idx_train in range(batch_num):
             if (batch_idx_train % step_val == 0 and (batch_idx_train != 0 or args.load_ckpt is not None)) \
                     or batch_idx_train == batch_num - 1:
                 ######################################################################
-                # Validation
-                filename_ckpt = os.path.join(folder_ckpt, 'iter')
-                saver.save(sess, filename_ckpt, global_step=global_step)
-                print('{}-Checkpoint saved to {}!'.format(datetime.now(), filename_ckpt))
-
-                sess.run(reset_metrics_op)
-                for batch_val_idx in range(batch_num_val):
-                    start_idx = batch_size * batch_val_idx
-                    end_idx = min(start_idx + batch_size, num_val)
-                    batch_size_val = end_idx - start_idx
-                    fru_batch = list_fru_train[start_idx:end_idx]
-
-                    points_batch_sampled, labels_batch_sampled, weights_batch_sampled = \
-                        df_utils.group_sampling_fru(fru_batch, sample_num, label_weights_list)
-
-                    xforms_np, rotations_np = pf.get_xforms(batch_size_val,
-                                                            rotation_range=rotation_range_val,
-                                                            scaling_range=scaling_range_val,
-                                                            order=setting.rotation_order)
-                    sess.run([loss_mean_update_op, t_1_acc_update_op, t_1_per_class_acc_update_op,
-                              t_1_mean_iou_update_op],
-                             feed_dict={
-                                 pts_fts_sampled: points_batch_sampled,
-                                 xforms: xforms_np,
-                                 rotations: rotations_np,
-                                 jitter_range: np.array([jitter_val]),
-                                 labels_sampled: labels_batch_sampled,
-                                 labels_weights_sampled: weights_batch_sampled,
-                                 is_training: False,
-                             })
-
-                loss_val, t_1_acc_val, t_1_per_class_acc_val, t_1_mean_iou_val, summaries_val = sess.run(
-                    [loss_mean_op, t_1_acc_op, t_1_per_class_acc_op, t_1_mean_iou_op, summaries_val_op])
-                summary_writer.add_summary(summaries_val, batch_idx_train)
-                print('{}-[Val  ]-Average:      Loss: {:.4f}  T-1 Acc: {:.4f}  T-1 mAcc: {:.4f}  T-1 mIOU: {:.4f}'
-                      .format(datetime.now(), loss_val, t_1_acc_val, t_1_per_class_acc_val, t_1_mean_iou_val))
+                # Validation, the val process evaluates the checkpoint while training goes on
+                while not queue_val_result.empty():
+                    manager.report(*queue_val_result.get())
+                path_ckpt = manager.save(sess, sess.run(global_step))
+                print('{}-Checkpoint queued for saving to {}!'.format(datetime.now(), path_ckpt))
                 ######################################################################
 
             ######################################################################
             # Training
-            start_idx = (batch_size * batch_idx_train) % num_train
-            end_idx = min(start_idx + batch_size, num_train)
-            batch_size_train = end_idx - start_idx
-            fru_batch = list_fru_train[start_idx:end_idx]
-
-            if start_idx + batch_size_train == num_train:
-                random.shuffle(list_fru_train)
+            if sampler is None:
+                start_idx = (batch_size * batch_idx_train) % num_train
+                end_idx = min(start_idx + batch_size, num_train)
+                batch_size_train = end_idx - start_idx
+                fru_batch = list_fru_train[start_idx:end_idx]
+
+                if start_idx + batch_size_train == num_train:
+                    random.shuffle(list_fru_train)
+                    # a remainder batch smaller than the towers is topped up from the next epoch
+                    if batch_size_train < num_towers:
+                        fru_batch += list_fru_train[:num_towers - batch_size_train]
+                        batch_size_train = num_towers
+            else:
+                fru_indices = sampler.sample(batch_size)
+                batch_size_train = len(fru_indices)
+                fru_batch = [list_fru_train[i] for i in fru_indices]
 
             offset = int(random.gauss(0, sample_num * setting.sample_num_variance))
             offset = max(offset, -sample_num * setting.sample_num_clip)
@@ -261,17 +315,25 @@ def main():
                                                     scaling_range=scaling_range,
                                                     order=setting.rotation_order)
             sess.run(reset_metrics_op)
-            sess.run([train_op, loss_mean_update_op, t_1_acc_update_op, t_1_per_class_acc_update_op,
-                      t_1_mean_iou_update_op],
-                     feed_dict={
-                         pts_fts_sampled: points_batch_sampled,
-                         xforms: xforms_np,
-                         rotations: rotations_np,
-                         jitter_range: np.array([jitter]),
-                         labels_sampled: labels_batch_sampled,
-                         labels_weights_sampled: weights_batch_sampled,
-                         is_training: True,
-                     })
+            time_train_start = time.time()
+            feed_dict_train = {
+                pts_fts_sampled: points_batch_sampled,
+                xforms: xforms_np,
+                rotations: rotations_np,
+                jitter_range: np.array([jitter]),
+                labels_sampled: labels_batch_sampled,
+                labels_weights_sampled: weights_batch_sampled,
+                is_training: True,
+            }
+            loss_per_fru = sess.run([train_op, loss_mean_update_op, confusion_update_op, loss_per_fru_op],
+                                    feed_dict=feed_dict_train)[-1]
+            time_train += time.time() - time_train_start
+            if args.knn_report and batch_idx_train == 0:
+                for tag, time_saved in net.knn_time_saved(sess, feed_dict_train):
+                    print('{}-{}knn saved {:.2f} ms per iteration'.format(datetime.now(), tag, time_saved * 1000))
+            sample_num_trained += batch_size_train
+            if sampler is not None:
+                sampler.update(fru_indices, loss_per_fru)
             if batch_idx_train % 10 == 0:
                 loss, t_1_acc, t_1_per_class_acc, t_1_mean_iou, summaries = sess.run([loss_mean_op,
                                                                                       t_1_acc_op,
@@ -280,8 +342,19 @@ def main():
                                                                                       summaries_op])
                 summary_writer.add_summary(summaries, batch_idx_train)
                 print('{}-[Train]-Iter: {:06d}  Loss: {:.4f}  T-1 Acc: {:.4f}  T-1 mAcc: {:.4f}  T-1 mIOU: {:.4f}'
-                      .format(datetime.now(), batch_idx_train, loss, t_1_acc, t_1_per_class_acc, t_1_mean_iou))
+                      '  Samples/s: {:.2f}'
+                      .format(datetime.now(), batch_idx_train, loss, t_1_acc, t_1_per_class_acc, t_1_mean_iou,
+                              sample_num_trained / max(time_train, 1e-8)))
+                time_train = 0.0
+                sample_num_trained = 0
             ######################################################################
+        manager.close()
+        queue_ckpt.put(None)
+        print('{}-Training done, waiting for validation...'.format(datetime.now()))
+        process_val.join()
+        while not queue_val_result.empty():
+            manager.report(*queue_val_result.get())
+        print('{}-Best checkpoint: {}'.format(datetime.now(), manager.best()))
         print('{}-Done!'.format(datetime.now()))
 
 
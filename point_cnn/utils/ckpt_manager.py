@@ -0,0 +1,142 @@
+import os
+import glob
+import json
+import time
+import queue
+import threading
+import tensorflow as tf
+from datetime import datetime
+
+
+class CkptManager:
+    """
+    Save checkpoints in a background thread and bound the number kept on disk.
+
+    save() only snapshots the variable values with one sess.run, a writer thread then loads the
+    snapshot into a shadow copy of the variables living in its own graph and session, and saves it
+    from there, so training continues while the checkpoint is written.
+
+    The last keep_last checkpoints are kept, plus the keep_best ones with the highest val mIoU
+    reported through report(). With wait_for_report, a checkpoint is also kept until report() was
+    called for it, so one queued for or being restored by validation is never deleted. index.json in
+    the checkpoint folder lists the kept checkpoints with their step, save time and metrics, and the
+    checkpoint state file lists them for tf.train.latest_checkpoint.
+    """
+
+    def __init__(self, folder_ckpt, var_list=None, keep_last=5, keep_best=3, metric_name='t_1_mean_iou',
+                 on_saved=None, filename='iter', wait_for_report=False):
+        self.folder_ckpt = folder_ckpt
+        self.filename = filename
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.wait_for_report = wait_for_report
+        self.metric_name = metric_name
+        self.on_saved = on_saved
+        self.path_index = os.path.join(folder_ckpt, 'index.json')
+
+        self.var_list = tf.global_variables() if var_list is None else var_list
+        self.graph_shadow = tf.Graph()
+        with self.graph_shadow.as_default(), tf.device('/cpu:0'):
+            self.vars_shadow = {}
+            self.values_feed = []
+            assign_ops = []
+            for var in self.var_list:
+                name = var.op.name
+                var_shadow = tf.Variable(tf.zeros(var.shape, dtype=var.dtype.base_dtype), trainable=False, name=name)
+                value_feed = tf.placeholder(var.dtype.base_dtype, shape=var.shape)
+                self.vars_shadow[name] = var_shadow
+                self.values_feed.append(value_feed)
+                assign_ops.append(tf.assign(var_shadow, value_feed))
+            self.assign_op = tf.group(*assign_ops)
+            self.saver_shadow = tf.train.Saver(self.vars_shadow, max_to_keep=None)
+            self.sess_shadow = tf.Session(config=tf.ConfigProto(device_count={'GPU': 0}))
+
+        self.lock = threading.Lock()
+        self.records = []
+        self.queue_save = queue.Queue()
+        self.thread_save = threading.Thread(target=self._save_loop)
+        self.thread_save.daemon = True
+        self.thread_save.start()
+
+    def save(self, sess, step):
+        """
+        snapshot the variables and queue them for writing
+        :param sess: session holding the variables
+        :param step: global step, used as checkpoint suffix
+        :return: the checkpoint prefix the snapshot will be written to
+        """
+        values = sess.run(self.var_list)
+        path_ckpt = os.path.join(self.folder_ckpt, '{}-{:d}'.format(self.filename, step))
+        self.queue_save.put((path_ckpt, step, values))
+        return path_ckpt
+
+    def report(self, path_ckpt, metrics):
+        """
+        attach val metrics to a checkpoint, then apply the retention policy
+        :param path_ckpt: checkpoint prefix returned by save()
+        :param metrics: dict of metric name to value, None when the checkpoint was not validated
+        """
+        with self.lock:
+            for record in self.records:
+                if record['path'] == path_ckpt:
+                    record['pending'] = False
+                    if metrics is not None:
+                        record['metrics'] = dict((key, float(value)) for key, value in metrics.items())
+            self._retain()
+
+    def best(self):
+        """:return: prefix of the kept checkpoint with the highest val metric, or None"""
+        with self.lock:
+            records = [record for record in self.records if self.metric_name in record['metrics']]
+        if not records:
+            return None
+        return max(records, key=lambda record: record['metrics'][self.metric_name])['path']
+
+    def close(self):
+        """wait for the queued checkpoints to be written"""
+        self.queue_save.put(None)
+        self.thread_save.join()
+        self.sess_shadow.close()
+
+    def _save_loop(self):
+        while True:
+            item = self.queue_save.get()
+            if item is None:
+                break
+            path_ckpt, step, values = item
+            self.sess_shadow.run(self.assign_op, feed_dict=dict(zip(self.values_feed, values)))
+            # the checkpoint state is written by _retain, which knows the kept checkpoints
+            self.saver_shadow.save(self.sess_shadow, path_ckpt, write_meta_graph=False, write_state=False)
+            print('{}-Checkpoint saved to {}!'.format(datetime.now(), path_ckpt))
+            with self.lock:
+                self.records.append({'path': path_ckpt, 'step': int(step), 'time': time.time(), 'metrics': {},
+                                     'pending': self.wait_for_report})
+                self._retain()
+            if self.on_saved is not None:
+                self.on_saved(path_ckpt, step)
+
+    # called with self.lock held
+    def _retain(self):
+        records_last = sorted(self.records, key=lambda record: record['step'])[-self.keep_last:] \
+            if self.keep_last > 0 else []
+        records_scored = [record for record in self.records if self.metric_name in record['metrics']]
+        records_best = sorted(records_scored, key=lambda record: record['metrics'][self.metric_name])
+        records_best = records_best[-self.keep_best:] if self.keep_best > 0 else []
+        records_pending = [record for record in self.records if record['pending']]
+        paths_keep = set(record['path'] for record in records_last + records_best + records_pending)
+
+        for record in self.records:
+            if record['path'] not in paths_keep:
+                for path in glob.glob(record['path'] + '.*'):
+                    os.remove(path)
+        self.records = [record for record in self.records if record['path'] in paths_keep]
+
+        paths_ckpt = [record['path'] for record in sorted(self.records, key=lambda record: record['step'])]
+        path_state = os.path.join(self.folder_ckpt, 'checkpoint')
+        if paths_ckpt:
+            tf.train.update_checkpoint_state(self.folder_ckpt, paths_ckpt[-1], all_model_checkpoint_paths=paths_ckpt)
+        elif os.path.exists(path_state):
+            os.remove(path_state)
+        with open(self.path_index + '.tmp', 'w') as f:
+            json.dump({'metric': self.metric_name, 'checkpoints': self.records}, f, indent=2)
+        os.rename(self.path_index + '.tmp', self.path_index)
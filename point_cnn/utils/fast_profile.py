@@ -0,0 +1,108 @@
+import ast
+import types
+
+# profile keys, all of them leave the variables of a setting unchanged, so a profile runs on its checkpoints
+PROFILE_KEYS = ('sample_num', 'P_scale', 'D', 'with_global', 'knn_method', 'x_transformation_fused', 'precision')
+PRECISIONS = ('float32', 'int8')
+
+
+def parse_profile(text):
+    """
+    parse an inline profile
+    :param text: e.g. 'sample_num=1024,P_scale=0.5,D=1,with_global=False,precision=int8', lists as D=[1,1,2,2]
+    :return: profile dict
+    """
+    profile = dict()
+    for item in filter(None, _split_items(text)):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        try:
+            profile[key] = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            profile[key] = value.strip()
+    return profile
+
+
+# split on the commas outside of brackets
+def _split_items(text):
+    items = ['']
+    depth = 0
+    for c in text:
+        depth += (c == '[') - (c == ']')
+        if c == ',' and depth == 0:
+            items.append('')
+        else:
+            items[-1] += c
+    return [item.strip() for item in items]
+
+
+def load_profile(setting, name_or_text):
+    """
+    a profile by name from setting.fast_profiles, or an inline one
+    :return: (name, profile dict), ('base', {}) for None
+    """
+    if not name_or_text or name_or_text == 'base':
+        return 'base', dict()
+    fast_profiles = getattr(setting, 'fast_profiles', dict())
+    if name_or_text in fast_profiles:
+        return name_or_text, dict(fast_profiles[name_or_text])
+    return name_or_text, parse_profile(name_or_text)
+
+
+def apply_profile(setting, profile):
+    """
+    derive the lighter inference variant of a setting
+    sample_num: points sampled per frustum
+    P_scale: representative points of every xconv layer with P > 0 scaled by it
+    D: dilation, an int for all xconv and xdconv layers or a list over the xconv then the xdconv layers
+    with_global: False replaces the global branch by its expectation (pointcnn.xconv with_global='constant')
+    knn_method, x_transformation_fused: as in the setting
+    precision: 'float32' or 'int8', the latter for quantize_seg_df_fru.py and sweep_profiles_df_fru.py
+    K is not a profile key, it is built into the X-transformation and convolution weights.
+    :param setting: setting module
+    :param profile: profile dict
+    :return: setting namespace, with precision set
+    """
+    for key in profile:
+        if key == 'K':
+            raise ValueError('K is built into the xconv weights, train a setting with the smaller K instead!')
+        if key not in PROFILE_KEYS:
+            raise ValueError('Unknown profile key {}, expected one of {}!'.format(key, ', '.join(PROFILE_KEYS)))
+
+    attributes = {name: value for name, value in vars(setting).items() if not name.startswith('__')}
+    result = types.SimpleNamespace(**attributes)
+    result.precision = profile.get('precision', 'float32')
+    if result.precision not in PRECISIONS:
+        raise ValueError('Unknown precision {}, expected one of {}!'.format(result.precision, ', '.join(PRECISIONS)))
+    result.sample_num = int(profile.get('sample_num', setting.sample_num))
+    for key in ['knn_method', 'x_transformation_fused']:
+        if key in profile:
+            setattr(result, key, profile[key])
+    if 'with_global' in profile and setting.with_global:
+        result.with_global = 'constant' if not profile['with_global'] else profile['with_global']
+
+    xconv_params = [dict(param) for param in setting.xconv_params]
+    xdconv_params = [dict(param) for param in getattr(setting, 'xdconv_params', [])]
+    if 'D' in profile:
+        D = profile['D']
+        D_list = D if isinstance(D, (list, tuple)) else [D] * (len(xconv_params) + len(xdconv_params))
+        if len(D_list) != len(xconv_params) + len(xdconv_params):
+            raise ValueError('D lists one dilation per xconv and xdconv layer!')
+        for param, D_layer in zip(xconv_params + xdconv_params, D_list):
+            param['D'] = int(D_layer)
+
+    # scaled P keeps the P equal to the previous P relation, and is clipped to the points of the previous layer
+    P_scale = profile.get('P_scale', 1.0)
+    point_num = result.sample_num
+    for layer_idx, param in enumerate(xconv_params):
+        P = setting.xconv_params[layer_idx]['P']
+        if P != -1:
+            if layer_idx > 0 and P == setting.xconv_params[layer_idx - 1]['P']:
+                param['P'] = xconv_params[layer_idx - 1]['P']
+            else:
+                param['P'] = min(max(int(round(P * P_scale)), 1), point_num)
+            point_num = param['P']
+    result.xconv_params = xconv_params
+    if hasattr(setting, 'xdconv_params'):
+        result.xdconv_params = xdconv_params
+    return result
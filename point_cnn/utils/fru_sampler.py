@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def compute_fru_hists(list_fru_data, num_class):
+    """
+    count points of every category in every frustum
+    :param list_fru_data: list of (point_num, 5) arrays, [x, y, z, intensity, category]
+    :param num_class: number of categories
+    :return: (fru_num, num_class) int64 histograms
+    """
+    fru_hists = np.zeros((len(list_fru_data), num_class), np.int64)
+    for i, fru_data in enumerate(list_fru_data):
+        fru_hists[i] = np.bincount(fru_data[:, 4].astype(np.int64), minlength=num_class)[0:num_class]
+    return fru_hists
+
+
+def load_fru_hists(path_hists, list_fru_data, num_class):
+    """
+    load precomputed frustum histograms, compute them when the index is missing or stale
+    :param path_hists: path to a .npy index written by data_conversions/df/prepare_fru_hists.py, or None
+    :param list_fru_data: frustums the index belongs to, in filelist order
+    :param num_class: number of categories
+    :return: (fru_num, num_class) int64 histograms
+    """
+    if path_hists is not None:
+        fru_hists = np.load(path_hists)
+        if fru_hists.shape == (len(list_fru_data), num_class):
+            return fru_hists
+        print('Frustum histograms in {} do not match the filelist, recomputing!'.format(path_hists))
+    return compute_fru_hists(list_fru_data, num_class)
+
+
+class FruSampler:
+    """
+    Draw training batches of frustums by class frequency and, optionally, by recent loss.
+
+    Every frustum f gets the weight sum_c(share_fc * class_freqs_c / global_share_c), so that
+    frustums holding rare categories are drawn until the expected category mix of a batch
+    approaches class_freqs. With hard_example on, the weight is further scaled by
+    (loss_f / mean_loss) ** hard_power, where loss_f is a running average of the frustum loss.
+    """
+
+    def __init__(self, fru_hists, class_freqs=None, hard_example=False, loss_momentum=0.9, hard_power=1.0,
+                 weight_min=1e-3):
+        fru_hists = np.asarray(fru_hists, np.float64)
+        self.fru_num = fru_hists.shape[0]
+        self.hard_example = hard_example
+        self.loss_momentum = loss_momentum
+        self.hard_power = hard_power
+        self.weight_min = weight_min
+
+        if class_freqs is None:
+            self.class_weights = np.ones(self.fru_num)
+        else:
+            class_freqs = np.asarray(class_freqs, np.float64)
+            class_freqs = class_freqs / np.sum(class_freqs)
+            global_share = np.sum(fru_hists, axis=0) / max(np.sum(fru_hists), 1.0)
+            class_ratio = np.where(global_share > 0, class_freqs / np.maximum(global_share, 1e-12), 0.0)
+            fru_share = fru_hists / np.maximum(np.sum(fru_hists, axis=1, keepdims=True), 1.0)
+            self.class_weights = np.maximum(np.dot(fru_share, class_ratio), weight_min)
+
+        # unseen frustums start at the mean loss, i.e. a neutral weight
+        self.losses = np.full(self.fru_num, np.nan)
+
+    def weights(self):
+        weights = self.class_weights
+        if self.hard_example:
+            seen = ~np.isnan(self.losses)
+            if np.any(seen):
+                losses = np.where(seen, self.losses, np.mean(self.losses[seen]))
+                hardness = np.power(losses / max(np.mean(losses), 1e-12), self.hard_power)
+                weights = weights * np.maximum(hardness, self.weight_min)
+        return weights / np.sum(weights)
+
+    def sample(self, batch_size):
+        """
+        :param batch_size: number of frustums to draw
+        :return: indices into the frustum list, without repetition inside a batch
+        """
+        batch_size = min(batch_size, self.fru_num)
+        return np.random.choice(self.fru_num, batch_size, replace=False, p=self.weights())
+
+    def update(self, indices, losses):
+        """
+        record the per-frustum losses of the batch drawn by sample()
+        :param indices: indices returned by sample()
+        :param losses: (batch_size,) loss of every frustum in the batch
+        """
+        if not self.hard_example:
+            return
+        losses_old = self.losses[indices]
+        self.losses[indices] = np.where(np.isnan(losses_old), losses,
+                                        self.loss_momentum * losses_old + (1 - self.loss_momentum) * losses)
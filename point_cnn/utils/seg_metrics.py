@@ -0,0 +1,61 @@
+import numpy as np
+
+
+# the same functions as utils/util.py of point_seg and squeeze_seg, with the same arguments and returns
+def confusion_matrix(label, pred, n_class, mask=None, ignore_label=None, weights=None):
+    """
+    confusion matrix of a batch with one bincount, rows are labels and columns predictions
+    :param label: int array of any shape
+    :param pred: int array of the label shape
+    :param n_class: number of classes, labels and predictions out of [0, n_class) are left out
+    :param mask: optional array of the label shape, or with a trailing dimension of 1, only elements where it is
+                 nonzero count
+    :param ignore_label: optional class index or list of class indices left out
+    :param weights: optional per element weights of the label shape, e.g. the label weights of the validation
+    :return: (n_class, n_class) array, int64 counts or float64 weight sums with weights
+    """
+    assert np.shape(label) == np.shape(pred), 'label and pred shape mismatch: {} vs {}'.format(
+        np.shape(label), np.shape(pred))
+
+    label = np.asarray(label).reshape(-1).astype(np.int64)
+    pred = np.asarray(pred).reshape(-1).astype(np.int64)
+    valid = (label >= 0) & (label < n_class) & (pred >= 0) & (pred < n_class)
+    if mask is not None:
+        valid &= np.asarray(mask).reshape(-1) > 0
+    if ignore_label is not None:
+        valid &= ~np.in1d(label, ignore_label)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64).reshape(-1)[valid]
+
+    return np.bincount(label[valid] * n_class + pred[valid], weights=weights,
+                       minlength=n_class * n_class).reshape(n_class, n_class)
+
+
+def confusion_metrics(confusion, epsilon=1e-12):
+    """
+    per class metrics of a confusion matrix
+    :param confusion: (n_class, n_class) array, rows are labels and columns predictions, e.g. the sum of
+                      confusion_matrix over batches
+    :param epsilon: a small value to prevent division by 0
+    :return: ious, tps, fps, fns, precision, recall, as evaluate_iou
+    """
+    tps = np.diag(confusion).astype(np.float64)
+    fps = confusion.sum(axis=0) - tps
+    fns = confusion.sum(axis=1) - tps
+
+    ious = tps / (tps + fns + fps + epsilon)
+    precision = tps / (tps + fps + epsilon)
+    recall = tps / (tps + fns + epsilon)
+
+    return ious, tps, fps, fns, precision, recall
+
+
+def evaluate_iou(label, pred, n_class, epsilon=1e-12, mask=None, ignore_label=None, weights=None):
+    """
+    per class IoU of a batch
+    :param label, pred, n_class, mask, ignore_label, weights: as confusion_matrix
+    :param epsilon: a small value to prevent division by 0
+    :return: (n_class,) arrays of the IoU, the true positives, false positives and false negatives, the precision
+             and the recall of every class
+    """
+    return confusion_metrics(confusion_matrix(label, pred, n_class, mask, ignore_label, weights), epsilon)
@@ -0,0 +1,133 @@
+import numpy as np
+
+
+class VoxelGrid:
+    """
+    Hash grid of one point cloud for exact KNN and radius search without the (P_queries, P_points) distance
+    matrix, the NumPy counterpart of the VoxelKnn and VoxelRadiusSearch ops in knn/tf_knn.cpp.
+
+    The points are sorted by voxel once, a query then only looks at the voxels around its own one. Queries are
+    handled per query voxel, all the queries of a voxel share their candidate points.
+    """
+
+    def __init__(self, points, voxel_size=None, k=16):
+        """
+        build the grid
+        :param points: (P, 3) points
+        :param voxel_size: voxel edge length, None to pick one giving about k points per occupied voxel
+        :param k: the neighbor number the automatic voxel size is picked for
+        """
+        self.points = np.asarray(points, dtype=np.float32)
+        self.origin = self.points.min(axis=0)
+        extent = self.points.max(axis=0) - self.origin
+        if voxel_size is None:
+            # as if the points filled their bounding box, then corrected for points lying on surfaces
+            voxel_size = np.cbrt(np.prod(np.maximum(extent, 1e-3)) * k / len(self.points))
+            self._build(voxel_size, extent)
+            occupancy = len(self.points) / len(self.keys)
+            if occupancy < k / 2:
+                self._build(voxel_size * np.sqrt(k / occupancy), extent)
+        else:
+            self._build(voxel_size, extent)
+
+    def _build(self, voxel_size, extent):
+        self.voxel_size = np.float32(max(voxel_size, extent.max() / (1 << 20), 1e-6))
+        self.dims = (extent // self.voxel_size).astype(np.int64) + 1
+        cells = np.minimum(((self.points - self.origin) // self.voxel_size).astype(np.int64), self.dims - 1)
+        keys = self._keys(cells)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+
+    def _keys(self, cells):
+        return (cells[..., 0] * self.dims[1] + cells[..., 1]) * self.dims[2] + cells[..., 2]
+
+    # indices of the points in the voxels of the block of radius r around cell, sorted
+    def _block_points(self, cell, r):
+        lo = np.maximum(cell - r, 0)
+        hi = np.minimum(cell + r, self.dims - 1)
+        if np.any(hi < lo):
+            return np.zeros(0, dtype=np.int64)
+        block = np.stack(np.meshgrid(*[np.arange(lo[a], hi[a] + 1) for a in range(3)], indexing='ij'), axis=-1)
+        keys = self._keys(block.reshape(-1, 3))
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        positions = positions[self.keys[positions] == keys]
+        starts = self.starts[positions]
+        counts = self.counts[positions]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.sort(self.order[np.repeat(starts, counts) + offsets])
+
+    # squared distances of queries (Q, 3) to the candidates, summed as the ops do for identical rounding
+    def _distances(self, queries, candidates):
+        diff = queries[:, None, :] - self.points[candidates][None, :, :]
+        return diff[..., 0] * diff[..., 0] + diff[..., 1] * diff[..., 1] + diff[..., 2] * diff[..., 2]
+
+    # groups of queries sharing a voxel, as (cell, query indices)
+    def _query_groups(self, queries):
+        cells = np.floor((queries - self.origin) / self.voxel_size).astype(np.int64)
+        cells_unique, inverse = np.unique(cells, axis=0, return_inverse=True)
+        order = np.argsort(inverse.reshape(-1), kind='stable')
+        splits = np.cumsum(np.bincount(inverse.reshape(-1), minlength=len(cells_unique)))[:-1]
+        return zip(cells_unique, np.split(order, splits))
+
+    def knn(self, queries, k):
+        """
+        exact k nearest points, ties broken by the smaller point index
+        :param queries: (Q, 3) queries
+        :param k: neighbor number, k <= P
+        :return: (Q, k) euclidean distances in ascending order, (Q, k) point indices
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        point_num = len(self.points)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        for cell, query_indices in self._query_groups(queries):
+            r = max(0, int(np.max(np.maximum(-cell, cell - (self.dims - 1)))))
+            r_max = int(np.max(np.maximum(cell, self.dims - 1 - cell)))
+            while True:
+                # the block grows too big, or covers everything
+                if r >= r_max or (2 * r + 1) ** 3 > point_num:
+                    candidates = np.arange(point_num)
+                else:
+                    candidates = self._block_points(cell, r)
+                d = self._distances(queries[query_indices], candidates)
+                if len(candidates) >= k:
+                    # stable sort on index sorted candidates, so ties go to the smaller index
+                    nn = np.argsort(d, axis=1, kind='stable')[:, :k]
+                    d_nn = np.take_along_axis(d, nn, axis=1)
+                    distance_outside = max(r * self.voxel_size - 1e-4 * self.voxel_size, 0.0) ** 2
+                    if len(candidates) == point_num or np.all(d_nn[:, -1] < distance_outside):
+                        break
+                r += 1
+            distances[query_indices] = np.sqrt(d_nn)
+            indices[query_indices] = candidates[nn]
+        return distances, indices
+
+    def radius_search(self, queries, radius, max_nn):
+        """
+        the up to max_nn nearest points within radius
+        :param queries: (Q, 3) queries
+        :param radius: search radius
+        :param max_nn: maximum neighbor number
+        :return: (Q, max_nn) point indices, padded with the nearest one (0 when none), (Q,) neighbor counts
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        indices = np.zeros((len(queries), max_nn), dtype=np.int64)
+        counts = np.zeros(len(queries), dtype=np.int64)
+        r = int(np.ceil(radius / self.voxel_size + 1e-4))
+        for cell, query_indices in self._query_groups(queries):
+            candidates = self._block_points(cell, r)
+            if len(candidates) == 0:
+                continue
+            d = self._distances(queries[query_indices], candidates)
+            nn = np.argsort(d, axis=1, kind='stable')[:, :max_nn]
+            within = np.take_along_axis(d, nn, axis=1) <= np.float32(radius * radius)
+            counts_group = within.sum(axis=1)
+            indices_group = np.where(within, candidates[nn], candidates[nn[:, :1]])
+            indices_group[counts_group == 0] = 0
+            if indices_group.shape[1] < max_nn:
+                indices_group = np.concatenate([indices_group, np.repeat(indices_group[:, :1],
+                                                                         max_nn - indices_group.shape[1], axis=1)],
+                                               axis=1)
+            indices[query_indices] = indices_group
+            counts[query_indices] = counts_group
+        return indices, counts
@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+"""Validation On Segmentation Task, run from saved checkpoints in its own process."""
+
+# python3 val_seg_df_fru.py -i /ssd/Datasets/DataFountain/data_bin_fru \
+# -v /ssd/Datasets/DataFountain/val.txt \
+# -l /ssd/wyc/models/data_fountain/pointcnn_seg_df_x4_2048_fps_xxxx/ckpts/iter-80000 \
+# -s /ssd/wyc/models/data_fountain/pointcnn_seg_df_x4_2048_fps_xxxx/summary \
+# -m pointcnn_seg -x df_x4_2048_fps
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import math
+import argparse
+import importlib
+import data_utils
+import numpy as np
+import pointfly as pf
+import tensorflow as tf
+from datetime import datetime
+from utils import df_utils
+
+
+class Validator:
+    """Holds the val graph, the val frustums and a summary writer, evaluates one checkpoint per call."""
+
+    def __init__(self, dir_bin, path_filelist_val, model_name, setting_name, folder_summary, max_fru_num=None):
+        model = importlib.import_module(model_name)
+        setting_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), model_name)
+        sys.path.append(setting_path)
+        setting = importlib.import_module(setting_name)
+        self.setting = setting
+
+        self.list_fru_val, _ = data_utils.load_bin_all(dir_bin, path_filelist_val)
+        if max_fru_num is not None:
+            self.list_fru_val = self.list_fru_val[0:max_fru_num]
+        print('{}-{:d} validation samples.'.format(datetime.now(), len(self.list_fru_val)))
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.xforms = tf.placeholder(tf.float32, shape=(None, 3, 3), name="xforms")
+            self.jitter_range = tf.placeholder(tf.float32, shape=(1), name="jitter_range")
+            self.pts_fts_sampled = tf.placeholder(tf.float32, shape=(None, setting.sample_num, setting.data_dim),
+                                                  name='pts_fts')
+            self.labels_sampled = tf.placeholder(tf.int64, shape=(None, setting.sample_num), name='labels_seg')
+            self.labels_weights_sampled = tf.placeholder(tf.float32, shape=(None, setting.sample_num),
+                                                         name='labels_weights')
+            is_training = tf.constant(False, dtype=tf.bool, name='is_training')
+
+            features_sampled = None
+            if setting.data_dim > 3:
+                points_sampled, features_sampled = tf.split(self.pts_fts_sampled,
+                                                            [3, setting.data_dim - 3],
+                                                            axis=-1,
+                                                            name='split_points_features')
+                if not setting.use_extra_features:
+                    features_sampled = None
+            else:
+                points_sampled = self.pts_fts_sampled
+            points_augmented = pf.augment(points_sampled, self.xforms, self.jitter_range)
+
+            net = model.Net(points_augmented, features_sampled, is_training, setting)
+            predictions = tf.argmax(net.logits, axis=-1, name='predictions')
+            loss_op = tf.losses.sparse_softmax_cross_entropy(labels=self.labels_sampled, logits=net.logits,
+                                                             weights=self.labels_weights_sampled)
+
+            with tf.name_scope('metrics'):
+                self.loss_mean_op, loss_mean_update_op = tf.metrics.mean(loss_op)
+                confusion_op, confusion_update_op = \
+                    pf.streaming_confusion_matrix(self.labels_sampled, predictions, setting.num_class,
+                                                  self.labels_weights_sampled)
+                self.t_1_acc_op, self.t_1_per_class_acc_op, self.t_1_mean_iou_op, t_1_per_class_iou_op = \
+                    pf.confusion_matrix_metrics(confusion_op)
+            self.update_ops = [loss_mean_update_op, confusion_update_op]
+            self.reset_metrics_op = tf.variables_initializer([var for var in tf.local_variables()
+                                                              if var.name.split('/')[0] == 'metrics'])
+
+            _ = tf.summary.scalar('loss/val', tensor=self.loss_mean_op, collections=['val'])
+            _ = tf.summary.scalar('t_1_acc/val', tensor=self.t_1_acc_op, collections=['val'])
+            _ = tf.summary.scalar('t_1_per_class_acc/val', tensor=self.t_1_per_class_acc_op, collections=['val'])
+            _ = tf.summary.scalar('t_1_mean_iou/val', tensor=self.t_1_mean_iou_op, collections=['val'])
+            for class_idx in range(setting.num_class):
+                _ = tf.summary.scalar('t_1_iou_{:d}/val'.format(class_idx), tensor=t_1_per_class_iou_op[class_idx],
+                                      collections=['val'])
+            self.summaries_val_op = tf.summary.merge_all('val')
+
+            self.saver = tf.train.Saver()
+            config = tf.ConfigProto(allow_soft_placement=True)
+            # the training process shares the gpus unless the validation has its own gpu_id
+            config.gpu_options.allow_growth = True
+            self.sess = tf.Session(config=config)
+
+        # a second event file in the training summary folder, tensorboard merges them
+        self.summary_writer = tf.summary.FileWriter(folder_summary)
+
+    def validate(self, path_ckpt, step):
+        """
+        evaluate a checkpoint on the whole val list
+        :param path_ckpt: checkpoint prefix, e.g. ckpts/iter-5000
+        :param step: summary step, the training iteration the checkpoint was saved at
+        :return: (loss, t_1_acc, t_1_per_class_acc, t_1_mean_iou)
+        """
+        setting = self.setting
+        batch_size = setting.batch_size
+        num_val = len(self.list_fru_val)
+        batch_num_val = int(math.ceil(num_val / batch_size))
+
+        self.saver.restore(self.sess, path_ckpt)
+        self.sess.run(self.reset_metrics_op)
+        for batch_val_idx in range(batch_num_val):
+            start_idx = batch_size * batch_val_idx
+            end_idx = min(start_idx + batch_size, num_val)
+            batch_size_val = end_idx - start_idx
+            fru_batch = self.list_fru_val[start_idx:end_idx]
+
+            points_batch_sampled, labels_batch_sampled, weights_batch_sampled = \
+                df_utils.group_sampling_fru(fru_batch, setting.sample_num, setting.label_weights)
+
+            xforms_np, _ = pf.get_xforms(batch_size_val,
+                                         rotation_range=setting.rotation_range_val,
+                                         scaling_range=setting.scaling_range_val,
+                                         order=setting.rotation_order)
+            self.sess.run(self.update_ops,
+                          feed_dict={
+                              self.pts_fts_sampled: points_batch_sampled,
+                              self.xforms: xforms_np,
+                              self.jitter_range: np.array([setting.jitter_val]),
+                              self.labels_sampled: labels_batch_sampled,
+                              self.labels_weights_sampled: weights_batch_sampled,
+                          })
+
+        loss_val, t_1_acc_val, t_1_per_class_acc_val, t_1_mean_iou_val, summaries_val = self.sess.run(
+            [self.loss_mean_op, self.t_1_acc_op, self.t_1_per_class_acc_op, self.t_1_mean_iou_op,
+             self.summaries_val_op])
+        self.summary_writer.add_summary(summaries_val, step)
+        self.summary_writer.flush()
+        print('{}-[Val  ]-Iter: {:06d}  Loss: {:.4f}  T-1 Acc: {:.4f}  T-1 mAcc: {:.4f}  T-1 mIOU: {:.4f}'
+              .format(datetime.now(), step, loss_val, t_1_acc_val, t_1_per_class_acc_val, t_1_mean_iou_val))
+        return loss_val, t_1_acc_val, t_1_per_class_acc_val, t_1_mean_iou_val
+
+    def close(self):
+        self.summary_writer.close()
+        self.sess.close()
+
+
+def validate_queue(queue_ckpt, dir_bin, path_filelist_val, model_name, setting_name, folder_summary,
+                   max_fru_num=None, gpu_id=None, queue_result=None):
+    """
+    process target: validate the (path_ckpt, step) items put into queue_ckpt until None arrives,
+    when training outruns validation only the newest queued checkpoint is evaluated, the last one always is,
+    (path_ckpt, metrics) is put into queue_result after every validation, with None metrics for the skipped
+    checkpoints, so that the trainer only deletes checkpoints validation is done with
+    """
+    if gpu_id is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
+    validator = Validator(dir_bin, path_filelist_val, model_name, setting_name, folder_summary, max_fru_num)
+
+    def report(path_ckpt, metrics):
+        if queue_result is not None:
+            queue_result.put((path_ckpt, metrics))
+
+    done = False
+    while not done:
+        item = queue_ckpt.get()
+        done = item is None
+        # skip to the newest checkpoint, an end of training None behind it still has it validated first
+        while not queue_ckpt.empty():
+            item_next = queue_ckpt.get()
+            if item_next is None:
+                done = True
+            else:
+                if item is not None:
+                    report(item[0], None)
+                item = item_next
+        if item is None:
+            continue
+        path_ckpt, step = item
+        if not os.path.exists(path_ckpt + '.index'):
+            print('{}-Checkpoint {} no longer exists, skipped!'.format(datetime.now(), path_ckpt))
+            report(path_ckpt, None)
+            continue
+        loss_val, t_1_acc_val, t_1_per_class_acc_val, t_1_mean_iou_val = validator.validate(path_ckpt, step)
+        report(path_ckpt, {'loss': loss_val, 't_1_acc': t_1_acc_val, 't_1_per_class_acc': t_1_per_class_acc_val,
+                           't_1_mean_iou': t_1_mean_iou_val})
+
+    validator.close()
+    print('{}-Validation done! PID = {}'.format(datetime.now(), os.getpid()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir_bin', '-i', help='Path to binary files dir (*.npy)', required=True)
+    parser.add_argument('--filelist_val', '-v', help='Path to validation set ground truth (.txt)', required=True)
+    parser.add_argument('--load_ckpt', '-l', help='Path to a check point file for load', required=True)
+    parser.add_argument('--summary_folder', '-s', help='Path to folder for saving summary', required=True)
+    parser.add_argument('--model', '-m', help='Model to use', required=True)
+    parser.add_argument('--setting', '-x', help='Setting to use', required=True)
+    args = parser.parse_args()
+    print(args)
+
+    step = int(args.load_ckpt.split('-')[-1]) if args.load_ckpt.split('-')[-1].isdigit() else 0
+    validator = Validator(args.dir_bin, args.filelist_val, args.model, args.setting, args.summary_folder)
+    validator.validate(args.load_ckpt, step)
+    validator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+#include "tensorflow/core/framework/op.h"
+#include "tensorflow/core/framework/op_kernel.h"
+#include "tensorflow/core/framework/shape_inference.h"
+#include "tensorflow/core/framework/common_shape_fns.h"
+#include "tensorflow/core/util/work_sharder.h"
+#include "tensorflow/core/platform/mutex.h"
+#include <cmath>
+#include <vector>
+
+using namespace tensorflow;
+
+// The X-transformation of xconv in one op, per representative point:
+//   X_0 = scale0 * elu(conv(nn_pts_local, w0)) + shift0        w0 is the (1, K, C_pts, K * K) conv2d kernel
+//   X_1 = scale1 * elu(depthwise(X_0, w1)) + shift1           w1 is the (1, K, K, K) depthwise kernel
+//   X_2 = scale2 * depthwise(X_1, w2) + shift2                w2 is the (1, K, K, K) depthwise kernel
+//   fts_X = X_2 (K, K) matmul nn_fts (K, C)
+// scale and shift are the batch normalizations folded into an affine map, applied after the elu as pf.conv2d and
+// pf.depthwise_conv2d do, the X_i are never written out.
+REGISTER_OP("XTransform")
+.Input("nn_pts_local: float32")
+.Input("nn_fts: float32")
+.Input("w0: float32")
+.Input("scale0: float32")
+.Input("shift0: float32")
+.Input("w1: float32")
+.Input("scale1: float32")
+.Input("shift1: float32")
+.Input("w2: float32")
+.Input("scale2: float32")
+.Input("shift2: float32")
+.Output("fts_x: float32")
+.SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+    ::tensorflow::shape_inference::ShapeHandle dims1; // batch_size * points_num * K * C_pts
+    TF_RETURN_IF_ERROR(c->WithRank(c->input(0), 4, &dims1));
+    ::tensorflow::shape_inference::ShapeHandle dims2; // batch_size * points_num * K * C
+    TF_RETURN_IF_ERROR(c->WithRank(c->input(1), 4, &dims2));
+    c->set_output(0, c->input(1));
+    return Status::OK();
+});
+
+REGISTER_OP("XTransformGrad")
+.Input("nn_pts_local: float32")
+.Input("nn_fts: float32")
+.Input("w0: float32")
+.Input("scale0: float32")
+.Input("shift0: float32")
+.Input("w1: float32")
+.Input("scale1: float32")
+.Input("shift1: float32")
+.Input("w2: float32")
+.Input("scale2: float32")
+.Input("shift2: float32")
+.Input("grad_fts_x: float32")
+.Output("grad_nn_pts_local: float32")
+.Output("grad_nn_fts: float32")
+.Output("grad_w0: float32")
+.Output("grad_scale0: float32")
+.Output("grad_shift0: float32")
+.Output("grad_w1: float32")
+.Output("grad_scale1: float32")
+.Output("grad_shift1: float32")
+.Output("grad_w2: float32")
+.Output("grad_scale2: float32")
+.Output("grad_shift2: float32")
+.SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+    for (int i = 0; i < 11; i++) {
+        c->set_output(i, c->input(i));
+    }
+    return Status::OK();
+});
+
+struct XTransformWeights {
+    int K;
+    int C_pts;
+    int C;
+    const float *w0, *scale0, *shift0;
+    const float *w1, *scale1, *shift1;
+    const float *w2, *scale2, *shift2;
+};
+
+// intermediates of one point, K * K each: activations e of the conv outputs and their batch normalizations a
+struct XTransformBuffers {
+    std::vector<float> e0, a0, e1, a1, z2, X;
+    explicit XTransformBuffers(int K) : e0(K * K), a0(K * K), e1(K * K), a1(K * K), z2(K * K), X(K * K) {}
+};
+
+inline float elu(float x) {
+    return x < 0 ? std::expm1(x) : x;
+}
+
+// derivative of elu from its output
+inline float eluGrad(float y) {
+    return y < 0 ? y + 1 : 1;
+}
+
+// out[c * K + m] = sum_w in[w * K + c] * w[(w * K + c) * K + m], the depthwise conv over a (K, K) input
+inline void depthwise(int K, const float *in, const float *weights, float *out) {
+    std::fill(out, out + K * K, 0.0f);
+    for (int w = 0; w < K; w++) {
+        for (int c = 0; c < K; c++) {
+            float v = in[w * K + c];
+            const float *weights_wc = weights + (w * K + c) * K;
+            float *out_c = out + c * K;
+            for (int m = 0; m < K; m++) {
+                out_c[m] += v * weights_wc[m];
+            }
+        }
+    }
+}
+
+void xtransformForward(const XTransformWeights &p, const float *pts, XTransformBuffers &buf) {
+    const int K = p.K, KK = K * K;
+    std::fill(buf.e0.begin(), buf.e0.end(), 0.0f);
+    for (int wc = 0; wc < K * p.C_pts; wc++) {
+        float v = pts[wc];
+        const float *w0_wc = p.w0 + wc * KK;
+        for (int o = 0; o < KK; o++) {
+            buf.e0[o] += v * w0_wc[o];
+        }
+    }
+    for (int o = 0; o < KK; o++) {
+        buf.e0[o] = elu(buf.e0[o]);
+        buf.a0[o] = p.scale0[o] * buf.e0[o] + p.shift0[o];
+    }
+    depthwise(K, buf.a0.data(), p.w1, buf.e1.data());
+    for (int o = 0; o < KK; o++) {
+        buf.e1[o] = elu(buf.e1[o]);
+        buf.a1[o] = p.scale1[o] * buf.e1[o] + p.shift1[o];
+    }
+    depthwise(K, buf.a1.data(), p.w2, buf.z2.data());
+    for (int o = 0; o < KK; o++) {
+        buf.X[o] = p.scale2[o] * buf.z2[o] + p.shift2[o];
+    }
+}
+
+// out (K, C) = X (K, K) matmul fts (K, C)
+void xtransformApply(const XTransformWeights &p, const float *X, const float *fts, float *out) {
+    const int K = p.K, C = p.C;
+    std::fill(out, out + K * C, 0.0f);
+    for (int a = 0; a < K; a++) {
+        for (int b = 0; b < K; b++) {
+            float x = X[a * K + b];
+            const float *fts_b = fts + b * C;
+            float *out_a = out + a * C;
+            for (int ch = 0; ch < C; ch++) {
+                out_a[ch] += x * fts_b[ch];
+            }
+        }
+    }
+}
+
+struct XTransformGrads {
+    std::vector<float> w0, scale0, shift0, w1, scale1, shift1, w2, scale2, shift2;
+    XTransformGrads(int K, int C_pts)
+        : w0(K * C_pts * K * K), scale0(K * K), shift0(K * K), w1(K * K * K), scale1(K * K), shift1(K * K),
+          w2(K * K * K), scale2(K * K), shift2(K * K) {}
+    void add(const XTransformGrads &other) {
+        std::vector<float> XTransformGrads::*members[] = {&XTransformGrads::w0, &XTransformGrads::scale0,
+                                                          &XTransformGrads::shift0, &XTransformGrads::w1,
+                                                          &XTransformGrads::scale1, &XTransformGrads::shift1,
+                                                          &XTransformGrads::w2, &XTransformGrads::scale2,
+                                                          &XTransformGrads::shift2};
+        for (auto member : members) {
+            for (size_t i = 0; i < (this->*member).size(); i++) {
+                (this->*member)[i] += (other.*member)[i];
+            }
+        }
+    }
+};
+
+// backward of a depthwise conv, accumulates the weight gradient, writes the input gradient
+inline void depthwiseGrad(int K, const float *in, const float *weights, const float *grad_out,
+                          float *grad_in, float *grad_weights) {
+    for (int w = 0; w < K; w++) {
+        for (int c = 0; c < K; c++) {
+            float v = in[w * K + c];
+            const float *weights_wc = weights + (w * K + c) * K;
+            float *grad_weights_wc = grad_weights + (w * K + c) * K;
+            const float *grad_out_c = grad_out + c * K;
+            float grad_v = 0;
+            for (int m = 0; m < K; m++) {
+                grad_weights_wc[m] += v * grad_out_c[m];
+                grad_v += weights_wc[m] * grad_out_c[m];
+            }
+            grad_in[w * K + c] = grad_v;
+        }
+    }
+}
+
+// recomputes the forward pass of one point, then back propagates grad_out (K, C) through it
+void xtransformBackward(const XTransformWeights &p, const float *pts, const float *fts, const float *grad_out,
+                        XTransformBuffers &buf, std::vector<float> &grad_X, std::vector<float> &grad_tmp,
+                        float *grad_pts, float *grad_fts, XTransformGrads &grads) {
+    const int K = p.K, KK = K * K, C = p.C;
+    xtransformForward(p, pts, buf);
+
+    // fts_X = X matmul fts
+    for (int a = 0; a < K; a++) {
+        for (int b = 0; b < K; b++) {
+            const float *fts_b = fts + b * C;
+            const float *grad_out_a = grad_out + a * C;
+            float g = 0;
+            for (int ch = 0; ch < C; ch++) {
+                g += grad_out_a[ch] * fts_b[ch];
+            }
+            grad_X[a * K + b] = g;
+        }
+    }
+    std::fill(grad_fts, grad_fts + K * C, 0.0f);
+    for (int a = 0; a < K; a++) {
+        for (int b = 0; b < K; b++) {
+            float x = buf.X[a * K + b];
+            const float *grad_out_a = grad_out + a * C;
+            float *grad_fts_b = grad_fts + b * C;
+            for (int ch = 0; ch < C; ch++) {
+                grad_fts_b[ch] += x * grad_out_a[ch];
+            }
+        }
+    }
+
+    // X = scale2 * z2 + shift2
+    for (int o = 0; o < KK; o++) {
+        grads.scale2[o] += grad_X[o] * buf.z2[o];
+        grads.shift2[o] += grad_X[o];
+        grad_X[o] *= p.scale2[o];
+    }
+    // z2 = depthwise(a1, w2), a1 = scale1 * e1 + shift1, e1 = elu(z1)
+    depthwiseGrad(K, buf.a1.data(), p.w2, grad_X.data(), grad_tmp.data(), grads.w2.data());
+    for (int o = 0; o < KK; o++) {
+        float g = grad_tmp[o];
+        grads.scale1[o] += g * buf.e1[o];
+        grads.shift1[o] += g;
+        grad_tmp[o] = g * p.scale1[o] * eluGrad(buf.e1[o]);
+    }
+    // z1 = depthwise(a0, w1), a0 = scale0 * e0 + shift0, e0 = elu(z0)
+    depthwiseGrad(K, buf.a0.data(), p.w1, grad_tmp.data(), grad_X.data(), grads.w1.data());
+    for (int o = 0; o < KK; o++) {
+        float g = grad_X[o];
+        grads.scale0[o] += g * buf.e0[o];
+        grads.shift0[o] += g;
+        grad_X[o] = g * p.scale0[o] * eluGrad(buf.e0[o]);
+    }
+    // z0 = conv(pts, w0)
+    for (int wc = 0; wc < K * p.C_pts; wc++) {
+        float v = pts[wc];
+        const float *w0_wc = p.w0 + wc * KK;
+        float *grad_w0_wc = grads.w0.data() + wc * KK;
+        float g = 0;
+        for (int o = 0; o < KK; o++) {
+            grad_w0_wc[o] += v * grad_X[o];
+            g += w0_wc[o] * grad_X[o];
+        }
+        grad_pts[wc] = g;
+    }
+}
+
+// checks the inputs, sets the context status when they do not match
+void xtransformWeights(OpKernelContext *context, XTransformWeights *p, int *batch_size, int *pts_num) {
+    const Tensor &pts_tensor = context->input(0);
+    const Tensor &fts_tensor = context->input(1);
+    OP_REQUIRES(context, pts_tensor.dims() == 4,
+                errors::InvalidArgument("XTransform expects (batch_size,num_points,K,C_pts) nn_pts_local shape"));
+    *batch_size = pts_tensor.dim_size(0);
+    *pts_num = pts_tensor.dim_size(1);
+    int K = pts_tensor.dim_size(2);
+    OP_REQUIRES(context, fts_tensor.dims() == 4 && fts_tensor.dim_size(0) == *batch_size
+                && fts_tensor.dim_size(1) == *pts_num && fts_tensor.dim_size(2) == K,
+                errors::InvalidArgument("XTransform expects (batch_size,num_points,K,C) nn_fts shape"));
+    p->K = K;
+    p->C_pts = pts_tensor.dim_size(3);
+    p->C = fts_tensor.dim_size(3);
+
+    const int KK = K * K;
+    const TensorShape shapes[9] = {TensorShape{1, K, p->C_pts, KK}, TensorShape{KK}, TensorShape{KK},
+                                   TensorShape{1, K, K, K}, TensorShape{KK}, TensorShape{KK},
+                                   TensorShape{1, K, K, K}, TensorShape{KK}, TensorShape{KK}};
+    const float **weights[9] = {&p->w0, &p->scale0, &p->shift0, &p->w1, &p->scale1, &p->shift1,
+                                &p->w2, &p->scale2, &p->shift2};
+    for (int i = 0; i < 9; i++) {
+        const Tensor &tensor = context->input(2 + i);
+        OP_REQUIRES(context, tensor.shape() == shapes[i],
+                    errors::InvalidArgument("XTransform expects input ", 2 + i, " of shape ",
+                                            shapes[i].DebugString(), ", got ", tensor.shape().DebugString()));
+        *weights[i] = tensor.flat<float>().data();
+    }
+}
+
+class XTransformCpuOp: public OpKernel{
+public:
+    explicit XTransformCpuOp(OpKernelConstruction* context):OpKernel(context) {}
+    void Compute(OpKernelContext * context)override{
+        XTransformWeights p;
+        int batch_size, pts_num;
+        xtransformWeights(context, &p, &batch_size, &pts_num);
+        if (!context->status().ok()) {
+            return;
+        }
+        const float *pts = context->input(0).flat<float>().data();
+        const float *fts = context->input(1).flat<float>().data();
+
+        Tensor *out_tensor;
+        OP_REQUIRES_OK(context, context->allocate_output(0, context->input(1).shape(), &out_tensor));
+        float *out = out_tensor->flat<float>().data();
+
+        const int K = p.K, C = p.C, C_pts = p.C_pts;
+        auto worker_threads = context->device()->tensorflow_cpu_worker_threads();
+        int64 cost = (int64)K * K * (K * C_pts + 2 * K + C);
+        Shard(worker_threads->num_threads, worker_threads->workers, (int64)batch_size * pts_num, cost,
+              [&](int64 start, int64 limit) {
+                  XTransformBuffers buf(K);
+                  for (int64 index = start; index < limit; index++) {
+                      xtransformForward(p, pts + index * K * C_pts, buf);
+                      xtransformApply(p, buf.X.data(), fts + index * K * C, out + index * K * C);
+                  }
+              });
+    }
+};
+REGISTER_KERNEL_BUILDER(Name("XTransform").Device(DEVICE_CPU),XTransformCpuOp);
+
+class XTransformGradCpuOp: public OpKernel{
+public:
+    explicit XTransformGradCpuOp(OpKernelConstruction* context):OpKernel(context) {}
+    void Compute(OpKernelContext * context)override{
+        XTransformWeights p;
+        int batch_size, pts_num;
+        xtransformWeights(context, &p, &batch_size, &pts_num);
+        if (!context->status().ok()) {
+            return;
+        }
+        const Tensor &grad_out_tensor = context->input(11);
+        OP_REQUIRES(context, grad_out_tensor.shape() == context->input(1).shape(),
+                    errors::InvalidArgument("XTransformGrad expects grad_fts_x of the nn_fts shape"));
+        const float *pts = context->input(0).flat<float>().data();
+        const float *fts = context->input(1).flat<float>().data();
+        const float *grad_out = grad_out_tensor.flat<float>().data();
+
+        float *outputs[11];
+        for (int i = 0; i < 11; i++) {
+            Tensor *out_tensor;
+            OP_REQUIRES_OK(context, context->allocate_output(i, context->input(i).shape(), &out_tensor));
+            outputs[i] = out_tensor->flat<float>().data();
+        }
+
+        // the weight gradients are summed per shard, then added up under the lock
+        const int K = p.K, C = p.C, C_pts = p.C_pts;
+        XTransformGrads grads(K, C_pts);
+        mutex mu;
+        auto worker_threads = context->device()->tensorflow_cpu_worker_threads();
+        int64 cost = (int64)K * K * (K * C_pts + 2 * K + C) * 3;
+        Shard(worker_threads->num_threads, worker_threads->workers, (int64)batch_size * pts_num, cost,
+              [&](int64 start, int64 limit) {
+                  XTransformBuffers buf(K);
+                  XTransformGrads grads_shard(K, C_pts);
+                  std::vector<float> grad_X(K * K), grad_tmp(K * K);
+                  for (int64 index = start; index < limit; index++) {
+                      xtransformBackward(p, pts + index * K * C_pts, fts + index * K * C, grad_out + index * K * C,
+                                         buf, grad_X, grad_tmp, outputs[0] + index * K * C_pts,
+                                         outputs[1] + index * K * C, grads_shard);
+                  }
+                  mutex_lock lock(mu);
+                  grads.add(grads_shard);
+              });
+
+        const std::vector<float> *grads_weights[9] = {&grads.w0, &grads.scale0, &grads.shift0, &grads.w1,
+                                                      &grads.scale1, &grads.shift1, &grads.w2, &grads.scale2,
+                                                      &grads.shift2};
+        for (int i = 0; i < 9; i++) {
+            std::copy(grads_weights[i]->begin(), grads_weights[i]->end(), outputs[2 + i]);
+        }
+    }
+};
+REGISTER_KERNEL_BUILDER(Name("XTransformGrad").Device(DEVICE_CPU),XTransformGradCpuOp);
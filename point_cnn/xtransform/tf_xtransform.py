@@ -0,0 +1,29 @@
+import tensorflow as tf
+import sys
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+xtransform_module = tf.load_op_library(os.path.join(BASE_DIR, 'tf_xtransform.so'))
+
+
+def x_transform(nn_pts_local, nn_fts, w0, scale0, shift0, w1, scale1, shift1, w2, scale2, shift2):
+    """
+    the X-transformation of xconv fused in one op, CPU only, the (N, P, K, K) intermediates are not materialized
+    :param nn_pts_local:    (N, P, K, C_pts) local coordinates of the neighbors
+    :param nn_fts:  (N, P, K, C) neighbor features to be transformed
+    :param w0:  (1, K, C_pts, K * K) kernel of the X_0 conv2d
+    :param w1:  (1, K, K, K) depthwise kernel of X_1
+    :param w2:  (1, K, K, K) depthwise kernel of X_2
+    :param scale0, shift0, scale1, shift1, scale2, shift2:  (K * K,) batch normalizations of X_0, X_1 and X_2
+                folded into scale * x + shift
+    :return:    (N, P, K, C) X_2 matmul nn_fts
+    """
+
+    return xtransform_module.x_transform(nn_pts_local, nn_fts, w0, scale0, shift0, w1, scale1, shift1,
+                                         w2, scale2, shift2)
+
+
+@tf.RegisterGradient('XTransform')
+def _x_transform_grad(op, grad_fts_x):
+    return xtransform_module.x_transform_grad(*(list(op.inputs) + [grad_fts_x]))
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+"""Benchmark the fused X-transformation op against the composed conv2d/depthwise/matmul one, per xconv layer."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+import pointcnn
+
+
+def time_op(sess, op, repeat_num):
+    sess.run(op)  # warm up
+    time_start = time.time()
+    for _ in range(repeat_num):
+        sess.run(op)
+    return (time.time() - time_start) / repeat_num
+
+
+# bytes of all the tensors the run allocated as op outputs, the activation memory of the subgraph
+def output_bytes(sess, op):
+    run_metadata = tf.RunMetadata()
+    sess.run(op, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), run_metadata=run_metadata)
+    return sum(output.tensor_description.allocation_description.requested_bytes
+               for dev_stats in run_metadata.step_stats.dev_stats
+               for node_stats in dev_stats.node_stats
+               for output in node_stats.output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', '-b', help='Batch size', type=int, default=8)
+    parser.add_argument('--repeat_num', '-r', help='Repeat number', type=int, default=10)
+    parser.add_argument('--threads', '-t', help='Intra op threads, 0 for all cores', type=int, default=0)
+    args = parser.parse_args()
+    print(args)
+
+    # (P, K, C of nn_fts_input) of the df_x4_2048_fps xconv layers
+    configs = [(2048, 12, 48), (768, 16, 80), (384, 16, 160), (128, 16, 320)]
+    config = tf.ConfigProto(intra_op_parallelism_threads=args.threads, device_count={'GPU': 0})
+
+    print('{:>6} {:>4} {:>5} {:>10} {:>10} {:>12} {:>12} {:>10} {:>10}'.format(
+        'P', 'K', 'C', 'fwd (ms)', 'fused', 'fwd+bwd (ms)', 'fused', 'mem (MB)', 'fused'))
+    for P, K, C in configs:
+        results = []
+        for fused in [False, True]:
+            with tf.Graph().as_default():
+                with tf.device('/cpu:0'):
+                    nn_pts_local = tf.constant(np.random.random((args.batch_size, P, K, 3)).astype(np.float32))
+                    nn_fts = tf.constant(np.random.random((args.batch_size, P, K, C)).astype(np.float32))
+                    fts_X = pointcnn.x_transformation(nn_pts_local, nn_fts, 'xconv_', args.batch_size, P, K, False,
+                                                      fused)
+                    grads = tf.gradients(tf.reduce_sum(fts_X), [nn_fts] + tf.trainable_variables())
+                with tf.Session(config=config) as sess:
+                    sess.run(tf.global_variables_initializer())
+                    results += [time_op(sess, fts_X.op, args.repeat_num) * 1000,
+                                time_op(sess, [grad.op for grad in grads], args.repeat_num) * 1000,
+                                output_bytes(sess, fts_X.op) / 1024 / 1024]
+        print('{:>6d} {:>4d} {:>5d} {:>10.2f} {:>10.2f} {:>12.2f} {:>12.2f} {:>10.1f} {:>10.1f}'.format(
+            P, K, C, results[0], results[3], results[1], results[4], results[2], results[5]))
+
+
+if __name__ == '__main__':
+    main()
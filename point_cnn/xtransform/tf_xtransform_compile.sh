@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+# the fused X-transformation has a CPU kernel only, no CUDA needed
+PYTHON=python3
+TF_LIB=$($PYTHON -c 'import tensorflow as tf; print(tf.sysconfig.get_lib())')
+TF_PATH=$TF_LIB/include
+g++ -std=c++11 tf_xtransform.cpp -o tf_xtransform.so -shared -fPIC -L$TF_LIB -ltensorflow_framework \
+-I $TF_PATH/external/nsync/public/ -I $TF_PATH -O2 -D_GLIBCXX_USE_CXX11_ABI=0
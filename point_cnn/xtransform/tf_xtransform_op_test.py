@@ -0,0 +1,80 @@
+import os
+import sys
+import numpy as np
+import tensorflow as tf
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+import pointcnn
+from tf_xtransform import x_transform
+
+
+# the composed and the fused X-transformation on the same variables, which get random values
+def build(N, P, K, C):
+  nn_pts_local = tf.constant(np.random.random((N, P, K, 3)).astype('float32') - 0.5)
+  nn_fts = tf.constant(np.random.random((N, P, K, C)).astype('float32') - 0.5)
+  with tf.variable_scope('xconv_1_', reuse=tf.AUTO_REUSE):
+    fts_X = pointcnn.x_transformation(nn_pts_local, nn_fts, 'xconv_1_', N, P, K, False)
+    fts_X_fused = pointcnn.x_transformation(nn_pts_local, nn_fts, 'xconv_1_', N, P, K, False, fused=True)
+  randomize_ops = [tf.assign(var, (np.random.uniform(0.5, 1.5, var.shape) if 'variance' in var.name
+                              else np.random.uniform(-0.5, 0.5, var.shape)).astype('float32'))
+                   for var in tf.global_variables()]
+  return nn_pts_local, nn_fts, fts_X, fts_X_fused, randomize_ops
+
+
+class XTransformTest(tf.test.TestCase):
+  def test_same_variables(self):
+    with tf.Graph().as_default():
+      build(2, 16, 8, 12)
+      names = sorted(var.op.name for var in tf.global_variables())
+      self.assertEqual(len(names), len(set(names)))
+      self.assertEqual(len(names), 15)  # 3 kernels and 3 * 4 batch normalization variables
+
+  def test_training_composed(self):
+    for is_training in [lambda: True, lambda: tf.placeholder(tf.bool, name='is_training')]:
+      with tf.Graph().as_default() as graph:
+        nn_pts_local = tf.zeros((2, 16, 8, 3))
+        nn_fts = tf.zeros((2, 16, 8, 12))
+        with tf.variable_scope('xconv_1_', reuse=tf.AUTO_REUSE):
+          pointcnn.x_transformation(nn_pts_local, nn_fts, 'xconv_1_', 2, 16, 8, is_training(), fused=True)
+        self.assertNotIn('XTransform', [op.type for op in graph.get_operations()])
+        self.assertEqual(len(tf.global_variables()), 15)
+
+  def test_forward(self):
+    np.random.seed(0)
+    for N, P, K, C in [(2, 128, 8, 24), (1, 7, 16, 5), (3, 33, 12, 64)]:
+      with tf.Graph().as_default():
+        _, _, fts_X, fts_X_fused, randomize_ops = build(N, P, K, C)
+        with self.test_session() as sess:
+          sess.run(randomize_ops)
+          fts_X_val, fts_X_fused_val = sess.run([fts_X, fts_X_fused])
+        self.assertAllClose(fts_X_fused_val, fts_X_val, rtol=1e-4, atol=1e-4)
+
+  def test_backward(self):
+    np.random.seed(1)
+    with tf.Graph().as_default():
+      nn_pts_local, nn_fts, fts_X, fts_X_fused, randomize_ops = build(2, 32, 8, 16)
+      xs = [nn_pts_local, nn_fts] + tf.trainable_variables()
+      grad_out = tf.constant(np.random.random(fts_X.get_shape().as_list()).astype('float32') - 0.5)
+      grads = tf.gradients(fts_X, xs, grad_out)
+      grads_fused = tf.gradients(fts_X_fused, xs, grad_out)
+      with self.test_session() as sess:
+        sess.run(randomize_ops)
+        grads_val, grads_fused_val = sess.run([grads, grads_fused])
+      for x, grad_val, grad_fused_val in zip(xs, grads_val, grads_fused_val):
+        self.assertAllClose(grad_fused_val, grad_val, rtol=1e-3, atol=1e-3, msg=x.name)
+
+  def test_gradient_numeric(self):
+    np.random.seed(2)
+    K, C = 4, 3
+    shapes = [(2, 3, K, 3), (2, 3, K, C), (1, K, 3, K * K), (K * K,), (K * K,), (1, K, K, K), (K * K,), (K * K,),
+              (1, K, K, K), (K * K,), (K * K,)]
+    with tf.Graph().as_default():
+      inputs = [tf.constant(np.random.random(shape) - 0.5, dtype=tf.float32) for shape in shapes]
+      with self.test_session():
+        fts_X = x_transform(*inputs)
+        error = tf.test.compute_gradient_error(inputs, list(shapes), fts_X, fts_X.get_shape().as_list())
+      self.assertLess(error, 1e-2)
+
+if __name__=='__main__':
+  tf.test.main()
@@ -140,6 +140,20 @@ def base_model_config(dataset='KITTI'):
     # Whether to do data augmentation
     cfg.DATA_AUGMENTATION = False
 
+    # Whether to flip, shift and jitter the dequeued batches in the graph
+    # (nn_skeleton) instead of in the readers, the loss weights are then looked
+    # up in the graph as well, with the normalized packed range images
+    # (data_conversion/pack_lidar_2d.py --config) reading is an index gather
+    cfg.AUGMENT_IN_GRAPH = False
+
+    # The largest random shift in pixels of the range image along its azimuth
+    # axis, the image rolls around, in-graph augmentation only
+    cfg.AZIMUTH_SHIFT = 0
+
+    # Standard deviation of the gaussian noise added to the intensity of the
+    # valid pixels, in-graph augmentation only
+    cfg.INTENSITY_JITTER = 0.0
+
     # The range to randomly shift the image widht
     cfg.DRIFT_X = 0
 
@@ -153,9 +167,22 @@ def base_model_config(dataset='KITTI'):
     # small value used in denominator to prevent division by 0
     cfg.DENOM_EPSILON = 1e-12
 
+    # Whether the recurrent CRF gathers the neighbors with shifted slices and
+    # shares the bilateral weights of the classes with the same theta, instead
+    # of the dense condensing and angular convolutions. Both give the same
+    # outputs (crf_test.py), the dense one is kept as their reference
+    cfg.EFFICIENT_CRF = True
+
     # capacity for tf.FIFOQueue
     cfg.QUEUE_CAPACITY = 80
 
     cfg.NUM_ENQUEUE_THREAD = 8
 
+    # processes reading batches into shared memory buffers (imdb/batch_reader.py)
+    # for a single enqueue thread, 0 to read in the NUM_ENQUEUE_THREAD threads
+    cfg.NUM_READER_PROCESS = 6
+
+    # shared memory batch buffers of the reader processes
+    cfg.NUM_READER_BUFFER = 12
+
     return cfg
@@ -34,6 +34,9 @@ def df_squeezeSeg_config():
 
     mc.DATA_AUGMENTATION = True
     mc.RANDOM_FLIPPING = True
+    mc.AUGMENT_IN_GRAPH = True
+    mc.AZIMUTH_SHIFT = 0
+    mc.INTENSITY_JITTER = 0.0
 
     # x, y, z, intensity, distance
     mc.INPUT_MEAN = np.array([[[10.88, 0.23, -1.04, 0.21, 12.12]]])
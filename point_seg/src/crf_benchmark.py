@@ -0,0 +1,99 @@
+"""Compare the dense and the efficient (mc.EFFICIENT_CRF) recurrent CRF"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os.path
+import time
+
+import numpy as np
+from six.moves import xrange
+import tensorflow as tf
+
+from config import *
+from nn_skeleton import ModelSkeleton
+from utils.util import range_image_batch
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string(
+    'input_path', '',
+    """Range images (*.npy) to run the CRF on, random inputs by default.""")
+tf.app.flags.DEFINE_integer('batch_size', 8, """Range images per batch.""")
+tf.app.flags.DEFINE_integer('max_iter', 3,
+                            """Compare RCRF_ITER from 1 to this.""")
+tf.app.flags.DEFINE_integer('runs', 20, """Timed runs per CRF.""")
+tf.app.flags.DEFINE_string('device', '/gpu:0', """Device of the graph.""")
+tf.app.flags.DEFINE_string('gpu', '0', """gpu id.""")
+
+
+def build_crf(model, logits, efficient, num_iterations):
+  """The bilateral filter and recurrent CRF of SqueezeSeg on logits."""
+  mc = model.mc
+  mc.EFFICIENT_CRF = efficient
+  scope = '{}_crf_iter_{}'.format(
+      'efficient' if efficient else 'dense', num_iterations)
+  with tf.variable_scope(scope):
+    bilateral_filter_weights = model._bilateral_filter_layer(
+        'bilateral_filter', model.lidar_input[:, :, :, :3], # x, y, z
+        thetas=[mc.BILATERAL_THETA_A, mc.BILATERAL_THETA_R],
+        sizes=[mc.LCN_HEIGHT, mc.LCN_WIDTH], stride=1)
+
+    return model._recurrent_crf_layer(
+        'recurrent_crf', logits, bilateral_filter_weights,
+        sizes=[mc.LCN_HEIGHT, mc.LCN_WIDTH], num_iterations=num_iterations,
+        padding='SAME'
+    )
+
+
+def main(argv=None):  # pylint: disable=unused-argument
+  os.environ['CUDA_VISIBLE_DEVICES'] = FLAGS.gpu
+
+  mc = kitti_squeezeSeg_config()
+  mc.LOAD_PRETRAINED_MODEL = False
+  lidar, lidar_mask = range_image_batch(
+      mc, FLAGS.batch_size, FLAGS.input_path, empty_fraction=0.1)
+  logits_value = np.random.randn(
+      FLAGS.batch_size, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, mc.NUM_CLASS
+  ).astype(np.float32)
+
+  with tf.Graph().as_default(), tf.device(FLAGS.device):
+    model = ModelSkeleton(mc, serving=True)
+    logits = tf.placeholder(
+        tf.float32, [None, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, mc.NUM_CLASS],
+        name='logits')
+    crfs = [(num_iterations,
+             build_crf(model, logits, False, num_iterations),
+             build_crf(model, logits, True, num_iterations))
+            for num_iterations in range(1, FLAGS.max_iter+1)]
+
+    feed_dict = {model.lidar_input: lidar, model.lidar_mask: lidar_mask,
+                 logits: logits_value}
+
+    def time_op(sess, op):
+      out = sess.run(op, feed_dict=feed_dict) # warm up
+      start_time = time.time()
+      for _ in xrange(FLAGS.runs):
+        sess.run(op, feed_dict=feed_dict)
+      return out, (time.time() - start_time)/FLAGS.runs
+
+    config = tf.ConfigProto(allow_soft_placement=True)
+    with tf.Session(config=config) as sess:
+      sess.run(tf.global_variables_initializer())
+      print('batch size {:d}, {:d}x{:d} range images, {:d}x{:d} neighbors'
+            .format(FLAGS.batch_size, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL,
+                    mc.LCN_HEIGHT, mc.LCN_WIDTH))
+      print('{:>10} {:>12} {:>15} {:>8} {:>14}'.format(
+          'RCRF_ITER', 'dense ms', 'efficient ms', 'speedup', 'max abs diff'))
+      for num_iterations, dense, efficient in crfs:
+        dense_out, dense_time = time_op(sess, dense)
+        efficient_out, efficient_time = time_op(sess, efficient)
+        print('{:>10d} {:>12.2f} {:>15.2f} {:>7.2f}x {:>14.2e}'.format(
+            num_iterations, dense_time*1000, efficient_time*1000,
+            dense_time/efficient_time,
+            np.max(np.abs(dense_out - efficient_out))))
+
+
+if __name__ == '__main__':
+  tf.app.run()
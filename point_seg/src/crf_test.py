@@ -0,0 +1,47 @@
+"""The efficient (mc.EFFICIENT_CRF) recurrent CRF against the dense one"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from config import *
+from crf_benchmark import build_crf
+from nn_skeleton import ModelSkeleton
+
+
+class RecurrentCRFTest(tf.test.TestCase):
+  def test_efficient_matches_dense(self):
+    mc = kitti_squeezeSeg_config()
+    mc.ZENITH_LEVEL = 16
+    mc.AZIMUTH_LEVEL = 64
+
+    rng = np.random.RandomState(0)
+    shape = [2, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL]
+    # points close enough to their neighbors for BILATERAL_THETA_R to weigh
+    # them, and a tenth of the pixels without a return
+    lidar = (rng.rand(*(shape + [5]))*0.02).astype(np.float32)
+    lidar_mask = (rng.rand(*(shape + [1])) > 0.1).astype(np.float32)
+    logits_value = rng.randn(*(shape + [mc.NUM_CLASS])).astype(np.float32)
+
+    with tf.Graph().as_default():
+      model = ModelSkeleton(mc, serving=True)
+      logits = tf.constant(logits_value)
+      crfs = [(build_crf(model, logits, False, num_iterations),
+               build_crf(model, logits, True, num_iterations))
+              for num_iterations in range(1, 4)]
+
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        outs = sess.run(crfs, feed_dict={model.lidar_input: lidar,
+                                         model.lidar_mask: lidar_mask})
+
+    for num_iterations, (dense_out, efficient_out) in enumerate(outs, 1):
+      self.assertAllClose(efficient_out, dense_out, rtol=1e-5, atol=1e-5,
+                          msg='RCRF_ITER {}'.format(num_iterations))
+
+
+if __name__ == '__main__':
+  tf.test.main()
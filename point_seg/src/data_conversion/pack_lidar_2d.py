@@ -0,0 +1,91 @@
+"""Pack the lidar_2d/gta range images of an ImageSet into one array for imdb.kitti_packed.
+
+Writes <data_path>/packed/<image_set>.npy, a float32 (N, ZENITH_LEVEL, AZIMUTH_LEVEL, 6) array opened with
+mmap_mode='r' at training, and <data_path>/packed/<image_set>.txt, the image ids of its rows.
+With --config also <image_set>_normalized.npy, the (N, ZENITH_LEVEL, AZIMUTH_LEVEL, 7) x, y, z, intensity, range
+normalized with the INPUT_MEAN and INPUT_STD of the config, mask and label, and <image_set>_normalized_stats.npy,
+the (2, 5) mean and std, so that reading with in-graph augmentation is an index gather.
+
+python pack_lidar_2d.py --data_path ./data --image_set train --config df_squeezeSeg_config
+"""
+
+from __future__ import print_function
+
+import argparse
+import importlib
+import os
+import sys
+
+import numpy as np
+
+
+def lidar_2d_path(data_path, idx):
+    # as imdb.kitti._lidar_2d_path_at
+    if idx[:4] == 'gta_':
+        return os.path.join(data_path, 'gta', idx + '.npy')
+    return os.path.join(data_path, 'lidar_2d', idx + '.npy')
+
+
+def pack(data_path, image_set, mc=None):
+    with open(os.path.join(data_path, 'ImageSet', image_set + '.txt')) as f:
+        image_idx = [x.strip() for x in f.readlines() if x.strip()]
+    paths = [lidar_2d_path(data_path, idx) for idx in image_idx]
+    missing = [path for path in paths if not os.path.exists(path)]
+    assert not missing, 'Files do not exist: {}'.format(', '.join(missing[:10]))
+
+    shape = np.load(paths[0], mmap_mode='r').shape
+    dir_packed = os.path.join(data_path, 'packed')
+    if not os.path.exists(dir_packed):
+        os.makedirs(dir_packed)
+    path_packed = os.path.join(dir_packed, image_set + '.npy')
+    records = np.lib.format.open_memmap(path_packed, mode='w+', dtype=np.float32, shape=(len(paths),) + shape)
+    if mc is not None:
+        mean = np.reshape(mc.INPUT_MEAN, [-1])
+        std = np.reshape(mc.INPUT_STD, [-1])
+        np.save(os.path.join(dir_packed, image_set + '_normalized_stats.npy'), np.stack([mean, std]))
+        records_normalized = np.lib.format.open_memmap(os.path.join(dir_packed, image_set + '_normalized.npy'),
+                                                       mode='w+', dtype=np.float32,
+                                                       shape=(len(paths),) + shape[:2] + (7,))
+    for i, path in enumerate(paths):
+        record = np.load(path)
+        assert record.shape == shape, 'Shape {} of {} differs from {}'.format(record.shape, path, shape)
+        records[i] = record
+        if mc is not None:
+            # as imdb.read_batch_at
+            records_normalized[i, :, :, :5] = (record[:, :, :5] - mean) / std
+            records_normalized[i, :, :, 5] = record[:, :, 4] > 0
+            records_normalized[i, :, :, 6] = record[:, :, 5]
+        if (i + 1) % 1000 == 0:
+            print('{:d}/{:d} packed'.format(i + 1, len(paths)))
+    records.flush()
+    del records
+    if mc is not None:
+        records_normalized.flush()
+        del records_normalized
+
+    with open(os.path.join(dir_packed, image_set + '.txt'), 'w') as f:
+        f.write('\n'.join(image_idx) + '\n')
+    print('{:d} range images of {} packed into {}.'.format(len(paths), image_set, path_packed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', '-d', help='Root directory of data, with ImageSet, lidar_2d and gta',
+                        required=True)
+    parser.add_argument('--image_set', '-s', help='ImageSets to pack, comma separated', default='train,val')
+    parser.add_argument('--config', '-c', help='Config to also pack normalized records with, '
+                                               'e.g. df_squeezeSeg_config')
+    args = parser.parse_args()
+    print(args)
+
+    mc = None
+    if args.config:
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        mc = getattr(importlib.import_module('config.' + args.config), args.config)()
+
+    for image_set in args.image_set.split(','):
+        pack(args.data_path, image_set.strip(), mc)
+
+
+if __name__ == '__main__':
+    main()
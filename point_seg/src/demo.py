@@ -16,6 +16,8 @@ from PIL import Image
 from config import *
 from imdb import kitti
 from utils.util import *
+from utils.postprocess import split_by_class, cluster_summaries
+from utils.ros_publish import cloud_msg, cluster_marker
 from nets import *
 
 import os
@@ -43,6 +45,8 @@ tf.app.flags.DEFINE_string(
 tf.app.flags.DEFINE_string(
         'out_dir', path[:-4]+'/data/samples_out/', """Directory to dump output.""")
 tf.app.flags.DEFINE_string('gpu', '0', """gpu id.""")
+tf.app.flags.DEFINE_string(
+    'device', '', """Device of the graph, e.g. /cpu:0, the gpu by default.""")
 
 def _normalize(x):
   return (x - x.min())/(x.max() - x.min())
@@ -53,7 +57,7 @@ def publish_pc(pc,car,person,cyc,mask,depth):
     header = std_msgs.msg.Header()
     header.stamp = rospy.Time.now()
     header.frame_id = 'velody'
-    points = pc2.create_cloud_xyz32(header,pc)
+    points = cloud_msg(header,pc)
     '''
     pub2 = rospy.Publisher('/point_seg',PointCloud2,queue_size=10000)
     header = std_msgs.msg.Header()
@@ -76,9 +80,13 @@ def publish_pc(pc,car,person,cyc,mask,depth):
     mask =  bridge.cv2_to_imgmsg(mask, encoding="passthrough")
     depth =bridge.cv2_to_imgmsg(depth, encoding="passthrough")
     r = rospy.Rate(10) 
-    marker_car =print_car(pub_car,car)    
-    marker_per =print_person(pub_per,person)    
-    marker_cyc =print_cyc(pub_cyc,cyc)    
+    # one box per cluster, the markers do not grow with the points of a class
+    marker_car = cluster_marker(
+        'velody', cluster_summaries(car), (0.0, 0.0, 1.0), 0)
+    marker_per = cluster_marker(
+        'velody', cluster_summaries(person), (0.0, 1.0, 0.0), 1)
+    marker_cyc = cluster_marker(
+        'velody', cluster_summaries(cyc), (1.0, 0.0, 0.0), 2)
     while not rospy.is_shutdown():
 
         pub.publish(points)
@@ -87,71 +95,6 @@ def publish_pc(pc,car,person,cyc,mask,depth):
         pub_cyc.publish(marker_cyc)
         pub_mask.publish(mask)
         pub_depth.publish(depth)
-def print_car(pub,points):
-    triplePoints=[]
-    for (x,y,z) in points:
-        p = Point()
-        p.x = x
-        p.y = y
-        p.z = z
-        triplePoints.append(p)
-    marker = Marker()
-    marker.header.frame_id = 'velody'
-    marker.type = marker.POINTS
-    marker.action = marker.ADD
-    marker.pose.orientation.w = 1
-    marker.points = triplePoints
-
-    marker.scale.x = 0.1
-    marker.scale.y = 0.1
-    marker.scale.z = 0.1
-    marker.color.a = 1.0
-    marker.color.b = 1.0
-    return marker
-
-def print_person(pub,points):
-    triplePoints=[]
-    for (x,y,z) in points:
-        p = Point()
-        p.x = x
-        p.y = y
-        p.z = z
-        triplePoints.append(p)
-    marker = Marker()
-    marker.header.frame_id = 'velody'
-    marker.type = marker.POINTS
-    marker.action = marker.ADD
-    marker.pose.orientation.w = 1
-    marker.points = triplePoints
-
-    marker.scale.x = 0.1
-    marker.scale.y = 0.1
-    marker.scale.z = 0.1
-    marker.color.a = 1.0
-    marker.color.g = 1.0
-    return marker
-
-def print_cyc(pub,points):
-    triplePoints=[]
-    for (x,y,z) in points:
-        p = Point()
-        p.x = x
-        p.y = y
-        p.z = z
-        triplePoints.append(p)
-    marker = Marker()
-    marker.header.frame_id = 'velody'
-    marker.type = marker.POINTS
-    marker.action = marker.ADD
-    marker.pose.orientation.w = 1
-    marker.points = triplePoints
-
-    marker.scale.x = 0.1
-    marker.scale.y = 0.1
-    marker.scale.z = 0.1
-    marker.color.a = 1.0
-    marker.color.r = 1.0
-    return marker
 def detect():
   """Detect LiDAR data."""
 
@@ -160,8 +103,7 @@ def detect():
   with tf.Graph().as_default():
     mc = kitti_squeezeSeg_config()
     mc.LOAD_PRETRAINED_MODEL = False
-    mc.BATCH_SIZE = 1 # TODO(bichen): fix this hard-coded batch size.
-    model = SqueezeSeg(mc)
+    model = SqueezeSeg(mc, device=FLAGS.device or None, serving=True)
     config = tf.ConfigProto(allow_soft_placement=True)
     config.gpu_options.per_process_gpu_memory_fraction = 0.2
     saver = tf.train.Saver(model.model_params)
@@ -192,30 +134,10 @@ def detect():
         lidar_raw = lidar_xyz.reshape(-1,3)
         print (lidar_raw.shape)
                 
-        Mask = pred_cls[0].reshape(-1,1)
-        print(Mask[:,0].shape)
-        id_0 = np.argwhere(Mask[:,0]==1)
-        id_1 = np.argwhere(Mask[:,0]==2)
-        id_2 = np.argwhere(Mask[:,0]==3)
         file_name = f.strip('.npy').split('/')[-1]
 
-        car= []
-        for index in id_0:
-              car.append(lidar_raw[index,:])
-        car = np.array(car,dtype=np.float32)
-        car = car.reshape(-1,3)
-            
-        pedestrian=[]
-        for index in id_1:
-              pedestrian.append(lidar_raw[index,:])
-        pedestrian = np.array(pedestrian,dtype=np.float32)
-        pedestrian = pedestrian.reshape(-1,3)
-            
-        cyc=[]
-        for index in id_2:
-              cyc.append(lidar_raw[index,:])
-        cyc = np.array(cyc,dtype=np.float32)
-        cyc = cyc.reshape(-1,3)
+        objects = split_by_class(lidar_raw, pred_cls[0], [1, 2, 3])
+        car, pedestrian, cyc = objects[1], objects[2], objects[3]
         p_cy = pcl.PointCloud(cyc)
         time1 = time.time()
         fil1 = p_cy.make_statistical_outlier_filter()
@@ -9,14 +9,15 @@ from __future__ import print_function
 from datetime import datetime
 import os.path
 import sys
+import threading
 import time
 
 import numpy as np
-from six.moves import xrange
+from six.moves import queue, xrange
 import tensorflow as tf
 
 from config import *
-from imdb import kitti
+from imdb import kitti, kitti_packed
 from utils.util import *
 from nets import *
 
@@ -38,6 +39,56 @@ tf.app.flags.DEFINE_boolean('run_once', False,
 tf.app.flags.DEFINE_string('net', 'squeezeSeg',
                            """Neural net architecture.""")
 tf.app.flags.DEFINE_string('gpu', '0', """gpu id.""")
+tf.app.flags.DEFINE_boolean('packed', False,
+                            """Read the packed range images of """
+                            """data_conversion/pack_lidar_2d.py.""")
+tf.app.flags.DEFINE_integer('batch_size', 32,
+                            """Range images per batch, the last batch is """
+                            """padded.""")
+tf.app.flags.DEFINE_integer('prefetch', 2,
+                            """Batches read ahead of the detection.""")
+
+
+def _eval_batches(imdb, batch_size):
+  """Image indices of the eval batches, in order.
+  Args:
+    imdb: the image database
+    batch_size: images per batch
+  Returns:
+    list of (batch_idx, num_valid), the last batch is padded to batch_size by
+    repeating its last image, only its num_valid first images count.
+  """
+  image_idx = imdb.image_idx
+  batches = []
+  for start in xrange(0, len(image_idx), batch_size):
+    batch_idx = image_idx[start:start+batch_size]
+    num_valid = len(batch_idx)
+    batch_idx = batch_idx + batch_idx[-1:]*(batch_size - num_valid)
+    batches.append((batch_idx, num_valid))
+  return batches
+
+
+def _prefetch_batches(imdb, batches, num_prefetch):
+  """Read the batches in a thread, num_prefetch batches ahead of the consumer.
+  Yields:
+    (num_valid, (lidar, lidar_mask, label, weight), read_time, wait_time)
+  """
+  batch_queue = queue.Queue(maxsize=max(num_prefetch, 1))
+
+  def read():
+    for batch_idx, num_valid in batches:
+      start_time = time.time()
+      batch = imdb.read_batch_at(batch_idx)
+      batch_queue.put((num_valid, batch, time.time() - start_time))
+
+  thread = threading.Thread(target=read)
+  thread.daemon = True
+  thread.start()
+  for _ in xrange(len(batches)):
+    start_time = time.time()
+    num_valid, batch, read_time = batch_queue.get()
+    yield num_valid, batch, read_time, time.time() - start_time
+  thread.join()
 
 
 def eval_once(
@@ -55,86 +106,68 @@ def eval_once(
     global_step = ckpt_path.split('/')[-1].split('-')[-1]
 
     mc = model.mc
-    mc.DATA_AUGMENTATION = False
 
     num_images = len(imdb.image_idx)
+    batches = _eval_batches(imdb, mc.BATCH_SIZE)
 
-    _t = {
-        'detect': Timer(),
-        'read': Timer(),
-        'eval': Timer()
-    }
+    # seconds spent per stage, read is the time of the prefetching thread and
+    # wait the time detection waited for it
+    stage_time = {'read': 0.0, 'wait': 0.0, 'detect': 0.0, 'eval': 0.0}
+    start_time = time.time()
+
+    # class-level metrics, rows are labels and columns predictions
+    confusion = np.zeros((mc.NUM_CLASS, mc.NUM_CLASS), dtype=np.int64)
+
+    num_done = 0
+    for num_valid, batch, read_time, wait_time in _prefetch_batches(
+        imdb, batches, FLAGS.prefetch):
+      lidar_per_batch, lidar_mask_per_batch, label_per_batch, _ = batch
+      stage_time['read'] += read_time
+      stage_time['wait'] += wait_time
 
-    tot_error_rate, tot_rmse, tot_th_correct = 0.0, 0.0, 0.0
-
-    # class-level metrics
-    tp_sum = np.zeros(mc.NUM_CLASS)
-    fn_sum = np.zeros(mc.NUM_CLASS)
-    fp_sum = np.zeros(mc.NUM_CLASS)
-    # instance-level metrics
-    itp_sum = np.zeros(mc.NUM_CLASS)
-    ifn_sum = np.zeros(mc.NUM_CLASS)
-    ifp_sum = np.zeros(mc.NUM_CLASS)
-    # instance-level object matching metrics
-    otp_sum = np.zeros(mc.NUM_CLASS)
-    ofn_sum = np.zeros(mc.NUM_CLASS)
-    ofp_sum = np.zeros(mc.NUM_CLASS)
-
-    for i in xrange(int(num_images/mc.BATCH_SIZE)):
-      offset = max((i+1)*mc.BATCH_SIZE - num_images, 0)
-      
-      _t['read'].tic()
-      lidar_per_batch, lidar_mask_per_batch, label_per_batch, _ \
-          = imdb.read_batch(shuffle=False)
-      _t['read'].toc()
-
-      _t['detect'].tic()
+      detect_start = time.time()
       pred_cls = sess.run(
-          model.pred_cls, 
+          model.pred_cls,
           feed_dict={
               model.lidar_input:lidar_per_batch,
-              model.keep_prob: 1.0,
               model.lidar_mask:lidar_mask_per_batch
           }
       )
-      _t['detect'].toc()
-
-      _t['eval'].tic()
-      # Evaluation
-      iou, tps, fps, fns = evaluate_iou(
-          label_per_batch[:mc.BATCH_SIZE-offset],
-          pred_cls[:mc.BATCH_SIZE-offset] \
-          * np.squeeze(lidar_mask_per_batch[:mc.BATCH_SIZE-offset]),
-          mc.NUM_CLASS
-      )
-
-      tp_sum += tps
-      fn_sum += fns
-      fp_sum += fps
+      stage_time['detect'] += time.time() - detect_start
 
-      _t['eval'].toc()
+      eval_start = time.time()
+      # Evaluation, the padded images of the last batch are left out
+      confusion += confusion_matrix(
+          label_per_batch[:num_valid], pred_cls[:num_valid], mc.NUM_CLASS,
+          mask=lidar_mask_per_batch[:num_valid])
+      stage_time['eval'] += time.time() - eval_start
 
+      num_done += num_valid
       print ('detect: {:d}/{:d} im_read: {:.3f}s '
           'detect: {:.3f}s evaluation: {:.3f}s'.format(
-                (i+1)*mc.BATCH_SIZE-offset, num_images,
-                _t['read'].average_time/mc.BATCH_SIZE,
-                _t['detect'].average_time/mc.BATCH_SIZE,
-                _t['eval'].average_time/mc.BATCH_SIZE))
+                num_done, num_images,
+                stage_time['read']/num_done,
+                stage_time['detect']/num_done,
+                stage_time['eval']/num_done))
 
-    ious = tp_sum.astype(np.float)/(tp_sum + fn_sum + fp_sum + mc.DENOM_EPSILON)
-    pr = tp_sum.astype(np.float)/(tp_sum + fp_sum + mc.DENOM_EPSILON)
-    re = tp_sum.astype(np.float)/(tp_sum + fn_sum + mc.DENOM_EPSILON)
+    total_time = time.time() - start_time
+    ious, _, _, _, pr, re = confusion_metrics(confusion, mc.DENOM_EPSILON)
 
     print ('Evaluation summary:')
     print ('  Timing:')
     print ('    read: {:.3f}s detect: {:.3f}s'.format(
-        _t['read'].average_time/mc.BATCH_SIZE,
-        _t['detect'].average_time/mc.BATCH_SIZE
-    ))
+        stage_time['read']/num_images, stage_time['detect']/num_images))
+    print ('  Throughput (images/sec, batch size {:d}):'.format(mc.BATCH_SIZE))
+    for stage in ['read', 'detect', 'eval']:
+      print ('    {}: {:.1f}'.format(
+          stage, num_images/max(stage_time[stage], 1e-6)))
+    print ('    overall: {:.1f}, waited for reading {:.1f}% of the time'.format(
+        num_images/max(total_time, 1e-6),
+        100.0*stage_time['wait']/max(total_time, 1e-6)))
 
     eval_sum_feed_dict = {
-        eval_summary_phs['Timing/detect']:_t['detect'].average_time/mc.BATCH_SIZE,
-        eval_summary_phs['Timing/read']:_t['read'].average_time/mc.BATCH_SIZE,
+        eval_summary_phs['Timing/detect']:stage_time['detect']/num_images,
+        eval_summary_phs['Timing/read']:stage_time['read']/num_images,
     }
 
     print ('  Accuracy:')
@@ -169,10 +202,14 @@ def evaluate():
     if FLAGS.net == 'squeezeSeg':
       mc = kitti_squeezeSeg_config()
       mc.LOAD_PRETRAINED_MODEL = False
-      mc.BATCH_SIZE = 1 # TODO(bichen): fix this hard-coded batch size.
-      model = SqueezeSeg(mc)
-
-    imdb = kitti(FLAGS.image_set, FLAGS.data_path, mc)
+      mc.BATCH_SIZE = FLAGS.batch_size
+      mc.DATA_AUGMENTATION = False
+      model = SqueezeSeg(mc, serving=True)
+
+    if FLAGS.packed:
+      imdb = kitti_packed(FLAGS.image_set, FLAGS.data_path, mc)
+    else:
+      imdb = kitti(FLAGS.image_set, FLAGS.data_path, mc)
 
     eval_summary_ops = []
     eval_summary_phs = {}
@@ -1 +1,3 @@
 from kitti import kitti
+from kitti_packed import kitti_packed
+from batch_reader import BatchReader
@@ -0,0 +1,160 @@
+"""Multiprocess batch reader filling shared memory batch buffers"""
+
+import ctypes
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+
+def _batch_arrays(raw_buffer, shapes, dtypes):
+  return [np.ctypeslib.as_array(raw).view(dtype).reshape(shape)
+          for raw, shape, dtype in zip(raw_buffer, shapes, dtypes)]
+
+
+def _read_worker(imdb, raw_buffers, shapes, dtypes, task_queue, done_queue):
+  buffers = [_batch_arrays(raw_buffer, shapes, dtypes)
+             for raw_buffer in raw_buffers]
+  # forked workers would otherwise flip the same records
+  np.random.seed()
+  while True:
+    task = task_queue.get()
+    if task is None:
+      break
+    buffer_idx, batch_idx = task
+    start_time = time.time()
+    imdb.read_batch_at(batch_idx, out=buffers[buffer_idx])
+    done_queue.put((buffer_idx, time.time() - start_time))
+
+
+class BatchReader(object):
+  """Reads the batches of an imdb in worker processes.
+
+  The np.load, flipping, normalization and loss weights of read_batch run in
+  num_process processes, which write into num_buffer shared memory batch
+  buffers, so the enqueue thread only copies them out and feeds them to the
+  queue. The copy is needed: the session may feed an aligned array without
+  copying it and the queue keeps that tensor, so a worker refilling the buffer
+  would change a queued batch. The parent keeps the batch order: it hands
+  (buffer, batch indices) to the workers from imdb.next_batch_idx. With
+  num_process 0 the batches are read in the calling threads instead, as the
+  enqueue threads used to.
+
+  Usage:
+    batch = reader.get()
+    sess.run(enqueue_op, feed_dict=...batch...)
+  """
+
+  def __init__(self, imdb, num_process, num_buffer, shuffle=True,
+               num_thread=1):
+    mc = imdb.mc
+    self._imdb = imdb
+    self._shuffle = shuffle
+    self._lock = threading.Lock()
+    # readers working at the same time, for the reading capacity
+    self._parallelism = num_process if num_process > 0 else num_thread
+    self._read_images = 0
+    self._read_time = 0.0
+    self._wait_time = 0.0
+    self._stats_start_time = time.time()
+
+    self._processes = []
+    if num_process == 0:
+      return
+
+    shape = [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL]
+    shapes = [shape + [5], shape + [1], shape, shape]
+    dtypes = [np.float32, np.float32, np.int32, np.float32]
+    ctypes_of = {np.float32: ctypes.c_float, np.int32: ctypes.c_int32}
+    raw_buffers = [[multiprocessing.RawArray(ctypes_of[dtype], int(np.prod(s)))
+                    for s, dtype in zip(shapes, dtypes)]
+                   for _ in range(num_buffer)]
+    self._buffers = [_batch_arrays(raw_buffer, shapes, dtypes)
+                     for raw_buffer in raw_buffers]
+    self._task_queue = multiprocessing.Queue()
+    self._done_queue = multiprocessing.Queue()
+    for _ in range(num_process):
+      process = multiprocessing.Process(
+          target=_read_worker,
+          args=(imdb, raw_buffers, shapes, dtypes, self._task_queue,
+                self._done_queue))
+      process.daemon = True
+      process.start()
+      self._processes.append(process)
+    for buffer_idx in range(num_buffer):
+      self._release(buffer_idx)
+
+  def get(self, timeout=None):
+    """Take the next batch.
+    Args:
+      timeout: seconds to wait for a worker, None to wait forever.
+    Returns:
+      (lidar, lidar_mask, label, weight) as imdb.read_batch returns, arrays
+      owned by the caller, None on timeout.
+    """
+    if not self._processes:
+      with self._lock:
+        batch_idx = self._imdb.next_batch_idx(self._shuffle)
+      start_time = time.time()
+      batch = self._imdb.read_batch_at(batch_idx)
+      self._add_stats(len(batch_idx), time.time() - start_time, 0.0)
+      return batch
+
+    start_time = time.time()
+    try:
+      buffer_idx, read_time = self._done_queue.get(timeout=timeout)
+    except queue.Empty:
+      return None
+    self._add_stats(self._imdb.mc.BATCH_SIZE, read_time,
+                    time.time() - start_time)
+    batch = [np.array(array, copy=True) for array in self._buffers[buffer_idx]]
+    self._release(buffer_idx)
+    return batch
+
+  def _release(self, buffer_idx):
+    """Hand a buffer back to the workers for the next batch."""
+    with self._lock:
+      batch_idx = self._imdb.next_batch_idx(self._shuffle)
+    self._task_queue.put((buffer_idx, batch_idx))
+
+  def _add_stats(self, images, read_time, wait_time):
+    with self._lock:
+      self._read_images += images
+      self._read_time += read_time
+      self._wait_time += wait_time
+
+  def stats(self, reset=True):
+    """Reading statistics since the last reset.
+    Returns:
+      read_images_per_sec: images per second the readers can deliver, when
+        lower than the images per second of the training steps they are
+        read-bound.
+      wait_fraction: share of the time the consumers waited for a worker.
+    """
+    with self._lock:
+      now = time.time()
+      read_images_per_sec = self._read_images * self._parallelism \
+          / max(self._read_time, 1e-6)
+      wait_fraction = self._wait_time / max(now - self._stats_start_time, 1e-6)
+      if reset:
+        self._read_images = 0
+        self._read_time = 0.0
+        self._wait_time = 0.0
+        self._stats_start_time = now
+    return read_images_per_sec, wait_fraction
+
+  def close(self):
+    """Stop the workers."""
+    for _ in self._processes:
+      self._task_queue.put(None)
+    for process in self._processes:
+      process.join(5)
+      if process.is_alive():
+        process.terminate()
+    self._processes = []
@@ -45,18 +45,12 @@ class imdb(object):
         np.random.permutation(np.arange(len(self._image_idx)))]
     self._cur_idx = 0
 
-  def read_batch(self, shuffle=True):
-    """Read a batch of lidar data including labels. Data formated as numpy array
-    of shape: height x width x {x, y, z, intensity, range, label}.
+  def next_batch_idx(self, shuffle=True):
+    """Advance the batch reader by one batch.
     Args:
       shuffle: whether or not to shuffle the dataset
     Returns:
-      lidar_per_batch: LiDAR input. Shape: batch x height x width x 5.
-      lidar_mask_per_batch: LiDAR mask, 0 for missing data and 1 otherwise.
-        Shape: batch x height x width x 1.
-      label_per_batch: point-wise labels. Shape: batch x height x width.
-      weight_per_batch: loss weights for different classes. Shape: 
-        batch x height x width
+      batch_idx: image indices of the next batch.
     """
     mc = self.mc
 
@@ -74,17 +68,47 @@ class imdb(object):
         batch_idx = self._image_idx[self._cur_idx:self._cur_idx+mc.BATCH_SIZE]
         self._cur_idx += mc.BATCH_SIZE
 
+    return batch_idx
+
+  def read_batch(self, shuffle=True):
+    """Read a batch of lidar data including labels. Data formated as numpy array
+    of shape: height x width x {x, y, z, intensity, range, label}.
+    Args:
+      shuffle: whether or not to shuffle the dataset
+    Returns:
+      lidar_per_batch: LiDAR input. Shape: batch x height x width x 5.
+      lidar_mask_per_batch: LiDAR mask, 0 for missing data and 1 otherwise.
+        Shape: batch x height x width x 1.
+      label_per_batch: point-wise labels. Shape: batch x height x width.
+      weight_per_batch: loss weights for different classes. Shape: 
+        batch x height x width
+    """
+    return self.read_batch_at(self.next_batch_idx(shuffle))
+
+  def read_batch_at(self, batch_idx, out=None):
+    """Read the batch of the given image indices, as read_batch does.
+    Args:
+      batch_idx: image indices of the batch.
+      out: optional (lidar, lidar_mask, label, weight) arrays of the batch
+        shapes to fill in place, e.g. the shared memory buffers of BatchReader.
+    Returns:
+      (lidar_per_batch, lidar_mask_per_batch, label_per_batch,
+      weight_per_batch), the out arrays if given.
+    """
+    mc = self.mc
+
     lidar_per_batch = []
     lidar_mask_per_batch = []
     label_per_batch = []
     weight_per_batch = []
 
-    for idx in batch_idx:
+    for i, idx in enumerate(batch_idx):
       # load data
       # loading from npy is 30x faster than loading from pickle
       record = np.load(self._lidar_2d_path_at(idx)).astype(np.float32, copy=False)
 
-      if mc.DATA_AUGMENTATION:
+      # flipped in the graph with mc.AUGMENT_IN_GRAPH
+      if mc.DATA_AUGMENTATION and not mc.AUGMENT_IN_GRAPH:
         if mc.RANDOM_FLIPPING:
           if np.random.rand() > 0.5:
             # flip y
@@ -100,9 +124,12 @@ class imdb(object):
       lidar = (lidar - mc.INPUT_MEAN)/mc.INPUT_STD
 
       label = record[:, :, 5]
-      weight = np.zeros(label.shape)
-      for l in range(mc.NUM_CLASS):
-        weight[label==l] = mc.CLS_LOSS_WEIGHT[int(l)]
+      weight = self._loss_weight(label)
+
+      if out is not None:
+        out[0][i], out[1][i], out[2][i], out[3][i] = \
+            lidar, lidar_mask, label, weight
+        continue
 
       # Append all the data
       lidar_per_batch.append(lidar)
@@ -110,8 +137,18 @@ class imdb(object):
       label_per_batch.append(label)
       weight_per_batch.append(weight)
 
+    if out is not None:
+      return out
     return np.array(lidar_per_batch), np.array(lidar_mask_per_batch), \
         np.array(label_per_batch), np.array(weight_per_batch)
 
+  def _loss_weight(self, label):
+    """Loss weights of the classes of label, 0 for labels out of range."""
+    mc = self.mc
+    lut = np.append(mc.CLS_LOSS_WEIGHT, 0.0)
+    label = label.astype(np.int64)
+    return lut[np.where((label >= 0) & (label < mc.NUM_CLASS), label,
+                        mc.NUM_CLASS)]
+
   def evaluate_detections(self):
     raise NotImplementedError
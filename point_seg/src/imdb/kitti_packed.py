@@ -0,0 +1,98 @@
+"""Image data base class for kitti range images packed into one array"""
+
+import os
+import numpy as np
+
+from kitti import kitti
+
+class kitti_packed(kitti):
+  """kitti reading from <data_path>/packed/<image_set>.npy, as written by
+  data_conversion/pack_lidar_2d.py. The array is memory mapped, a batch is one
+  fancy-index into it, flipped, normalized and weighted in place.
+
+  When the range images were also packed normalized (pack_lidar_2d.py --config)
+  with the INPUT_MEAN and INPUT_STD of mc, and nothing is left to augment on the
+  host (mc.AUGMENT_IN_GRAPH), a batch is the fancy-index only."""
+
+  def __init__(self, image_set, data_path, mc):
+    kitti.__init__(self, image_set, data_path, mc)
+    packed_path = os.path.join(data_path, 'packed', image_set + '.npy')
+    index_path = os.path.join(data_path, 'packed', image_set + '.txt')
+    assert os.path.exists(packed_path), \
+        'File does not exist: {}, run data_conversion/pack_lidar_2d.py'.format(
+            packed_path)
+    self._records = np.load(packed_path, mmap_mode='r')
+    assert self._records.shape[1:] == \
+        (mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 6), \
+        'Packed shape {} does not match the config'.format(
+            self._records.shape)
+
+    with open(index_path) as f:
+      packed_idx = [x.strip() for x in f.readlines() if x.strip()]
+    self._row_at = dict(zip(packed_idx, range(len(packed_idx))))
+    missing = [idx for idx in self._image_idx if idx not in self._row_at]
+    assert not missing, \
+        'Images missing from {}: {}'.format(packed_path, missing[:10])
+
+    self._normalized = None
+    normalized_path = os.path.join(
+        data_path, 'packed', image_set + '_normalized.npy')
+    stats_path = os.path.join(
+        data_path, 'packed', image_set + '_normalized_stats.npy')
+    if os.path.exists(normalized_path):
+      stats = np.load(stats_path)
+      if np.allclose(stats[0], np.reshape(mc.INPUT_MEAN, [-1])) \
+          and np.allclose(stats[1], np.reshape(mc.INPUT_STD, [-1])):
+        self._normalized = np.load(normalized_path, mmap_mode='r')
+      else:
+        print ('{} was normalized with other INPUT_MEAN/INPUT_STD, '
+               'normalizing on the host.'.format(normalized_path))
+
+  def read_batch_at(self, batch_idx, out=None):
+    """Read the batch of the given image indices, see imdb.read_batch_at."""
+    mc = self.mc
+
+    rows = [self._row_at[idx] for idx in batch_idx]
+    if self._normalized is not None and (
+        mc.AUGMENT_IN_GRAPH or not mc.DATA_AUGMENTATION
+        or not mc.RANDOM_FLIPPING):
+      # x, y, z, intensity, range normalized, mask, label
+      record = self._normalized[rows]
+      # loss weights are looked up in the graph with mc.AUGMENT_IN_GRAPH
+      weight = None if mc.AUGMENT_IN_GRAPH \
+          else self._loss_weight(record[:, :, :, 6])
+      if out is None:
+        return record[:, :, :, :5], record[:, :, :, 5:6], \
+            record[:, :, :, 6], weight
+      out[0][...] = record[:, :, :, :5]
+      out[1][...] = record[:, :, :, 5:6]
+      out[2][...] = record[:, :, :, 6]
+      if weight is not None:
+        out[3][...] = weight
+      return out
+
+    # the only copy out of the memory map
+    record = self._records[rows]
+
+    # flipped in the graph with mc.AUGMENT_IN_GRAPH
+    if mc.DATA_AUGMENTATION and not mc.AUGMENT_IN_GRAPH:
+      if mc.RANDOM_FLIPPING:
+        flip = np.random.rand(len(batch_idx)) > 0.5
+        # flip y
+        record[flip] = record[flip, :, ::-1, :]
+        record[flip, :, :, 1] *= -1
+
+    if out is None:
+      out = (np.empty(record.shape[:3] + (5,), np.float32),
+             np.empty(record.shape[:3] + (1,), np.float32),
+             np.empty(record.shape[:3], np.int32),
+             np.empty(record.shape[:3], np.float32))
+    lidar, lidar_mask, label, weight = out
+
+    lidar_mask[...] = record[:, :, :, 4:5] > 0
+    # normalize
+    np.subtract(record[:, :, :, :5], mc.INPUT_MEAN, out=lidar, casting='unsafe')
+    np.divide(lidar, mc.INPUT_STD, out=lidar, casting='unsafe')
+    label[...] = record[:, :, :, 5]
+    weight[...] = self._loss_weight(record[:, :, :, 5])
+    return out
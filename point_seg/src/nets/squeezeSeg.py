@@ -16,12 +16,24 @@ import tensorflow as tf
 from nn_skeleton import ModelSkeleton
 
 class SqueezeSeg(ModelSkeleton):
-  def __init__(self, mc, gpu_id=0):
-    with tf.device('/gpu:{}'.format(gpu_id)):
-      ModelSkeleton.__init__(self, mc)
+  def __init__(self, mc, gpu_id=0, device=None, serving=False):
+    """
+    Args:
+      mc: model config
+      gpu_id: gpu of the graph when no device is given
+      device: device of the graph, e.g. '/cpu:0'
+      serving: build only the forward and output graph, fed through
+        lidar_input and lidar_mask with any batch size
+    """
+    if device is None:
+      device = '/gpu:{}'.format(gpu_id)
+    with tf.device(device):
+      ModelSkeleton.__init__(self, mc, serving=serving)
 
       self._add_forward_graph()
       self._add_output_graph()
+      if serving:
+        return
       self._add_loss_graph()
       self._add_train_graph()
       self._add_viz_graph()
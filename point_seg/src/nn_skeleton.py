@@ -61,8 +61,41 @@ def _variable_with_weight_decay(name, shape, wd, initializer, trainable=True):
 
 class ModelSkeleton:
   """Base class of NN detection models."""
-  def __init__(self, mc):
+  def __init__(self, mc, serving=False):
     self.mc = mc
+    # serving builds have no queue, loss, viz or summary graph
+    self.serving = serving
+
+    if serving:
+      self._add_serving_inputs()
+    else:
+      self._add_queue_inputs()
+
+    # model parameters
+    self.model_params = []
+
+    # model size counter
+    self.model_size_counter = [] # array of tuple of layer name, parameter size
+    # flop counter
+    self.flop_counter = [] # array of tuple of layer name, flop number
+    # activation counter
+    self.activation_counter = [] # array of tuple of layer name, output activations
+    self.activation_counter.append(('input', mc.AZIMUTH_LEVEL*mc.ZENITH_LEVEL*3))
+
+  def _add_serving_inputs(self):
+    """Placeholders with a dynamic batch dimension, fed directly."""
+    mc = self.mc
+    self.keep_prob = tf.placeholder_with_default(1.0, [], name='keep_prob')
+    self.lidar_input = tf.placeholder(
+        tf.float32, [None, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 5],
+        name='lidar_input')
+    self.lidar_mask = tf.placeholder(
+        tf.float32, [None, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 1],
+        name='lidar_mask')
+
+  def _add_queue_inputs(self):
+    """Placeholders feeding the prefetch queue the training graph reads."""
+    mc = self.mc
 
     # a scalar tensor in range (0, 1]. Usually set to 0.5 in training phase and
     # 1.0 in evaluation phase
@@ -87,34 +120,105 @@ class ModelSkeleton:
         name='loss_weight')
 
     # define a FIFOqueue for pre-fetching data
-    self.q = tf.FIFOQueue(
-        capacity=mc.QUEUE_CAPACITY,
-        dtypes=[tf.float32, tf.float32, tf.float32, tf.int32, tf.float32],
-        shapes=[[],
-                [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 5],
-                [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 1],
-                [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL],
-                [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL]]
-    )
-    self.enqueue_op = self.q.enqueue(
-        [self.ph_keep_prob, self.ph_lidar_input, self.ph_lidar_mask,
-          self.ph_label, self.ph_loss_weight]
-    )
+    if mc.AUGMENT_IN_GRAPH:
+      # the loss weights follow the augmented labels, ph_loss_weight is unused
+      self.q = tf.FIFOQueue(
+          capacity=mc.QUEUE_CAPACITY,
+          dtypes=[tf.float32, tf.float32, tf.float32, tf.int32],
+          shapes=[[],
+                  [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 5],
+                  [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 1],
+                  [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL]]
+      )
+      self.enqueue_op = self.q.enqueue(
+          [self.ph_keep_prob, self.ph_lidar_input, self.ph_lidar_mask,
+            self.ph_label]
+      )
 
-    self.keep_prob, self.lidar_input, self.lidar_mask, self.label, \
-        self.loss_weight = self.q.dequeue()
+      self.keep_prob, lidar_input, lidar_mask, label = self.q.dequeue()
+      self.lidar_input, self.lidar_mask, self.label = \
+          self._add_augmentation_graph(lidar_input, lidar_mask, label)
+      self.loss_weight = tf.gather(
+          tf.constant(np.append(mc.CLS_LOSS_WEIGHT, 0.0), dtype=tf.float32),
+          tf.where(tf.logical_and(self.label >= 0, self.label < mc.NUM_CLASS),
+                   self.label, tf.fill(tf.shape(self.label), mc.NUM_CLASS)),
+          name='loss_weight_lookup')
+    else:
+      self.q = tf.FIFOQueue(
+          capacity=mc.QUEUE_CAPACITY,
+          dtypes=[tf.float32, tf.float32, tf.float32, tf.int32, tf.float32],
+          shapes=[[],
+                  [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 5],
+                  [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 1],
+                  [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL],
+                  [mc.BATCH_SIZE, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL]]
+      )
+      self.enqueue_op = self.q.enqueue(
+          [self.ph_keep_prob, self.ph_lidar_input, self.ph_lidar_mask,
+            self.ph_label, self.ph_loss_weight]
+      )
 
-    # model parameters
-    self.model_params = []
+      self.keep_prob, self.lidar_input, self.lidar_mask, self.label, \
+          self.loss_weight = self.q.dequeue()
 
-    # model size counter
-    self.model_size_counter = [] # array of tuple of layer name, parameter size
-    # flop counter
-    self.flop_counter = [] # array of tuple of layer name, flop number
-    # activation counter
-    self.activation_counter = [] # array of tuple of layer name, output activations
-    self.activation_counter.append(('input', mc.AZIMUTH_LEVEL*mc.ZENITH_LEVEL*3))
 
+  def _add_augmentation_graph(self, lidar_input, lidar_mask, label):
+    """Random flip, azimuth shift and intensity jitter of a normalized batch.
+
+    Feeding lidar_input, lidar_mask and label directly, as the evaluation does,
+    bypasses the augmentation.
+
+    Args:
+      lidar_input: normalized x, y, z, intensity, range. Shape: batch x height
+        x width x 5.
+      lidar_mask: Shape: batch x height x width x 1.
+      label: Shape: batch x height x width.
+    Returns:
+      The augmented lidar_input, lidar_mask and label.
+    """
+    mc = self.mc
+    mean = np.reshape(mc.INPUT_MEAN, [-1]).astype(np.float32)
+    std = np.reshape(mc.INPUT_STD, [-1]).astype(np.float32)
+    batch_size = mc.BATCH_SIZE
+
+    with tf.variable_scope('augmentation') as scope:
+      if mc.RANDOM_FLIPPING:
+        # flip y, -y normalizes to -y_n - 2 * mean_y / std_y
+        flip = tf.random_uniform([batch_size]) > 0.5
+        sign = tf.constant([1.0, -1.0, 1.0, 1.0, 1.0])
+        offset = tf.constant([0.0, -2.0*mean[1]/std[1], 0.0, 0.0, 0.0])
+        lidar_input = tf.where(
+            flip, tf.reverse(lidar_input, axis=[2])*sign + offset, lidar_input)
+        lidar_mask = tf.where(flip, tf.reverse(lidar_mask, axis=[2]),
+                              lidar_mask)
+        label = tf.where(flip, tf.reverse(label, axis=[2]), label)
+
+      if mc.AZIMUTH_SHIFT > 0:
+        shift = tf.random_uniform(
+            [batch_size], -mc.AZIMUTH_SHIFT, mc.AZIMUTH_SHIFT + 1,
+            dtype=tf.int32)
+        # columns of the rolled images, gathered from the transposed batch
+        columns = tf.mod(
+            tf.range(mc.AZIMUTH_LEVEL)[None, :] - shift[:, None],
+            mc.AZIMUTH_LEVEL)
+        indices = tf.stack(
+            [tf.tile(tf.range(batch_size)[:, None], [1, mc.AZIMUTH_LEVEL]),
+             columns], axis=-1)
+        def roll(x):
+          x_t = tf.transpose(x, [0, 2, 1, 3])
+          return tf.transpose(tf.gather_nd(x_t, indices), [0, 2, 1, 3])
+        lidar_input = roll(lidar_input)
+        lidar_mask = roll(lidar_mask)
+        label = tf.squeeze(roll(label[:, :, :, None]), axis=3)
+
+      if mc.INTENSITY_JITTER > 0:
+        noise = tf.random_normal(
+            [batch_size, mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 1],
+            stddev=mc.INTENSITY_JITTER/std[3])*lidar_mask
+        lidar_input = lidar_input \
+            + tf.pad(noise, [[0, 0], [0, 0], [0, 0], [3, 1]])
+
+    return lidar_input, lidar_mask, label
 
   def _add_forward_graph(self):
     """NN architecture specification."""
@@ -709,12 +813,17 @@ class ModelSkeleton:
           'biases', [filters], bias_init, trainable=(not freeze))
       self.model_params += [kernel, biases]
 
-      # TODO(bichen): fix this
+      # the batch dimension follows the input, so serving builds take any
+      # batch size
       deconv = tf.nn.conv2d_transpose(
-          inputs, kernel, 
-          [mc.BATCH_SIZE, stride_h*in_height, stride_w*in_width, filters],
+          inputs, kernel,
+          tf.stack([tf.shape(inputs)[0], stride_h*in_height, stride_w*in_width,
+                    filters]),
           [1, stride_h, stride_w, 1], padding=padding,
           name='deconv')
+      deconv.set_shape(
+          [inputs.get_shape()[0], stride_h*in_height, stride_w*in_width,
+           filters])
       deconv_bias = tf.nn.bias_add(deconv, biases, name='bias_add')
 
       if relu:
@@ -928,36 +1037,64 @@ class ModelSkeleton:
 
       self.model_params += [bi_compat_kernel, angular_compat_kernel]
 
-      condensing_kernel = tf.constant(
-          util.condensing_matrix(sizes[0], sizes[1], mc.NUM_CLASS),
-          dtype=tf.float32,
-          name='condensing_kernel'
-      )
+      if mc.EFFICIENT_CRF:
+        angular_weights = tf.constant(
+            util.angular_neighbor_weights(
+                sizes[0], sizes[1], mc.NUM_CLASS, mc.ANG_THETA_A**2),
+            dtype=tf.float32,
+            name='angular_weights'
+        )
 
-      angular_filters = tf.constant(
-          util.angular_filter_kernel(
-              sizes[0], sizes[1], mc.NUM_CLASS, mc.ANG_THETA_A**2),
-          dtype=tf.float32,
-          name='angular_kernel'
-      )
+        bi_angular_weights = tf.constant(
+            util.angular_neighbor_weights(
+                sizes[0], sizes[1], mc.NUM_CLASS, mc.BILATERAL_THETA_A**2),
+            dtype=tf.float32,
+            name='bi_angular_weights'
+        )
 
-      bi_angular_filters = tf.constant(
-          util.angular_filter_kernel(
-              sizes[0], sizes[1], mc.NUM_CLASS, mc.BILATERAL_THETA_A**2),
-          dtype=tf.float32,
-          name='bi_angular_kernel'
-      )
+        # the bilateral filter only reaches the valid neighbors, which do not
+        # change over the iterations
+        masked_bilateral_filters = tf.multiply(
+            bilateral_filters, self._neighbor_stack(self.lidar_mask, sizes),
+            name='masked_bilateral_filters')
+      else:
+        condensing_kernel = tf.constant(
+            util.condensing_matrix(sizes[0], sizes[1], mc.NUM_CLASS),
+            dtype=tf.float32,
+            name='condensing_kernel'
+        )
+
+        angular_filters = tf.constant(
+            util.angular_filter_kernel(
+                sizes[0], sizes[1], mc.NUM_CLASS, mc.ANG_THETA_A**2),
+            dtype=tf.float32,
+            name='angular_kernel'
+        )
+
+        bi_angular_filters = tf.constant(
+            util.angular_filter_kernel(
+                sizes[0], sizes[1], mc.NUM_CLASS, mc.BILATERAL_THETA_A**2),
+            dtype=tf.float32,
+            name='bi_angular_kernel'
+        )
 
       for it in range(num_iterations):
         unary = tf.nn.softmax(
             inputs, dim=-1, name='unary_term_at_iter_{}'.format(it))
 
-        ang_output, bi_output = self._locally_connected_layer(
-            'message_passing_iter_{}'.format(it), unary,
-            bilateral_filters, angular_filters, bi_angular_filters,
-            condensing_kernel, sizes=sizes,
-            padding=padding
-        )
+        if mc.EFFICIENT_CRF:
+          ang_output, bi_output = self._neighbor_message_passing(
+              'message_passing_iter_{}'.format(it), unary,
+              masked_bilateral_filters, angular_weights, bi_angular_weights,
+              sizes=sizes, padding=padding
+          )
+        else:
+          ang_output, bi_output = self._locally_connected_layer(
+              'message_passing_iter_{}'.format(it), unary,
+              bilateral_filters, angular_filters, bi_angular_filters,
+              condensing_kernel, sizes=sizes,
+              padding=padding
+          )
 
         # 1x1 convolution as compatibility transform
         ang_output = tf.nn.conv2d(
@@ -1033,7 +1170,7 @@ class ModelSkeleton:
               inputs*self.lidar_mask, condensing_kernel, [1, 1, 1, 1], padding=padding,
               name='condensed_prob_map'
           ),
-          [batch, zenith, azimuth, size_z*size_a-1, in_channel]
+          [-1, zenith, azimuth, size_z*size_a-1, in_channel]
       )
 
       bi_output = tf.multiply(
@@ -1044,6 +1181,74 @@ class ModelSkeleton:
       bi_output *= bi_ang_output
 
     return ang_output, bi_output
+
+  def _neighbor_stack(self, inputs, sizes=[3, 5]):
+    """Neighbors of every position, gathered with shifted slices.
+
+    Args:
+      inputs: input tensor with shape [batch_size, zenith, azimuth, channel].
+      sizes: size of the local region, odd on both dimensions.
+    Returns:
+      neighbors: tensor with shape
+          [batch_size, zenith, azimuth, sizes[0]*sizes[1]-1, channel], zero
+          beyond the borders, ordered as the channels of
+          util.condensing_matrix.
+    """
+    size_z, size_a = sizes
+    pad_z, pad_a = size_z//2, size_a//2
+    _, zenith, azimuth, _ = inputs.shape.as_list()
+
+    padded = tf.pad(inputs, [[0, 0], [pad_z, pad_z], [pad_a, pad_a], [0, 0]])
+    neighbors = [padded[:, z:z+zenith, a:a+azimuth, :]
+                 for z in range(size_z) for a in range(size_a)
+                 if (z, a) != (pad_z, pad_a)]
+    return tf.stack(neighbors, axis=3)
+
+  def _neighbor_message_passing(
+      self, layer_name, inputs, masked_bilateral_filters, angular_weights,
+      bi_angular_weights, sizes=[3, 5], padding='SAME'):
+    """Message passing of _locally_connected_layer on one neighbor stack.
+
+    Args:
+      layer_name: layer name
+      inputs: input tensor with shape
+          [batch_size, zenith, azimuth, num_class].
+      masked_bilateral_filters: bilateral filter weight times the lidar mask
+          of the neighbors, with shape
+          [batch_size, zenith, azimuth, sizes[0]*size[1]-1, num_class].
+      angular_weights: angular filter weight with shape
+          [sizes[0]*sizes[1]-1, num_class].
+      bi_angular_weights: angular filter weight of the bilateral term with
+          shape [sizes[0]*sizes[1]-1, num_class].
+      sizes: size of the local region to be filtered.
+      padding: padding strategy
+    Returns:
+      ang_output: output tensor filtered by anguler filter with shape
+          [batch_size, zenith, azimuth, num_class].
+      bi_output: output tensor filtered by bilateral filter with shape
+          [batch_size, zenith, azimuth, num_class].
+    """
+    assert padding=='SAME', 'only support SAME padding strategy'
+
+    with tf.variable_scope(layer_name) as scope:
+      neighbors = self._neighbor_stack(inputs, sizes)
+
+      ang_output = tf.reduce_sum(
+          neighbors*angular_weights, axis=3, name='angular_filtered_term')
+
+      bi_ang_output = tf.reduce_sum(
+          neighbors*bi_angular_weights, axis=3,
+          name='bi_angular_filtered_term')
+
+      bi_output = tf.multiply(
+          tf.reduce_sum(neighbors*masked_bilateral_filters, axis=3),
+          self.lidar_mask,
+          name='bilateral_filtered_term'
+      )
+      bi_output *= bi_ang_output
+
+    return ang_output, bi_output
+
   def _squee_ori(self,input,mc):
     
     #scale_2 = self._conv_layer('conv2_1', input, filters=48, size=3, stride=2,padding='SAME', freeze=False, xavier=True)
@@ -1649,6 +1854,9 @@ class ModelSkeleton:
 
     # assert in_channel == 1, 'Only support input channel == 1'
 
+    if mc.EFFICIENT_CRF:
+      return self._shared_bilateral_filter(layer_name, inputs, sizes)
+
     with tf.variable_scope(layer_name) as scope:
       condensing_kernel = tf.constant(
           util.condensing_matrix(size_z, size_a, in_channel),
@@ -1666,13 +1874,13 @@ class ModelSkeleton:
       #     - condensed_input[:, :, :, ::in_channel]
 
       diff_x = tf.reshape(
-          inputs[:, :, :, 0], [batch, zenith, azimuth, 1]) \
+          inputs[:, :, :, 0], [-1, zenith, azimuth, 1]) \
               - condensed_input[:, :, :, 0::in_channel]
       diff_y = tf.reshape(
-          inputs[:, :, :, 1], [batch, zenith, azimuth, 1]) \
+          inputs[:, :, :, 1], [-1, zenith, azimuth, 1]) \
               - condensed_input[:, :, :, 1::in_channel]
       diff_z = tf.reshape(
-          inputs[:, :, :, 2], [batch, zenith, azimuth, 1]) \
+          inputs[:, :, :, 2], [-1, zenith, azimuth, 1]) \
               - condensed_input[:, :, :, 2::in_channel]
 
       bi_filters = []
@@ -1689,6 +1897,36 @@ class ModelSkeleton:
 
     return out
 
+  def _shared_bilateral_filter(self, layer_name, inputs, sizes=[3, 5]):
+    """_bilateral_filter_layer on one neighbor stack, the weights are computed
+    once per distinct BILATERAL_THETA_R and shared by the classes using it.
+
+    Args:
+      layer_name: layer name
+      inputs: input tensor with shape [batch_size, zenith, azimuth, 3], the x,
+          y, z of the lidar points.
+      sizes: filter size for zenith and azimuth dimension.
+    Returns:
+      out: bilateral filter weight output with size
+          [batch_size, zenith, azimuth, sizes[0]*sizes[1]-1, num_class].
+    """
+    mc = self.mc
+    thetas_r, class_to_theta = np.unique(
+        mc.BILATERAL_THETA_R, return_inverse=True)
+
+    with tf.variable_scope(layer_name) as scope:
+      neighbors = self._neighbor_stack(inputs[:, :, :, :3], sizes)
+      dist_sq = tf.reduce_sum(
+          tf.square(tf.expand_dims(inputs[:, :, :, :3], 3) - neighbors),
+          axis=4)
+
+      bi_filters = [tf.exp(-dist_sq/2/theta_r**2) for theta_r in thetas_r]
+      out = tf.gather(
+          tf.stack(bi_filters, axis=4), class_to_theta, axis=4,
+          name='bilateral_filter_weights')
+
+    return out
+
   def _activation_summary(self, x, layer_name):
     """Helper to create summaries for activations.
 
@@ -1698,6 +1936,8 @@ class ModelSkeleton:
     Returns:
       nothing
     """
+    if self.serving:
+      return
     with tf.variable_scope('activation_summary') as scope:
       tf.summary.histogram(layer_name, x)
       tf.summary.scalar(layer_name+'/sparsity', tf.nn.zero_fraction(x))
@@ -0,0 +1,67 @@
+"""Layer-wise latency and memory of the SqueezeSeg forward pass"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os.path
+
+import tensorflow as tf
+
+from config import *
+from nets import *
+from utils import layer_profiler
+from utils.util import range_image_batch
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('checkpoint', '',
+                           """Checkpoint to restore, random weights if empty.""")
+tf.app.flags.DEFINE_string(
+    'input_path', '',
+    """Range images (*.npy) to run on, random inputs by default.""")
+tf.app.flags.DEFINE_string('out_dir', '/tmp/bichen/logs/squeezeSeg/profile',
+                           """Directory of layer_profile.txt and """
+                           """timeline.json.""")
+tf.app.flags.DEFINE_integer('batch_size', 1, """Range images per run.""")
+tf.app.flags.DEFINE_integer('runs', 10, """Traced forward passes.""")
+tf.app.flags.DEFINE_string(
+    'device', '', """Device of the graph, e.g. /cpu:0, the gpu by default.""")
+tf.app.flags.DEFINE_string('gpu', '0', """gpu id.""")
+
+
+def main(argv=None):  # pylint: disable=unused-argument
+  os.environ['CUDA_VISIBLE_DEVICES'] = FLAGS.gpu
+  if not tf.gfile.Exists(FLAGS.out_dir):
+    tf.gfile.MakeDirs(FLAGS.out_dir)
+
+  with tf.Graph().as_default():
+    mc = kitti_squeezeSeg_config()
+    mc.LOAD_PRETRAINED_MODEL = False
+    model = SqueezeSeg(mc, device=FLAGS.device or None, serving=True)
+    lidar, lidar_mask = range_image_batch(
+        mc, FLAGS.batch_size, FLAGS.input_path)
+
+    config = tf.ConfigProto(allow_soft_placement=True)
+    with tf.Session(config=config) as sess:
+      if FLAGS.checkpoint:
+        tf.train.Saver(model.model_params).restore(sess, FLAGS.checkpoint)
+      else:
+        sess.run(tf.global_variables_initializer())
+
+      stats, wall_time, run_metadata = layer_profiler.profile_layers(
+          sess, model.pred_cls,
+          {model.lidar_input: lidar, model.lidar_mask: lidar_mask},
+          layer_profiler.layer_names(model), FLAGS.runs)
+
+  profile_path = os.path.join(FLAGS.out_dir, 'layer_profile.txt')
+  trace_path = os.path.join(FLAGS.out_dir, 'timeline.json')
+  print(layer_profiler.write_profile(
+      profile_path, model, stats, wall_time, FLAGS.batch_size))
+  layer_profiler.write_chrome_trace(trace_path, run_metadata)
+  print('Layer profile saved to {}, chrome trace of the last run to {}.'.format(
+      profile_path, trace_path))
+
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,76 @@
+"""Replay range images through the streaming inference core, without ROS"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os.path
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from config import *
+from nets import *
+from utils.streaming import ReplaySource, StreamingInference, squeezeseg_infer
+
+path = os.getcwd()
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string(
+    'checkpoint', path[:-4]+'/log/best_record/model.ckpt-49999',
+    """Path to the model parameter file.""")
+tf.app.flags.DEFINE_string(
+    'input_path', path[:-4]+'/data/samples/*.npy',
+    """Range images (*.npy) replayed in sorted order.""")
+tf.app.flags.DEFINE_float('rate', 10.0, """Frames per second of the source.""")
+tf.app.flags.DEFINE_integer(
+    'max_batch', 2, """Frames kept waiting and run as one batch.""")
+tf.app.flags.DEFINE_boolean('loop', False,
+                            """Replay the frames until duration is over.""")
+tf.app.flags.DEFINE_integer('duration', 60, """Seconds to replay at most.""")
+tf.app.flags.DEFINE_integer(
+    'stats_interval', 10, """Seconds between the latency reports.""")
+tf.app.flags.DEFINE_string(
+    'device', '', """Device of the graph, e.g. /cpu:0, the gpu by default.""")
+tf.app.flags.DEFINE_string('gpu', '0', """gpu id.""")
+
+
+def main(argv=None):  # pylint: disable=unused-argument
+  os.environ['CUDA_VISIBLE_DEVICES'] = FLAGS.gpu
+
+  with tf.Graph().as_default():
+    mc = kitti_squeezeSeg_config()
+    mc.LOAD_PRETRAINED_MODEL = False
+    model = SqueezeSeg(mc, device=FLAGS.device or None, serving=True)
+    saver = tf.train.Saver(model.model_params)
+    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+      saver.restore(sess, FLAGS.checkpoint)
+
+      infer = squeezeseg_infer(sess, model)
+      # warm up, the first run would count as the latency of the first frames
+      infer([np.zeros([mc.ZENITH_LEVEL, mc.AZIMUTH_LEVEL, 5], np.float32)])
+      source = ReplaySource(FLAGS.input_path, FLAGS.rate, loop=FLAGS.loop)
+      stream = StreamingInference(infer, max_batch=FLAGS.max_batch)
+      source.start(stream)
+
+      start_time = time.time()
+      last_report = start_time
+      while time.time() - start_time < FLAGS.duration:
+        source.join(1.0)
+        if time.time() - last_report >= FLAGS.stats_interval:
+          print(stream.stats())
+          last_report = time.time()
+        if not source.is_alive():
+          break
+      source.stop()
+      stream.wait_idle(timeout=10.0)
+      stream.close()
+      print('Replay of {} at {:.1f} frames/sec:'.format(
+          FLAGS.input_path, FLAGS.rate))
+      print(stream.stats())
+
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -15,6 +15,9 @@ import matplotlib.pyplot as plt
 from config import *
 from imdb import  kitti
 from utils.util import *
+from utils.streaming import StreamingInference, squeezeseg_infer
+from utils.postprocess import split_by_class, cluster_summaries
+from utils.ros_publish import cloud_msg, cluster_marker
 from nets import *
 
 import os
@@ -40,14 +43,19 @@ tf.app.flags.DEFINE_string(
 tf.app.flags.DEFINE_string(
         'out_dir', path[:-4]+'/data/samples_out/', """Directory to dump output.""")
 tf.app.flags.DEFINE_string('gpu', '2', """gpu id.""")
+tf.app.flags.DEFINE_string(
+    'device', '', """Device of the graph, e.g. /cpu:0, the gpu by default.""")
+tf.app.flags.DEFINE_integer(
+    'max_batch', 2, """Frames kept waiting and run as one batch.""")
+tf.app.flags.DEFINE_integer(
+    'stats_interval', 10, """Seconds between the latency reports.""")
 
 class Ros_tensor():
     def __init__(self):
         self.input_lidar = None
         self.mc = kitti_squeezeSeg_config()
         self.mc.LOAD_PRETRAINED_MODEL = False
-        self.mc.BATCH_SIZE = 1 # TODO(bichen): fix this hard-coded batch size.
-        self.model = SqueezeSeg(self.mc)
+        self.model = SqueezeSeg(self.mc, device=FLAGS.device or None, serving=True)
         rospy.init_node('rostensorflow')
         rospy.Rate(10)
         self.header = std_msgs.msg.Header()
@@ -59,7 +67,13 @@ class Ros_tensor():
         self._session = tf.Session(config=tf.ConfigProto(allow_soft_placement=True))
         self._saver.restore(self._session, FLAGS.checkpoint)
 
-        self._sub =rospy.Subscriber('/kitti/velo/pointcloud',PointCloud2,self.callback,queue_size=1000)
+        # latest frame wins, the subscriber and the stream keep no backlog
+        self.stream = StreamingInference(
+            squeezeseg_infer(self._session, self.model),
+            preprocess=self.generate_data,
+            postprocess=self.publish_prediction,
+            max_batch=FLAGS.max_batch)
+        self._sub =rospy.Subscriber('/kitti/velo/pointcloud',PointCloud2,self.callback,queue_size=1)
         self.pub = rospy.Publisher('/points_raw',PointCloud2,queue_size=1000)
         self.pub_car =rospy.Publisher("/points_raw1",Marker,queue_size=1000)
         self.pub_per =rospy.Publisher("/points_raw2",Marker,queue_size=1000)
@@ -68,75 +82,17 @@ class Ros_tensor():
         #self.detect()
         
     def callback(self,data):
-        lidar_ros=pc2.read_points(data)
-        points = []
-        for point in lidar_ros:
-            points.append(point)
-        self.input_lidar=self.generate_data(np.array(points))
-
-        #with tf.Graph().as_default():
-          #for f in glob.iglob(FLAGS.input_path):
-            #lidar = np.load(f).astype(np.float32, copy=False)[:, :, :5]
-            #topic kitti/velo/pointcloud
-            
-             
-        print(self.input_lidar.shape)
-        lidar = self.input_lidar
-        start =time.time()
-
-        lidar_mask = np.reshape(
-                (lidar[:, :, 4] > 0),
-                [self.mc.ZENITH_LEVEL, self.mc.AZIMUTH_LEVEL, 1]
-            )
-        lidar_nor = (lidar - self.mc.INPUT_MEAN)/self.mc.INPUT_STD
-      
-        pred_cls = self._session.run(
-                self.model.pred_cls,
-                feed_dict={
-                    self.model.lidar_input:[lidar_nor],
-                    self.model.keep_prob: 1.0,
-                    self.model.lidar_mask:[lidar_mask]
-                }
-            )
-        print('time',time.time()-start)
-    
-            # save the data
-            #print(pred_cls[0].shape)
-            #plt.imshow(pred_cls[0])
-        lidar_xyz = lidar[:,:,:3]
-            #print(lidar_xyz.shape)
-        lidar_raw = lidar_xyz.reshape(-1,3)
-        print (lidar_raw.shape)
-                
-        Mask = pred_cls[0].reshape(-1,1)
-        print(Mask[:,0].shape)
-        id_0 = np.argwhere(Mask[:,0]==1)
-        id_1 = np.argwhere(Mask[:,0]==2)
-        id_2 = np.argwhere(Mask[:,0]==3)
-            
-        car= []
-        for index in id_0:
-              car.append(lidar_raw[index,:])
-        car = np.array(car)
-        self.car = car.reshape(-1,3)
-            
-        pedestrian=[]
-        for index in id_1:
-              pedestrian.append(lidar_raw[index,:])
-        pedestrian = np.array(pedestrian)
-        self.pedestrian = pedestrian.reshape(-1,3)
-            
-        cyc=[]
-        for index in id_2:
-              cyc.append(lidar_raw[index,:])
-        cyc = np.array(cyc)
-        self.cyc = cyc.reshape(-1,3)
-            
-            
+        # only the conversion runs in the subscriber thread, projection,
+        # inference and publishing run in the inference thread of self.stream
+        points = np.array(list(pc2.read_points(data)))
+        self.stream.submit(points)
+
+    def publish_prediction(self,points,lidar,pred_cls):
+        lidar_raw = lidar[:,:,:3].reshape(-1,3)
+        objects = split_by_class(lidar_raw, pred_cls, [1, 2, 3])
+        self.car, self.pedestrian, self.cyc = objects[1], objects[2], objects[3]
         self.publish_pc(lidar_raw,self.car,self.pedestrian,self.cyc)
-            
-            
-        
+
     def generate_data(self,points_ros): 
         start =time.time()
 
@@ -147,89 +103,15 @@ class Ros_tensor():
         return sphere_lidar
 
     def publish_pc(self,pc,car,person,cyc):
-    
-        
-        points = pc2.create_cloud_xyz32(self.header,pc)
-        '''
-        pub2 = rospy.Publisher('/point_seg',PointCloud2,queue_size=10000)
-        header = std_msgs.msg.Header()
-        header.stamp = rospy.Time.now()
-        header.frame_id = 'velody'
-        points2 = pc2.create_cloud_xyz32(header,obj)
-        '''
-        marker_car =self.print_car(self.pub_car,car)    
-        marker_per =self.print_person(self.pub_per,person)    
-        marker_cyc =self.print_cyc(self.pub_cyc,cyc)    
-        self.pub.publish(points)
-        self.pub_car.publish(marker_car)
-        self.pub_per.publish(marker_per)
-        self.pub_cyc.publish(marker_cyc)
-        
-    def print_car(self,pub,points):
-        triplePoints=[]
-        for (x,y,z) in points:
-            p = Point()
-            p.x = x
-            p.y = y
-            p.z = z
-            triplePoints.append(p)
-        marker = Marker()
-        marker.header.frame_id = 'velody'
-        marker.type = marker.POINTS
-        marker.action = marker.ADD
-        marker.pose.orientation.w = 1
-        marker.points = triplePoints
-
-        marker.scale.x = 0.1
-        marker.scale.y = 0.1
-        marker.scale.z = 0.1
-        marker.color.a = 1.0
-        marker.color.r = 1.0
-        return marker
-
-    def print_person(self,pub,points):
-        triplePoints=[]
-        for (x,y,z) in points:
-            p = Point()
-            p.x = x
-            p.y = y
-            p.z = z
-            triplePoints.append(p)
-        marker = Marker()
-        marker.header.frame_id = 'velody'
-        marker.type = marker.POINTS
-        marker.action = marker.ADD
-        marker.pose.orientation.w = 1
-        marker.points = triplePoints
-    
-        marker.scale.x = 0.1
-        marker.scale.y = 0.1
-        marker.scale.z = 0.1
-        marker.color.a = 1.0
-        marker.color.g = 1.0
-        return marker
-    
-    def print_cyc(self,pub,points):
-        triplePoints=[]
-        for (x,y,z) in points:
-            p = Point()
-            p.x = x
-            p.y = y
-            p.z = z
-            triplePoints.append(p)
-        marker = Marker()
-        marker.header.frame_id = 'velody'
-        marker.type = marker.POINTS
-        marker.action = marker.ADD
-        marker.pose.orientation.w = 1
-        marker.points = triplePoints
-    
-        marker.scale.x = 0.1
-        marker.scale.y = 0.1
-        marker.scale.z = 0.1
-        marker.color.a = 1.0
-        marker.color.b = 1.0
-        return marker
+        # one buffer copy for the cloud, one box per cluster for the classes
+        self.pub.publish(cloud_msg(self.header,pc))
+        self.pub_car.publish(cluster_marker(
+            'velody', cluster_summaries(car), (1.0, 0.0, 0.0), 0))
+        self.pub_per.publish(cluster_marker(
+            'velody', cluster_summaries(person), (0.0, 1.0, 0.0), 1))
+        self.pub_cyc.publish(cluster_marker(
+            'velody', cluster_summaries(cyc), (0.0, 0.0, 1.0), 2))
+
     def tansform_data_projection(self,points,num_height,num_width):
         append_zero = np.zeros((points.shape[0],2))
         r = np.sqrt(points[:,0]*points[:,0]+points[:,1]*points[:,1])
@@ -312,8 +194,7 @@ class Ros_tensor():
       with tf.Graph().as_default():
         mc = kitti_squeezeSeg_config()
         mc.LOAD_PRETRAINED_MODEL = False
-        mc.BATCH_SIZE = 1 # TODO(bichen): fix this hard-coded batch size.
-        model = SqueezeSeg(mc)
+        model = SqueezeSeg(mc, device=FLAGS.device or None, serving=True)
 
         saver = tf.train.Saver(model.model_params)
         with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
@@ -350,37 +231,18 @@ class Ros_tensor():
             lidar_raw = lidar_xyz.reshape(-1,3)
             print (lidar_raw.shape)
             
-            Mask = pred_cls[0].reshape(-1,1)
-            print(Mask[:,0].shape)
-            id_0 = np.argwhere(Mask[:,0]==1)
-            id_1 = np.argwhere(Mask[:,0]==2)
-            id_2 = np.argwhere(Mask[:,0]==3)
-        
-            car= []
-            for index in id_0:
-                car.append(lidar_raw[index,:])
-            car = np.array(car)
-            self.car = car.reshape(-1,3)
-        
-            pedestrian=[]
-            for index in id_1:
-                pedestrian.append(lidar_raw[index,:])
-            pedestrian = np.array(pedestrian)
-            self.pedestrian = pedestrian.reshape(-1,3)
-        
-            cyc=[]
-            for index in id_2:
-                cyc.append(lidar_raw[index,:])
-            cyc = np.array(cyc)
-            self.cyc = cyc.reshape(-1,3)
-        
+            objects = split_by_class(lidar_raw, pred_cls[0], [1, 2, 3])
+            self.car, self.pedestrian, self.cyc = objects[1], objects[2], objects[3]
         
             self.publish_pc(lidar_raw,self.car,self.pedestrian,self.cyc)
         
         
             print('time',time.time()-start)
     def main(self):
-        rospy.spin()
+        while not rospy.is_shutdown():
+            time.sleep(FLAGS.stats_interval)
+            print(self.stream.stats())
+        self.stream.close()
 
 if __name__ =='__main__':
    
@@ -19,7 +19,7 @@ import threading
 
 from config import *
 from config.df_squeezeSeg_config import df_squeezeSeg_config
-from imdb import kitti
+from imdb import kitti, kitti_packed, BatchReader
 from utils.util import *
 from nets import *
 
@@ -44,6 +44,9 @@ tf.app.flags.DEFINE_integer('summary_step', 50,
 tf.app.flags.DEFINE_integer('checkpoint_step', 1000,
                             """Number of steps to save summary.""")
 tf.app.flags.DEFINE_string('gpu', '0', """gpu id.""")
+tf.app.flags.DEFINE_boolean('packed', False,
+                            """Read the packed range images of """
+                            """data_conversion/pack_lidar_2d.py.""")
 
 def train():
   """Train SqueezeSeg model"""
@@ -62,7 +65,10 @@ def train():
       mc.PRETRAINED_MODEL_PATH = FLAGS.pretrained_model_path
       model = SqueezeSeg(mc)
 
-    imdb = kitti(FLAGS.image_set, FLAGS.data_path, mc)
+    if FLAGS.packed:
+      imdb = kitti_packed(FLAGS.image_set, FLAGS.data_path, mc)
+    else:
+      imdb = kitti(FLAGS.image_set, FLAGS.data_path, mc)
 
     # save model size, flops, activations by layers
     with open(os.path.join(FLAGS.train_dir, 'model_metrics.txt'), 'w') as f:
@@ -90,20 +96,32 @@ def train():
     print ('Model statistics saved to {}.'.format(
       os.path.join(FLAGS.train_dir, 'model_metrics.txt')))
 
+    # started before the session, forking after it is unsafe
+    reader = BatchReader(imdb, mc.NUM_READER_PROCESS, mc.NUM_READER_BUFFER,
+                         num_thread=mc.NUM_ENQUEUE_THREAD)
+    num_enqueue_thread = mc.NUM_ENQUEUE_THREAD \
+        if mc.NUM_READER_PROCESS == 0 else 1
+    queue_size_op = model.q.size()
+
     def enqueue(sess, coord):
       with coord.stop_on_exception():
         while not coord.should_stop():
           # read batch input
+          batch = reader.get(timeout=1.0)
+          if batch is None:
+            continue
           lidar_per_batch, lidar_mask_per_batch, label_per_batch,\
-              weight_per_batch = imdb.read_batch()
+              weight_per_batch = batch
 
           feed_dict = {
               model.ph_keep_prob: mc.KEEP_PROB,
               model.ph_lidar_input: lidar_per_batch,
               model.ph_lidar_mask: lidar_mask_per_batch,
               model.ph_label: label_per_batch,
-              model.ph_loss_weight: weight_per_batch,
           }
+          # looked up in the graph from the augmented labels otherwise
+          if not mc.AUGMENT_IN_GRAPH:
+            feed_dict[model.ph_loss_weight] = weight_per_batch
 
           sess.run(model.enqueue_op, feed_dict=feed_dict)
 
@@ -121,7 +139,7 @@ def train():
 
     coord = tf.train.Coordinator()
     enq_threads = []
-    for _ in range(mc.NUM_ENQUEUE_THREAD):
+    for _ in range(num_enqueue_thread):
       eqth = threading.Thread(target=enqueue, args=[sess, coord])
       eqth.start()
       enq_threads.append(eqth)
@@ -146,9 +164,9 @@ def train():
           pred_image = visualize_seg(pred_cls[:6, :, :], mc)
 
           # Run evaluation on the batch
-          ious, _, _, _ = evaluate_iou(
-              label_per_batch, pred_cls*np.squeeze(lidar_mask_per_batch),
-              mc.NUM_CLASS)
+          ious = evaluate_iou(
+              label_per_batch, pred_cls, mc.NUM_CLASS,
+              mask=lidar_mask_per_batch)[0]
 
           feed_dict = {}
           # Assume that class-0 is the background class
@@ -195,10 +213,16 @@ def train():
           num_images_per_step = mc.BATCH_SIZE
           images_per_sec = num_images_per_step / duration
           sec_per_batch = float(duration)
+          # reading below compute images/sec with an empty queue is read-bound
+          read_images_per_sec, wait_fraction = reader.stats()
+          queue_size = sess.run(queue_size_op)
           format_str = ('%s: step %d, loss = %.2f (%.1f images/sec; %.3f '
-                        'sec/batch)')
+                        'sec/batch; reading %.1f images/sec, %d queued, '
+                        'enqueue waits %.0f%%)')
           print (format_str % (datetime.now(), step, loss_value,
-                               images_per_sec, sec_per_batch))
+                               images_per_sec, sec_per_batch,
+                               read_images_per_sec, queue_size,
+                               wait_fraction * 100))
           sys.stdout.flush()
 
         # Save the model checkpoint periodically.
@@ -211,6 +235,7 @@ def train():
       coord.request_stop()
       sess.run(model.q.close(cancel_pending_enqueues=True))
       coord.join(enq_threads)
+      reader.close()
 
 
 def main(argv=None):  # pylint: disable=unused-argument
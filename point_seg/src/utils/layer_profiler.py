@@ -0,0 +1,161 @@
+"""Layer-wise latency and memory of ModelSkeleton networks from traced runs."""
+
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+def layer_names(model):
+  """Names of the layers of a ModelSkeleton, in the order of its counters."""
+  names = []
+  for counter in [model.model_size_counter, model.activation_counter,
+                  model.flop_counter]:
+    for name, _ in counter:
+      if name not in names:
+        names.append(name)
+  return names
+
+
+def layer_of(node_name, names):
+  """The layer a node belongs to.
+  Args:
+    node_name: graph node name, e.g. fire2/squeeze1x1/convolution.
+    names: layer names, the scopes the counters of ModelSkeleton use.
+  Returns:
+    the longest layer name the node is scoped under, otherwise the top scope
+    of the node, e.g. recurrent_crf or interpret_output.
+  """
+  node_name = node_name.split(':')[0]
+  best = None
+  for name in names:
+    if node_name == name or node_name.startswith(name+'/'):
+      if best is None or len(name) > len(best):
+        best = name
+  return best if best is not None else node_name.split('/')[0]
+
+
+def _step_node_stats(step_stats):
+  """Node stats of a traced step, kernel times from the gpu streams.
+  Returns:
+    timed: (node_name, micros) of the node executions.
+    allocated: (node_name, bytes) of the outputs the nodes allocated.
+  """
+  devices = [dev_stats.device for dev_stats in step_stats.dev_stats]
+  has_streams = any(device.endswith('/stream:all') for device in devices)
+  timed = []
+  allocated = []
+  for dev_stats in step_stats.dev_stats:
+    device = dev_stats.device.lower()
+    is_stream = '/stream:' in device or '/memcpy' in device
+    # the gpu devices time kernel launches, stream:all the kernels
+    if has_streams:
+      is_timed = device.endswith('/stream:all') or 'gpu' not in device
+    else:
+      is_timed = not is_stream
+    for node_stats in dev_stats.node_stats:
+      if is_timed:
+        timed.append((node_stats.node_name, node_stats.all_end_rel_micros))
+      if not is_stream:
+        for output in node_stats.output:
+          allocated.append(
+              (node_stats.node_name,
+               output.tensor_description.allocation_description
+               .requested_bytes))
+  return timed, allocated
+
+
+def profile_layers(sess, fetches, feed_dict, names, num_runs=10):
+  """Run fetches num_runs times with FULL_TRACE and aggregate by layer.
+  Args:
+    sess: session with the variables initialized or restored.
+    fetches: what to run, e.g. model.pred_cls.
+    feed_dict: feed of every run.
+    names: layer names, see layer_names.
+    num_runs: traced runs, after one warm up run.
+  Returns:
+    stats: dict from layer name to a dict of the mean 'micros' per run, the
+      mean output 'bytes' allocated per run and the 'ops' executed per run.
+    wall_time: mean seconds of a traced run.
+    run_metadata: RunMetadata of the last run.
+  """
+  run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+  sess.run(fetches, feed_dict=feed_dict)
+  stats = {}
+  wall_time = 0.0
+  run_metadata = None
+  for _ in range(num_runs):
+    run_metadata = tf.RunMetadata()
+    start_time = time.time()
+    sess.run(fetches, feed_dict=feed_dict, options=run_options,
+             run_metadata=run_metadata)
+    wall_time += time.time() - start_time
+    timed, allocated = _step_node_stats(run_metadata.step_stats)
+    for node_name, micros in timed:
+      layer = stats.setdefault(layer_of(node_name, names),
+                               {'micros': 0.0, 'bytes': 0.0, 'ops': 0.0})
+      layer['micros'] += micros
+      layer['ops'] += 1
+    for node_name, num_bytes in allocated:
+      layer = stats.setdefault(layer_of(node_name, names),
+                               {'micros': 0.0, 'bytes': 0.0, 'ops': 0.0})
+      layer['bytes'] += num_bytes
+
+  for layer in stats.values():
+    for key in layer:
+      layer[key] /= num_runs
+  return stats, wall_time/num_runs, run_metadata
+
+
+def write_profile(path, model, stats, wall_time, batch_size):
+  """Write the measured time and memory next to the counters of a model.
+  Args:
+    path: text file to write.
+    model: the profiled ModelSkeleton.
+    stats, wall_time: as profile_layers returns.
+    batch_size: range images per run, for the GFLOP/s of the layers.
+  Returns:
+    the table as a string.
+  """
+  params = dict(model.model_size_counter)
+  activations = dict(model.activation_counter)
+  flops = dict(model.flop_counter)
+  names = [name for name in layer_names(model) if name in stats]
+  names += sorted(set(stats) - set(names),
+                  key=lambda name: -stats[name]['micros'])
+  total_micros = max(sum(layer['micros'] for layer in stats.values()), 1e-6)
+
+  lines = ['{:<40} {:>10} {:>12} {:>14} {:>10} {:>7} {:>10} {:>8} {:>6}'
+           .format('layer', 'params', 'activations', 'flops', 'ms', '%',
+                   'MB', 'GFLOP/s', 'ops')]
+  for name in names:
+    layer = stats[name]
+    gflops = flops[name]*batch_size/max(layer['micros'], 1e-6)/1e3 \
+        if name in flops else np.nan
+    lines.append(
+        '{:<40} {:>10} {:>12} {:>14} {:>10.3f} {:>6.1f}% {:>10.2f} {:>8.1f} '
+        '{:>6.0f}'.format(
+            name, params.get(name, ''), activations.get(name, ''),
+            flops.get(name, ''), layer['micros']/1e3,
+            100.0*layer['micros']/total_micros, layer['bytes']/2.0**20,
+            gflops, layer['ops']))
+  lines.append(
+      '{:<40} {:>10} {:>12} {:>14} {:>10.3f} {:>6.1f}% {:>10.2f}'.format(
+          'total', sum(params.values()), sum(activations.values()),
+          sum(flops.values()), total_micros/1e3, 100.0,
+          sum(layer['bytes'] for layer in stats.values())/2.0**20))
+  lines.append('wall time per run: {:.3f}ms, batch size {:d}, traced op time '
+               'sums over the devices and overlapping ops'.format(
+                   wall_time*1e3, batch_size))
+  table = '\n'.join(lines)
+  with open(path, 'w') as f:
+    f.write(table + '\n')
+  return table
+
+
+def write_chrome_trace(path, run_metadata):
+  """Write the trace of a run for chrome://tracing."""
+  trace = timeline.Timeline(run_metadata.step_stats)
+  with open(path, 'w') as f:
+    f.write(trace.generate_chrome_trace_format(show_memory=True))
@@ -0,0 +1,113 @@
+"""Vectorized post-processing of predicted range images for publishing."""
+
+import numpy as np
+
+
+def split_by_class(points, pred_cls, class_ids):
+  """Points of every class, with one sort of the predictions.
+  Args:
+    points: array of shape [N, C], e.g. the x, y, z of the pixels of a range
+        image.
+    pred_cls: predicted class of every point, any shape of N elements.
+    class_ids: classes to return.
+  Returns:
+    dict from class id to the [N_cls, C] array of its points, in pixel order.
+  """
+  labels = np.asarray(pred_cls).reshape(-1)
+  order = np.argsort(labels, kind='mergesort')
+  sorted_labels = labels[order]
+  class_ids = np.asarray(class_ids)
+  starts = np.searchsorted(sorted_labels, class_ids, side='left')
+  ends = np.searchsorted(sorted_labels, class_ids, side='right')
+  return dict((int(cls), points[order[start:end]])
+              for cls, start, end in zip(class_ids, starts, ends))
+
+
+def cluster_summaries(points, cell_size=0.5, min_points=5):
+  """Centroid and axis aligned box of the clusters of a point set.
+
+  Points are binned into cell_size x cell_size cells on the x-y plane and
+  8-connected occupied cells form a cluster. The labels propagate over the
+  occupancy grid with shifted minimums, the points are never looped over.
+
+  Args:
+    points: array of shape [N, 3].
+    cell_size: cell size in meters, points further apart than about one cell
+        are in separate clusters.
+    min_points: clusters with fewer points are left out.
+  Returns:
+    dict of 'centroid', 'bbox_min' and 'bbox_max', arrays of shape [K, 3], and
+    'count', the points of each of the K clusters.
+  """
+  points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+  empty = {'centroid': np.zeros((0, 3), np.float32),
+           'bbox_min': np.zeros((0, 3), np.float32),
+           'bbox_max': np.zeros((0, 3), np.float32),
+           'count': np.zeros(0, np.int64)}
+  if len(points) == 0:
+    return empty
+
+  # occupancy grid with a border of empty cells
+  cells = np.floor(
+      (points[:, :2] - points[:, :2].min(axis=0))/cell_size).astype(np.int64) + 1
+  height, width = cells.max(axis=0) + 2
+  occupied = np.zeros((height, width), dtype=bool)
+  occupied[cells[:, 0], cells[:, 1]] = True
+
+  no_label = height*width
+  labels = np.where(occupied, np.arange(height*width).reshape(height, width),
+                    no_label)
+  while True:
+    padded = np.pad(labels, 1, mode='constant', constant_values=no_label)
+    neighbors = np.min(
+        [padded[1+dz:1+dz+height, 1+da:1+da+width]
+         for dz in (-1, 0, 1) for da in (-1, 0, 1)], axis=0)
+    propagated = np.where(occupied, np.minimum(labels, neighbors), no_label)
+    if np.array_equal(propagated, labels):
+      break
+    labels = propagated
+
+  _, cluster = np.unique(labels[cells[:, 0], cells[:, 1]], return_inverse=True)
+  cluster = cluster.reshape(-1)
+  count = np.bincount(cluster)
+  order = np.argsort(cluster, kind='mergesort')
+  starts = np.concatenate([[0], np.cumsum(count)[:-1]])
+  sorted_points = points[order]
+
+  keep = count >= min_points
+  return {'centroid': (np.add.reduceat(sorted_points, starts, axis=0)
+                       / count[:, None])[keep].astype(np.float32),
+          'bbox_min': np.minimum.reduceat(sorted_points, starts, axis=0)[keep],
+          'bbox_max': np.maximum.reduceat(sorted_points, starts, axis=0)[keep],
+          'count': count[keep]}
+
+
+# corner indices of the 12 edges of a box, corner bits are x, y, z max
+_BOX_EDGES = np.array(
+    [[0, 1], [2, 3], [4, 5], [6, 7],
+     [0, 2], [1, 3], [4, 6], [5, 7],
+     [0, 4], [1, 5], [2, 6], [3, 7]])
+
+
+def box_edges(bbox_min, bbox_max):
+  """Line list of the edges of axis aligned boxes.
+  Args:
+    bbox_min, bbox_max: arrays of shape [K, 3].
+  Returns:
+    array of shape [K*24, 3], the two ends of the 12 edges of every box.
+  """
+  bbox_min = np.asarray(bbox_min).reshape(-1, 1, 3)
+  bbox_max = np.asarray(bbox_max).reshape(-1, 1, 3)
+  bits = (np.arange(8)[:, None] >> np.arange(3)[None, :]) & 1
+  corners = np.where(bits[None, :, :] > 0, bbox_max, bbox_min)
+  return corners[:, _BOX_EDGES.reshape(-1), :].reshape(-1, 3)
+
+
+def cloud_buffer(points):
+  """Packed x, y, z float32 buffer of a point cloud message.
+  Returns:
+    (data, point_step, num_points)
+  """
+  points = np.ascontiguousarray(
+      np.asarray(points)[:, :3], dtype=np.float32)
+  return points.tobytes(), 12, len(points)
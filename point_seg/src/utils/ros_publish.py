@@ -0,0 +1,52 @@
+"""ROS messages of the post-processed predictions, built from numpy buffers."""
+
+from geometry_msgs.msg import Point
+from sensor_msgs.msg import PointCloud2, PointField
+from visualization_msgs.msg import Marker
+
+from utils.postprocess import box_edges, cloud_buffer
+
+
+def cloud_msg(header, points):
+  """PointCloud2 of the x, y, z of points, packed in one buffer copy."""
+  data, point_step, num_points = cloud_buffer(points)
+  msg = PointCloud2()
+  msg.header = header
+  msg.height = 1
+  msg.width = num_points
+  msg.fields = [PointField('x', 0, PointField.FLOAT32, 1),
+                PointField('y', 4, PointField.FLOAT32, 1),
+                PointField('z', 8, PointField.FLOAT32, 1)]
+  msg.is_bigendian = False
+  msg.point_step = point_step
+  msg.row_step = point_step*num_points
+  msg.is_dense = True
+  msg.data = data
+  return msg
+
+
+def cluster_marker(frame_id, summaries, color, marker_id=0):
+  """LINE_LIST marker of the boxes of postprocess.cluster_summaries.
+  Args:
+    frame_id: frame of the marker.
+    summaries: clusters of one class.
+    color: r, g, b in [0, 1].
+    marker_id: id of the marker.
+  Returns:
+    the marker, with 24 points per cluster whatever the points of the class.
+  """
+  marker = Marker()
+  marker.header.frame_id = frame_id
+  marker.id = marker_id
+  marker.type = marker.LINE_LIST
+  marker.action = marker.ADD
+  marker.pose.orientation.w = 1
+  marker.points = [
+      Point(x, y, z) for x, y, z in
+      box_edges(summaries['bbox_min'], summaries['bbox_max']).tolist()]
+
+  # line width
+  marker.scale.x = 0.05
+  marker.color.a = 1.0
+  marker.color.r, marker.color.g, marker.color.b = color
+  return marker
@@ -0,0 +1,251 @@
+"""Streaming inference with latest-frame-wins semantics, independent of ROS."""
+
+import collections
+import glob
+import logging
+import threading
+import time
+
+import numpy as np
+
+STAGES = ['wait', 'preprocess', 'inference', 'postprocess', 'total']
+
+
+class LatencyRecorder(object):
+  """Latencies of the last window frames per stage."""
+
+  def __init__(self, stages=STAGES, window=1000):
+    self._lock = threading.Lock()
+    self._samples = dict(
+        (stage, collections.deque(maxlen=window)) for stage in stages)
+
+  def add(self, stage, seconds):
+    with self._lock:
+      self._samples[stage].append(seconds)
+
+  def percentiles(self, q=(50, 90, 99)):
+    """Milliseconds at the percentiles q of every stage.
+    Returns:
+      dict from stage to a list of len(q) + 1 values, the last one the max,
+      None for stages without samples.
+    """
+    with self._lock:
+      samples = dict((stage, list(values))
+                     for stage, values in self._samples.items())
+    out = {}
+    for stage, values in samples.items():
+      if not values:
+        out[stage] = None
+        continue
+      values = np.array(values)*1000.0
+      out[stage] = list(np.percentile(values, q)) + [values.max()]
+    return out
+
+
+class StreamingInference(object):
+  """Runs the frames a source submits in a separate inference thread.
+
+  submit never blocks: frames wait in a buffer of max_batch slots and when it
+  is full the oldest one is dropped, so the newest frames win and the backlog
+  never grows beyond max_batch. The thread takes every waiting frame at once,
+  so it runs batches of up to max_batch frames when inference falls behind the
+  source and single frames when it keeps up.
+
+  Per frame, in the inference thread:
+    input = preprocess(frame), e.g. the projection of a point cloud
+    outputs = infer([input, ...]), one call per batch
+    postprocess(frame, input, output), e.g. publishing
+  An exception in any of them is logged and counts the batch as failed, its
+  frames as processed, and the thread goes on with the next batch.
+  """
+
+  def __init__(self, infer, preprocess=None, postprocess=None, max_batch=1,
+               window=1000):
+    """
+    Args:
+      infer: function from a list of inputs to a sequence of outputs.
+      preprocess: optional function from a frame to an input.
+      postprocess: optional function of (frame, input, output).
+      max_batch: the largest batch, also the frames kept waiting.
+      window: frames the latency percentiles are computed over.
+    """
+    self._infer = infer
+    self._preprocess = preprocess
+    self._postprocess = postprocess
+    self._max_batch = max_batch
+    self._pending = collections.deque()
+    self._condition = threading.Condition()
+    self._running = True
+    self.latency = LatencyRecorder(window=window)
+    self.counts = {'received': 0, 'dropped': 0, 'processed': 0, 'batches': 0,
+                   'errors': 0}
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def submit(self, frame):
+    """Hand a frame to the inference thread, dropping the oldest waiting one
+    if max_batch frames wait already."""
+    with self._condition:
+      self.counts['received'] += 1
+      if len(self._pending) >= self._max_batch:
+        self._pending.popleft()
+        self.counts['dropped'] += 1
+      self._pending.append((time.time(), frame))
+      self._condition.notify()
+
+  def _take(self):
+    with self._condition:
+      while self._running and not self._pending:
+        self._condition.wait(0.1)
+      batch = list(self._pending)
+      self._pending.clear()
+    return batch
+
+  def _run(self):
+    while self._running:
+      batch = self._take()
+      if not batch:
+        continue
+      failed = False
+      try:
+        self._run_batch(batch)
+      except Exception:
+        # e.g. a failed publish, the stream goes on with the next frames
+        logging.exception('Streaming inference failed on a batch of %d frames',
+                          len(batch))
+        failed = True
+      with self._condition:
+        self.counts['processed'] += len(batch)
+        self.counts['batches'] += 1
+        self.counts['errors'] += int(failed)
+
+  def _run_batch(self, batch):
+    start_time = time.time()
+    for arrival_time, _ in batch:
+      self.latency.add('wait', start_time - arrival_time)
+
+    inputs = []
+    for _, frame in batch:
+      stage_start = time.time()
+      inputs.append(
+          self._preprocess(frame) if self._preprocess is not None else frame)
+      self.latency.add('preprocess', time.time() - stage_start)
+
+    stage_start = time.time()
+    outputs = self._infer(inputs)
+    inference_time = time.time() - stage_start
+
+    for (arrival_time, frame), input_, output in zip(batch, inputs, outputs):
+      self.latency.add('inference', inference_time)
+      stage_start = time.time()
+      if self._postprocess is not None:
+        self._postprocess(frame, input_, output)
+      self.latency.add('postprocess', time.time() - stage_start)
+      self.latency.add('total', time.time() - arrival_time)
+
+  def stats(self):
+    """Counts and latency percentiles as text."""
+    with self._condition:
+      counts = dict(self.counts)
+    lines = ['received: {:d} processed: {:d} dropped: {:d} failed batches: '
+             '{:d} mean batch: {:.2f}'.format(
+                 counts['received'], counts['processed'], counts['dropped'],
+                 counts['errors'],
+                 counts['processed']/max(counts['batches'], 1))]
+    lines.append('{:<12} {:>9} {:>9} {:>9} {:>9}'.format(
+        'stage (ms)', 'p50', 'p90', 'p99', 'max'))
+    percentiles = self.latency.percentiles()
+    for stage in STAGES:
+      if percentiles[stage] is not None:
+        lines.append('{:<12} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            stage, *percentiles[stage]))
+    return '\n'.join(lines)
+
+  def wait_idle(self, timeout=None):
+    """Wait until every submitted frame is processed or dropped.
+    Returns:
+      whether the stream became idle before timeout.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with self._condition:
+      while self.counts['processed'] + self.counts['dropped'] \
+          < self.counts['received']:
+        if deadline is not None and time.time() >= deadline:
+          return False
+        self._condition.wait(0.1)
+    return True
+
+  def close(self):
+    """Stop the inference thread, the waiting frames are dropped."""
+    with self._condition:
+      self._running = False
+      self._condition.notify()
+    self._thread.join()
+
+
+class ReplaySource(object):
+  """Feeds .npy frames to a StreamingInference at a fixed rate, in a thread,
+  as a sensor would: frames are submitted on time whether or not inference
+  keeps up."""
+
+  def __init__(self, input_path, rate, loop=False):
+    """
+    Args:
+      input_path: glob of the .npy frames, replayed in sorted order.
+      rate: frames per second.
+      loop: replay the frames again after the last one.
+    """
+    self._paths = sorted(glob.glob(input_path))
+    assert self._paths, 'No frames at {}'.format(input_path)
+    self._period = 1.0/rate
+    self._loop = loop
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def start(self, stream):
+    self._thread = threading.Thread(target=self._run, args=(stream,))
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _run(self, stream):
+    next_time = time.time()
+    while not self._stopped.is_set():
+      for path in self._paths:
+        if self._stopped.is_set():
+          return
+        frame = np.load(path).astype(np.float32, copy=False)
+        delay = next_time - time.time()
+        if delay > 0:
+          time.sleep(delay)
+        stream.submit(frame)
+        next_time += self._period
+      if not self._loop:
+        return
+
+  def join(self, timeout=None):
+    self._thread.join(timeout)
+
+  def is_alive(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  def stop(self):
+    self._stopped.set()
+    if self._thread is not None:
+      self._thread.join()
+
+
+def squeezeseg_infer(sess, model):
+  """infer function of a SqueezeSeg serving build, from range images
+  (x, y, z, intensity, range) to the predicted class of every pixel."""
+  mc = model.mc
+
+  def infer(lidars):
+    lidar = np.array([l[:, :, :5] for l in lidars], dtype=np.float32)
+    lidar_mask = (lidar[:, :, :, 4:5] > 0).astype(np.float32)
+    lidar = (lidar - mc.INPUT_MEAN)/mc.INPUT_STD
+    return sess.run(
+        model.pred_cls,
+        feed_dict={model.lidar_input: lidar, model.lidar_mask: lidar_mask})
+
+  return infer
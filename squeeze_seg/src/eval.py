@@ -66,10 +66,8 @@ def eval_once(
 
     tot_error_rate, tot_rmse, tot_th_correct = 0.0, 0.0, 0.0
 
-    # class-level metrics
-    tp_sum = np.zeros(mc.NUM_CLASS)
-    fn_sum = np.zeros(mc.NUM_CLASS)
-    fp_sum = np.zeros(mc.NUM_CLASS)
+    # class-level metrics, rows are labels and columns predictions
+    confusion = np.zeros((mc.NUM_CLASS, mc.NUM_CLASS), dtype=np.int64)
     # instance-level metrics
     itp_sum = np.zeros(mc.NUM_CLASS)
     ifn_sum = np.zeros(mc.NUM_CLASS)
@@ -100,17 +98,12 @@ def eval_once(
 
       _t['eval'].tic()
       # Evaluation
-      iou, tps, fps, fns = evaluate_iou(
+      confusion += confusion_matrix(
           label_per_batch[:mc.BATCH_SIZE-offset],
-          pred_cls[:mc.BATCH_SIZE-offset] \
-          * np.squeeze(lidar_mask_per_batch[:mc.BATCH_SIZE-offset]),
-          mc.NUM_CLASS
+          pred_cls[:mc.BATCH_SIZE-offset], mc.NUM_CLASS,
+          mask=lidar_mask_per_batch[:mc.BATCH_SIZE-offset]
       )
 
-      tp_sum += tps
-      fn_sum += fns
-      fp_sum += fps
-
       _t['eval'].toc()
 
       print ('detect: {:d}/{:d} im_read: {:.3f}s '
@@ -120,9 +113,7 @@ def eval_once(
                 _t['detect'].average_time/mc.BATCH_SIZE,
                 _t['eval'].average_time/mc.BATCH_SIZE))
 
-    ious = tp_sum.astype(np.float)/(tp_sum + fn_sum + fp_sum + mc.DENOM_EPSILON)
-    pr = tp_sum.astype(np.float)/(tp_sum + fp_sum + mc.DENOM_EPSILON)
-    re = tp_sum.astype(np.float)/(tp_sum + fn_sum + mc.DENOM_EPSILON)
+    ious, _, _, _, pr, re = confusion_metrics(confusion, mc.DENOM_EPSILON)
 
     print ('Evaluation summary:')
     print ('  Timing:')
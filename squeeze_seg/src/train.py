@@ -142,9 +142,9 @@ def train():
           pred_image = visualize_seg(pred_cls[:6, :, :], mc)
 
           # Run evaluation on the batch
-          ious, _, _, _ = evaluate_iou(
-              label_per_batch, pred_cls*np.squeeze(lidar_mask_per_batch),
-              mc.NUM_CLASS)
+          ious = evaluate_iou(
+              label_per_batch, pred_cls, mc.NUM_CLASS,
+              mask=lidar_mask_per_batch)[0]
 
           feed_dict = {}
           # Assume that class-0 is the background class
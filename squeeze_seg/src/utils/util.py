@@ -59,7 +59,69 @@ def rel_accuracy_at_thresh_fn(pred_ogm, gt_ogm, mask, thresh):
               np.minimum(gt_ogm, pred_ogm) < thresh)
       )/float(np.sum(mask))
   
-def evaluate_iou(label, pred, n_class, epsilon=1e-12):
+def confusion_matrix(label, pred, n_class, mask=None, ignore_label=None,
+                     weights=None):
+  """Pixel level confusion matrix of a batch, in one bincount.
+
+  Args:
+    label: N-d array of shape [batch, W, H], where each element is a class
+        index.
+    pred: N-d array of shape [batch, W, H], the each element is the predicted
+        class index.
+    n_class: number of classes, labels and predictions out of [0, n_class) are
+        left out.
+    mask: optional array of the label shape, or with a trailing dimension of 1
+        as lidar_mask, only pixels where it is nonzero count.
+    ignore_label: optional class index or list of class indices left out.
+    weights: optional per pixel weights of the label shape.
+
+  Returns:
+    confusion: array of shape [n_class, n_class], rows are labels and
+        columns predictions, int64 counts or float64 weight sums with weights.
+  """
+
+  assert label.shape == pred.shape, \
+      'label and pred shape mismatch: {} vs {}'.format(
+          label.shape, pred.shape)
+
+  label = np.asarray(label).reshape(-1).astype(np.int64)
+  pred = np.asarray(pred).reshape(-1).astype(np.int64)
+  valid = (label >= 0) & (label < n_class) & (pred >= 0) & (pred < n_class)
+  if mask is not None:
+    valid &= np.asarray(mask).reshape(-1) > 0
+  if ignore_label is not None:
+    valid &= ~np.in1d(label, ignore_label)
+  if weights is not None:
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1)[valid]
+
+  return np.bincount(
+      label[valid]*n_class + pred[valid], weights=weights,
+      minlength=n_class*n_class
+  ).reshape(n_class, n_class)
+
+def confusion_metrics(confusion, epsilon=1e-12):
+  """Per class metrics of a confusion matrix.
+
+  Args:
+    confusion: array of shape [n_class, n_class], rows are labels and columns
+        predictions, e.g. the sum of confusion_matrix over batches.
+    epsilon: a small value to prevent division by 0
+
+  Returns:
+    ious, tps, fps, fns, precision, recall, as evaluate_iou.
+  """
+  tps = np.diag(confusion).astype(np.float64)
+  fps = confusion.sum(axis=0) - tps
+  fns = confusion.sum(axis=1) - tps
+
+  ious = tps/(tps+fns+fps+epsilon)
+  precision = tps/(tps+fps+epsilon)
+  recall = tps/(tps+fns+epsilon)
+
+  return ious, tps, fps, fns, precision, recall
+
+def evaluate_iou(label, pred, n_class, epsilon=1e-12, mask=None,
+                 ignore_label=None, weights=None):
   """Evaluation script to compute pixel level IoU.
 
   Args:
@@ -69,6 +131,10 @@ def evaluate_iou(label, pred, n_class, epsilon=1e-12):
         class index.
     n_class: number of classes
     epsilon: a small value to prevent division by 0
+    mask: optional array of the label shape, only pixels where it is nonzero
+        count, see confusion_matrix.
+    ignore_label: optional class index or list of class indices left out.
+    weights: optional per pixel weights of the label shape.
 
   Returns:
     IoU: array of lengh n_class, where each element is the average IoU for this
@@ -79,28 +145,13 @@ def evaluate_iou(label, pred, n_class, epsilon=1e-12):
         class.
     fns: same shape as IoU, where each element is the number of FN for each
         class.
+    precision: same shape as IoU, the precision of each class.
+    recall: same shape as IoU, the recall of each class.
   """
 
-  assert label.shape == pred.shape, \
-      'label and pred shape mismatch: {} vs {}'.format(
-          label.shape, pred.shape)
-
-  ious = np.zeros(n_class)
-  tps = np.zeros(n_class)
-  fns = np.zeros(n_class)
-  fps = np.zeros(n_class)
-
-  for cls_id in range(n_class):
-    tp = np.sum(pred[label == cls_id] == cls_id)
-    fp = np.sum(label[pred == cls_id] != cls_id)
-    fn = np.sum(pred[label == cls_id] != cls_id)
-
-    ious[cls_id] = tp/(tp+fn+fp+epsilon)
-    tps[cls_id] = tp
-    fps[cls_id] = fp
-    fns[cls_id] = fn
-
-  return ious, tps, fps, fns
+  return confusion_metrics(
+      confusion_matrix(label, pred, n_class, mask, ignore_label, weights),
+      epsilon)
 
 def condensing_matrix(size_z, size_a, in_channel):
   assert size_z % 2 == 1 and size_a % 2==1, \